@@ -0,0 +1,64 @@
+import random
+import sys
+import time
+
+from benchmarks.report import write_results
+from src.backend_server import BackendServer
+from src.load_balancer import ALGORITHMS
+
+# Pick-cost micro-benchmark for the balancers.
+# Usage: python3 -m benchmarks.bench_balancers [backends] [max_weight] [picks] [--json FILE]
+
+BALANCERS = sorted(ALGORITHMS.items())
+
+
+def make_servers(count, max_weight, seed=42):
+    rng = random.Random(seed)
+    return [BackendServer(i + 1, "10.0.0.1", 10000 + i, "tcp", rng.randint(1, max_weight)) for i in range(count)]
+
+
+def bench_balancer(balancer_class, servers, picks):
+    lb = balancer_class()
+    for server in servers:
+        lb.add_server(server)
+
+    started = time.perf_counter()
+    lb.get_next_server() # The first pick pays for any lazily built schedule
+    build_seconds = time.perf_counter() - started
+
+    get_next_server = lb.get_next_server
+    started = time.perf_counter()
+    for _ in range(picks):
+        get_next_server()
+    pick_seconds = time.perf_counter() - started
+    return {
+        "build_ms": build_seconds * 1000,
+        "pick_ns": pick_seconds / picks * 1e9,
+        "picks_per_sec": picks / pick_seconds,
+    }
+
+
+def main(argv):
+    json_path = None
+    if "--json" in argv:
+        index = argv.index("--json")
+        json_path = argv[index + 1]
+        argv = argv[:index] + argv[index + 2:]
+    count = int(argv[1]) if len(argv) > 1 else 1000
+    max_weight = int(argv[2]) if len(argv) > 2 else 1000
+    picks = int(argv[3]) if len(argv) > 3 else 200000
+    servers = make_servers(count, max_weight)
+    results = {}
+    for name, balancer_class in BALANCERS:
+        results[name] = bench_balancer(balancer_class, servers, picks)
+    if json_path != "-":
+        print(f"{count} backends, weights 1..{max_weight}, {picks} picks")
+        print(f"{'algorithm':<30}{'build (ms)':>12}{'pick (ns)':>12}{'picks/sec':>14}")
+        for name, result in results.items():
+            print(f"{name:<30}{result['build_ms']:>12.1f}{result['pick_ns']:>12.0f}{result['picks_per_sec']:>14.0f}")
+    if json_path:
+        write_results(json_path, "balancers", {"backends": count, "max_weight": max_weight, "picks": picks}, results)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
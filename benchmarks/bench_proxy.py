@@ -0,0 +1,297 @@
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+
+from benchmarks.report import fairness, latency_summary, percentile, write_results
+from src.backend_server import StandInBackend
+from src.http_parser import HttpParseError, HttpParser
+from src.load_balancer import ALGORITHMS
+from src.metrics import backend_label
+from src.proxy_server import ENGINES, HTTP_MODES, ProxyServer
+
+# End-to-end benchmark of the proxy data plane: starts stand-in backends and a
+# ProxyServer in a child process, drives it with concurrent clients from this one (so
+# the load generator does not share the proxy's GIL), and reports throughput, latency
+# percentiles, connection-setup cost and how evenly the backends were loaded.
+# Usage: python3 -m benchmarks.bench_proxy [--concurrency N] [--duration S] [--json FILE] ...
+#        python3 -m benchmarks.bench_proxy --help
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python3 -m benchmarks.bench_proxy", description="Benchmark the proxy with local stand-in backends.")
+    parser.add_argument("--backends", type=int, default=4, help="stand-in backends to start (default: 4)")
+    parser.add_argument("--weights", default=None, help="comma-separated backend weights, e.g. 1,1,2,4 (default: all 1)")
+    parser.add_argument("--mode", choices=StandInBackend.MODES, default="http", help="backend protocol (default: http)")
+    parser.add_argument("--algorithm", choices=sorted(ALGORITHMS), default="round_robin")
+    parser.add_argument("--engine", choices=ENGINES, default="threaded")
+    parser.add_argument("--http-mode", choices=HTTP_MODES, default="connection", help="proxy.http_mode (default: connection)")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent client connections (default: 16)")
+    parser.add_argument("--processes", type=int, default=1, help="load generator processes sharing the clients (default: 1)")
+    parser.add_argument("--duration", type=float, default=5.0, help="measured seconds (default: 5)")
+    parser.add_argument("--warmup", type=float, default=1.0, help="unmeasured seconds before that (default: 1)")
+    parser.add_argument("--requests-per-connection", type=int, default=100,
+                        help="requests (echo: round trips) per client connection; 1 measures connection setup (default: 100)")
+    parser.add_argument("--payload", type=int, default=64, help="request body / echo payload bytes (default: 64)")
+    parser.add_argument("--response-size", type=int, default=64, help="HTTP response body bytes (default: 64)")
+    parser.add_argument("--json", metavar="FILE", help="also write the results as JSON ('-' for stdout only)")
+    options = parser.parse_args(argv)
+    if options.weights:
+        options.weights = [int(weight) for weight in options.weights.split(",")]
+        if len(options.weights) != options.backends:
+            parser.error("--weights needs one weight per backend")
+    else:
+        options.weights = [1] * options.backends
+    if options.mode == "echo":
+        options.payload = max(options.payload, 1)
+    return options
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# Server side (child process)
+
+def serve(conn, options):
+    # Runs the backends and the proxy until told to stop; answers "stats" with the
+    # per-backend counts (requests for http, connections for echo)
+    sys.stdout = open(os.devnull, "w") # ProxyServer's start/stop messages would mix with the report
+    backends = [StandInBackend(options.mode, response_size=options.response_size).start() for _ in range(options.backends)]
+    servers = [backend.as_server(i + 1, weight) for i, (backend, weight) in enumerate(zip(backends, options.weights))]
+    load_balancer = ALGORITHMS[options.algorithm]()
+    for server in servers:
+        load_balancer.add_server(server)
+    proxy = ProxyServer("127.0.0.1", _free_port(), load_balancer, servers, engine=options.engine,
+                        http_mode=options.http_mode, backlog=4096)
+    thread = threading.Thread(target=proxy.start, daemon=True)
+    thread.start()
+    deadline = time.time() + 5
+    while not proxy.running and time.time() < deadline:
+        time.sleep(0.01)
+    conn.send(("ready", proxy.port, [backend_label(server) for server in servers]))
+
+    while True:
+        command = conn.recv()
+        if command == "stats":
+            conn.send([backend.requests if options.mode == "http" else backend.connections for backend in backends])
+        elif command == "stop":
+            proxy.stop()
+            thread.join(5)
+            for backend in backends:
+                backend.stop()
+            conn.send("stopped")
+            return
+
+
+# Load generator
+
+class ClientStats:
+    def __init__(self):
+        self.latencies = [] # Seconds per request (echo: per round trip)
+        self.first_latencies = [] # The first request on each connection, which pays for the backend connect
+        self.connect_times = [] # Seconds for the TCP connect to the proxy
+        self.errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def merge(self, other):
+        self.latencies.extend(other.latencies)
+        self.first_latencies.extend(other.first_latencies)
+        self.connect_times.extend(other.connect_times)
+        self.errors += other.errors
+        self.bytes_sent += other.bytes_sent
+        self.bytes_received += other.bytes_received
+
+
+def _http_request(options):
+    if options.payload:
+        head = f"POST / HTTP/1.1\r\nHost: bench\r\nContent-Length: {options.payload}\r\n\r\n".encode()
+        return head + b"x" * options.payload, "POST"
+    return b"GET / HTTP/1.1\r\nHost: bench\r\n\r\n", "GET"
+
+
+def _http_exchange(sock, parser, request, method):
+    sock.sendall(request)
+    parser.expect_response(method)
+    received = 0
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            raise ConnectionError("proxy closed the connection")
+        received += len(data)
+        for kind, _ in parser.feed(data):
+            if kind == "end":
+                return received
+
+
+def _echo_exchange(sock, request):
+    sock.sendall(request)
+    received = 0
+    while received < len(request):
+        data = sock.recv(65536)
+        if not data:
+            raise ConnectionError("proxy closed the connection")
+        received += len(data)
+    return received
+
+
+def _client(port, options, measure_from, deadline, stats):
+    if options.mode == "http":
+        request, method = _http_request(options)
+    else:
+        request, method = b"x" * options.payload, None
+    clock = time.perf_counter
+    while time.time() < deadline:
+        measuring = time.time() >= measure_from
+        started = clock()
+        try:
+            sock = socket.create_connection(("127.0.0.1", port))
+        except OSError:
+            if measuring:
+                stats.errors += 1
+            time.sleep(0.01)
+            continue
+        connect_time = clock() - started
+        with sock:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            parser = HttpParser(is_response=True)
+            for n in range(options.requests_per_connection):
+                now = time.time()
+                if now >= deadline:
+                    break
+                if not measuring and now >= measure_from: # Warm-up ended mid-connection: measure from here on
+                    measuring = True
+                started = clock()
+                try:
+                    if method:
+                        received = _http_exchange(sock, parser, request, method)
+                    else:
+                        received = _echo_exchange(sock, request)
+                except (OSError, HttpParseError):
+                    if measuring:
+                        stats.errors += 1
+                    break
+                elapsed = clock() - started
+                if measuring:
+                    stats.latencies.append(elapsed)
+                    stats.bytes_sent += len(request)
+                    stats.bytes_received += received
+                    if n == 0:
+                        stats.first_latencies.append(elapsed)
+                        stats.connect_times.append(connect_time)
+
+
+def generate_load(port, options, clients, measure_from, deadline):
+    # Runs `clients` client threads in this process and returns their merged ClientStats
+    stats = [ClientStats() for _ in range(clients)]
+    threads = [threading.Thread(target=_client, args=(port, options, measure_from, deadline, client_stats))
+               for client_stats in stats]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total = ClientStats()
+    for client_stats in stats:
+        total.merge(client_stats)
+    return total
+
+
+def _split(total, parts):
+    return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
+
+
+def run(options):
+    parent, child = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve, args=(child, options), daemon=True)
+    server.start()
+    try:
+        _, port, labels = parent.recv()
+        measure_from = time.time() + options.warmup
+        deadline = measure_from + options.duration
+        if options.warmup:
+            # Snapshot the backend counts when the measured window starts
+            threading.Timer(options.warmup, lambda: parent.send("stats")).start()
+        processes = max(1, min(options.processes, options.concurrency))
+        shares = [share for share in _split(options.concurrency, processes) if share]
+        if processes == 1:
+            stats = generate_load(port, options, options.concurrency, measure_from, deadline)
+        else:
+            with multiprocessing.Pool(processes) as pool:
+                results = pool.starmap(generate_load, [(port, options, share, measure_from, deadline) for share in shares])
+            stats = ClientStats()
+            for result in results:
+                stats.merge(result)
+        before = parent.recv() if options.warmup else [0] * options.backends
+        parent.send("stats")
+        after = parent.recv()
+        parent.send("stop")
+        parent.recv()
+    finally:
+        server.join(5)
+        if server.is_alive():
+            server.terminate()
+    counts = [end - start for start, end in zip(before, after)]
+    return summarize(options, stats, dict(zip(labels, counts)))
+
+
+def summarize(options, stats, backend_counts):
+    connects = sorted(stats.connect_times)
+    first = sorted(stats.first_latencies)
+    counts = list(backend_counts.values())
+    total = sum(counts)
+    weight_total = sum(options.weights)
+    return {
+        "requests": len(stats.latencies),
+        "errors": stats.errors,
+        "requests_per_sec": len(stats.latencies) / options.duration,
+        "bytes_per_sec": (stats.bytes_sent + stats.bytes_received) / options.duration,
+        "latency": latency_summary(stats.latencies),
+        "connection_setup": {
+            "connections": len(connects),
+            "connect_p50_ms": percentile(connects, 0.50) * 1000,
+            "connect_p99_ms": percentile(connects, 0.99) * 1000,
+            "first_request_p50_ms": percentile(first, 0.50) * 1000,
+            "first_request_p99_ms": percentile(first, 0.99) * 1000,
+        },
+        "backends": backend_counts,
+        "fairness": fairness(counts, options.weights),
+        # Largest gap between a backend's share of the load and its share of the weights
+        "max_share_deviation": max(abs(count / total - weight / weight_total)
+                                   for count, weight in zip(counts, options.weights)) if total else 0.0,
+    }
+
+
+def print_results(options, results):
+    latency = results["latency"]
+    setup = results["connection_setup"]
+    print(f"{options.backends} {options.mode} backends, {options.algorithm}, {options.engine} engine, "
+          f"http_mode={options.http_mode}, {options.concurrency} clients, {options.duration:g}s")
+    print(f"  requests        {results['requests']} ({results['errors']} errors)")
+    print(f"  throughput      {results['requests_per_sec']:.0f} req/s, {results['bytes_per_sec'] / 1e6:.2f} MB/s")
+    print(f"  latency (ms)    p50 {latency['p50_ms']:.3f}  p99 {latency['p99_ms']:.3f}  "
+          f"p99.9 {latency['p999_ms']:.3f}  max {latency['max_ms']:.3f}")
+    print(f"  connect (ms)    p50 {setup['connect_p50_ms']:.3f}  p99 {setup['connect_p99_ms']:.3f}  "
+          f"first request p50 {setup['first_request_p50_ms']:.3f}  ({setup['connections']} connections)")
+    print(f"  distribution    fairness {results['fairness']:.4f}, max share deviation {results['max_share_deviation']:.2%}")
+    for label, count in results["backends"].items():
+        print(f"    {label:<24}{count:>10}")
+
+
+def main(argv):
+    options = parse_args(argv[1:])
+    results = run(options)
+    if options.json != "-":
+        print_results(options, results)
+    if options.json:
+        config = {key: value for key, value in vars(options).items() if key != "json"}
+        write_results(options.json, "proxy", config, results)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
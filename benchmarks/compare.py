@@ -0,0 +1,80 @@
+import json
+import sys
+
+# Compares two benchmark result files (--json output of bench_proxy or bench_balancers)
+# and exits with status 1 when a metric got worse by more than the threshold.
+# Usage: python3 -m benchmarks.compare baseline.json current.json [threshold_percent]
+
+# Metric name suffix -> True when higher is better. Metrics matching none (counts,
+# per-backend distribution) are informational and never fail the comparison.
+DIRECTIONS = (
+    ("per_sec", True),
+    ("fairness", True),
+    ("_ms", False),
+    ("_ns", False),
+    ("errors", False),
+    ("max_share_deviation", False),
+)
+
+
+def flatten(results, prefix=""):
+    metrics = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            if key != "backends": # Backend addresses differ between runs
+                metrics.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)):
+            metrics[name] = value
+    return metrics
+
+
+def higher_is_better(name):
+    for suffix, higher in DIRECTIONS:
+        if name.endswith(suffix):
+            return higher
+    return None
+
+
+def compare(baseline, current, threshold):
+    # Returns [(metric, baseline value, current value, change, regressed)] for the metrics both runs have
+    old = flatten(baseline["results"])
+    new = flatten(current["results"])
+    rows = []
+    for name in sorted(old.keys() & new.keys()):
+        higher = higher_is_better(name)
+        if higher is None:
+            continue
+        before, after = old[name], new[name]
+        if before:
+            change = (after - before) / abs(before)
+        else:
+            change = 0.0 if not after else float("inf")
+        worse = -change if higher else change
+        rows.append((name, before, after, change, worse > threshold))
+    return rows
+
+
+def main(argv):
+    if len(argv) < 3:
+        print("Usage: python3 -m benchmarks.compare baseline.json current.json [threshold_percent]")
+        return 2
+    with open(argv[1]) as f:
+        baseline = json.load(f)
+    with open(argv[2]) as f:
+        current = json.load(f)
+    if baseline.get("benchmark") != current.get("benchmark"):
+        print(f"Cannot compare a '{baseline.get('benchmark')}' result with a '{current.get('benchmark')}' one.")
+        return 2
+    threshold = float(argv[3]) / 100 if len(argv) > 3 else 0.10
+    rows = compare(baseline, current, threshold)
+    print(f"{'metric':<48}{'baseline':>14}{'current':>14}{'change':>10}")
+    for name, before, after, change, regressed in rows:
+        print(f"{name:<48}{before:>14.3f}{after:>14.3f}{change:>+10.1%}{'  REGRESSION' if regressed else ''}")
+    regressions = sum(1 for row in rows if row[-1])
+    print(f"{regressions} regression(s) beyond {threshold:.0%}.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,56 @@
+import json
+import math
+import platform
+import sys
+import time
+
+# Shared helpers for the benchmarks: percentiles, fairness and the JSON result files
+# that benchmarks.compare checks for regressions.
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an already sorted list; 0.0 when it is empty
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(fraction * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def latency_summary(latencies):
+    # Seconds in, milliseconds out
+    values = sorted(latencies)
+    return {
+        "mean_ms": sum(values) / len(values) * 1000 if values else 0.0,
+        "p50_ms": percentile(values, 0.50) * 1000,
+        "p99_ms": percentile(values, 0.99) * 1000,
+        "p999_ms": percentile(values, 0.999) * 1000,
+        "max_ms": values[-1] * 1000 if values else 0.0,
+    }
+
+
+def fairness(counts, weights):
+    # Jain's fairness index of the weight-normalised shares: 1.0 when every backend got
+    # exactly its weighted share, 1/n when a single backend got everything.
+    shares = [count / weight for count, weight in zip(counts, weights)]
+    total = sum(shares)
+    if not total:
+        return 0.0
+    return total * total / (len(shares) * sum(share * share for share in shares))
+
+
+def write_results(path, benchmark, config, results):
+    document = {
+        "benchmark": benchmark,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "results": results,
+    }
+    if path == "-":
+        json.dump(document, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(path, "w") as f:
+            json.dump(document, f, indent=2)
+            f.write("\n")
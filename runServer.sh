@@ -24,6 +24,15 @@ stop() {
     PID=$(cat "$PID_FILE")
     echo "Stopping magicLB (PID: $PID)..."
     kill "$PID" 2>/dev/null # Suppress error if process is already gone
+    # Open connections get proxy.shutdown_timeout (30s by default) to finish
+    for _ in $(seq 60); do
+        kill -0 "$PID" 2>/dev/null || break
+        sleep 1
+    done
+    if kill -0 "$PID" 2>/dev/null; then
+        echo "magicLB did not exit in time; killing it."
+        kill -9 "$PID" 2>/dev/null
+    fi
     rm "$PID_FILE"
     echo "magicLB stopped."
 }
@@ -33,6 +42,27 @@ launch_dialog() {
     python3 -m src.main dialog_mode
 }
 
+reload() {
+    if [ ! -f "$PID_FILE" ]; then
+        echo "magicLB is not running (PID file not found)."
+        return 1
+    fi
+
+    PID=$(cat "$PID_FILE")
+    echo "Reloading magicLB configuration (PID: $PID)..."
+    kill -HUP "$PID"
+}
+
+status() {
+    # JSON for monitoring; exits 1 if the service is down or a backend is unreachable
+    python3 -m src.main status "$@"
+}
+
+top() {
+    # Live per-backend load of the running service, read from its shared stats file
+    python3 -m src.main top "$@"
+}
+
 restart() {
     stop
     start
@@ -51,8 +81,19 @@ case "$1" in
     restart)
         restart
         ;;
+    reload)
+        reload
+        ;;
+    status)
+        shift
+        status "$@"
+        ;;
+    top)
+        shift
+        top "$@"
+        ;;
     *)
-        echo "Usage: $0 {start|stop|launch_dialog|restart}"
+        echo "Usage: $0 {start|stop|launch_dialog|restart|reload|status|top}"
         exit 1
         ;;
 esac
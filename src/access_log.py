@@ -0,0 +1,112 @@
+import collections
+import json
+import os
+import random
+import threading
+import time
+
+from src.metrics import Counter
+
+# Access log for server mode: one JSON line per client connection. The relay path only
+# appends a tuple to a bounded deque (atomic, no lock, no I/O); a background thread
+# formats queued records and writes them in batches, rotating the file by size. When
+# the queue is full, records are dropped and counted rather than making clients wait.
+
+FIELDS = ("time", "client", "backend", "outcome", "duration", "bytes_in", "bytes_out", "requests")
+
+
+class AccessLog:
+    def __init__(self, path, max_queue=10000, batch_size=256, flush_interval=0.5,
+                 sample_rate=1.0, max_bytes=100 * 1024 * 1024, backup_count=5):
+        self.path = path
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sample_rate = sample_rate # Share of successful connections logged; errors are always logged
+        self.max_bytes = max_bytes # Rotate once the file reaches this size; None = never
+        self.backup_count = backup_count # Rotated files kept as path.1 ... path.N
+        self.dropped = Counter("magiclb_access_log_dropped_total", "Access log records dropped because the queue was full.")
+        self._queue = collections.deque()
+        self._file = None
+        self._size = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def log(self, client, backend, outcome, duration, bytes_in=0, bytes_out=0, requests=0):
+        # Called on the relay path: must never block
+        if outcome == "ok" and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        if len(self._queue) >= self.max_queue:
+            self.dropped.inc()
+            return
+        self._queue.append((time.time(), client, backend, outcome, duration, bytes_in, bytes_out, requests))
+
+    def start(self):
+        self._open()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="access-log", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # Writes whatever is still queued, then closes the file
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _run(self):
+        while True:
+            stopping = self._stop_event.wait(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Error writing access log {self.path}: {e}")
+            if stopping:
+                return
+
+    def flush(self):
+        batch = []
+        while self._queue:
+            batch.append(self._format(self._queue.popleft()))
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+
+    @staticmethod
+    def _format(record):
+        entry = dict(zip(FIELDS, record))
+        client = entry["client"]
+        if isinstance(client, tuple): # Socket address as passed by ProxyServer; formatted here, off the relay path
+            entry["client"] = f"{client[0]}:{client[1]}"
+        entry["time"] = round(entry["time"], 6)
+        entry["duration"] = round(entry["duration"], 6)
+        return json.dumps(entry, separators=(",", ":")) + "\n"
+
+    def _open(self):
+        self._file = open(self.path, "ab")
+        self._size = self._file.tell()
+
+    def _write(self, lines):
+        data = "".join(lines).encode("utf-8") # Rotation counts bytes on disk, not characters
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+        if self.max_bytes is not None and self._size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        if self.backup_count > 0:
+            for number in range(self.backup_count - 1, 0, -1):
+                source = f"{self.path}.{number}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{number + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
@@ -0,0 +1,204 @@
+import asyncio
+import collections
+import threading
+import time
+
+# Admission control at the listener. ProxyServer asks it about every accepted
+# connection before spending a thread (or task) on it:
+#   - a per-client-IP token bucket (rate connections/s, up to burst at once),
+#   - a cap on concurrent client connections, with an optional bounded wait for a slot
+#     in one FIFO queue of at most max_queued connections: a freed slot goes straight to
+#     the connection that has waited longest, and new arrivals never jump the queue,
+#   - a cap on concurrent connections per backend; a full backend is skipped like a
+#     failed one, so the client spills over to the next pick.
+# Every check is O(1). Client buckets live in an LRU of at most max_clients entries,
+# so a flood of distinct addresses cannot grow memory; an evicted client simply starts
+# over with a full bucket. None disables a limit.
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated = now
+
+
+class Waiter:
+    __slots__ = ("on_admitted", "state")
+
+    def __init__(self, on_admitted):
+        self.on_admitted = on_admitted # Called, holding the slot, on the thread that freed it
+        self.state = "waiting" # Then "admitted" or "cancelled"
+
+
+class AdmissionController:
+    def __init__(self, max_connections=None, queue_timeout=0.0, rate=None, burst=None,
+                 max_clients=65536, max_backend_connections=None, max_queued=1024):
+        self.max_connections = max_connections # Concurrent client connections
+        self.queue_timeout = queue_timeout # Seconds a connection may wait for a slot; 0 = reject at once
+        self.max_queued = max_queued # Connections waiting for a slot at once; more get rejected
+        self.rate = rate # New connections per second per client IP
+        self.burst = max(burst if burst is not None else rate or 1, 1) # Bucket size
+        self.max_clients = max_clients # Client buckets kept (LRU)
+        self.max_backend_connections = max_backend_connections
+        self.active = 0
+        self._buckets = collections.OrderedDict() # client IP -> TokenBucket, least recently seen first
+        self._rate_lock = threading.Lock()
+        self._condition = threading.Condition()
+        self._waiters = collections.deque() # Waiters in arrival order; cancelled ones are skipped
+        self.queued = 0 # Waiters still waiting
+        self._backend_active = collections.Counter() # (host, port) -> connections; zero entries are removed
+        self.stats = {
+            "admitted": 0,
+            "queued": 0,        # Connections that had to wait for a slot
+            "rate_limited": 0,
+            "over_capacity": 0, # Rejected after the queue_timeout, at once, or with the queue full
+            "backend_full": 0,  # Picks skipped because the backend was at its limit
+        }
+
+    def allow(self, client_ip):
+        # Takes a token from the client's bucket; False means the client is over its rate
+        if self.rate is None:
+            return True
+        now = time.monotonic()
+        with self._rate_lock:
+            bucket = self._buckets.get(client_ip)
+            if bucket is None:
+                if len(self._buckets) >= self.max_clients:
+                    self._buckets.popitem(last=False)
+                bucket = self._buckets[client_ip] = TokenBucket(self.burst, now)
+            else:
+                self._buckets.move_to_end(client_ip)
+                bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+                bucket.updated = now
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                return True
+            self.stats["rate_limited"] += 1
+            return False
+
+    def tracked_clients(self):
+        return len(self._buckets)
+
+    def try_acquire(self):
+        # Takes a free slot if there is one and nobody is queued for it, without counting a rejection
+        with self._condition:
+            return self._take_slot(count_rejection=False)
+
+    def queue(self, on_admitted):
+        # Queues for the next free slot. Returns the Waiter, or None (counted as a
+        # rejection) if max_queued connections are waiting already. Whoever gives up
+        # waiting calls cancel().
+        with self._condition:
+            if self.max_queued is not None and self.queued >= self.max_queued:
+                self.stats["over_capacity"] += 1
+                return None
+            if len(self._waiters) > 2 * self.queued + 64: # Mostly cancelled: drop them
+                self._waiters = collections.deque(w for w in self._waiters if w.state == "waiting")
+            waiter = Waiter(on_admitted)
+            self._waiters.append(waiter)
+            self.queued += 1
+            self.stats["queued"] += 1
+            return waiter
+
+    def cancel(self, waiter):
+        # Gives up waiting; False if the waiter got its slot first (its callback has run or is about to)
+        with self._condition:
+            if waiter.state != "waiting":
+                return False
+            waiter.state = "cancelled"
+            self.queued -= 1
+            self.stats["over_capacity"] += 1
+            return True
+
+    def acquire(self, timeout=None):
+        # Waits up to timeout (default queue_timeout) for a connection slot
+        timeout = self.queue_timeout if timeout is None else timeout
+        with self._condition:
+            if self._take_slot(count_rejection=timeout <= 0):
+                return True
+            if timeout <= 0:
+                return False
+        admitted = threading.Event()
+        waiter = self.queue(admitted.set)
+        if waiter is None:
+            return False
+        return admitted.wait(timeout) or not self.cancel(waiter)
+
+    async def acquire_async(self, timeout=None):
+        # asyncio counterpart of acquire(); waits on a future instead of blocking the loop
+        timeout = self.queue_timeout if timeout is None else timeout
+        with self._condition:
+            if self._take_slot(count_rejection=timeout <= 0):
+                return True
+            if timeout <= 0:
+                return False
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = self.queue(lambda: loop.call_soon_threadsafe(_wake, future))
+        if waiter is None:
+            return False
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return not self.cancel(waiter)
+
+    def release(self):
+        # Hands the slot to the longest waiting connection, if any
+        with self._condition:
+            waiter = None
+            while self._waiters:
+                candidate = self._waiters.popleft()
+                if candidate.state == "waiting":
+                    waiter = candidate
+                    break
+            if waiter is None:
+                self.active -= 1
+                return
+            waiter.state = "admitted"
+            self.queued -= 1
+            self.stats["admitted"] += 1
+        waiter.on_admitted()
+
+    def reserve_backend(self, server):
+        # Counts a connection to server; False (and nothing counted) when it is at its limit
+        key = (server.host, server.port)
+        with self._condition:
+            if self.max_backend_connections is not None and self._backend_active[key] >= self.max_backend_connections:
+                self.stats["backend_full"] += 1
+                return False
+            self._backend_active[key] += 1
+            return True
+
+    def release_backend(self, server):
+        key = (server.host, server.port)
+        with self._condition:
+            self._backend_active[key] -= 1
+            if self._backend_active[key] <= 0:
+                del self._backend_active[key]
+
+    def backend_full(self, server):
+        # Lock-free check for picking; reserve_backend() is the authoritative one
+        return self.max_backend_connections is not None and \
+               self._backend_active.get((server.host, server.port), 0) >= self.max_backend_connections
+
+    def backend_connections(self, server):
+        with self._condition:
+            return self._backend_active[(server.host, server.port)]
+
+    def _take_slot(self, count_rejection=True):
+        # Caller holds self._condition. Queued connections come first.
+        if (self.max_connections is not None and self.active >= self.max_connections) or self.queued:
+            if count_rejection:
+                self.stats["over_capacity"] += 1
+            return False
+        self.active += 1
+        self.stats["admitted"] += 1
+        return True
+
+
+def _wake(future):
+    if not future.done(): # May have timed out in the meantime
+        future.set_result(None)
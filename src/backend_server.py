@@ -1,11 +1,19 @@
+import socket
+import threading
+
+from src.http_parser import HttpParseError, HttpParser
+
 
 class BackendServer:
-    def __init__(self, id, host, port, protocol="http", weight=1):
+    __slots__ = ("id", "host", "port", "protocol", "weight", "group") # Thousands of these stay small
+
+    def __init__(self, id, host, port, protocol="http", weight=1, group=None):
         self.id = id
         self.host = host
         self.port = port
         self.protocol = protocol # e.g., "http", "https", "tcp"
         self.weight = weight # Used for Weighted Round Robin
+        self.group = group # Backend group named by HTTP routing rules; None = ungrouped
 
     def __str__(self):
         return f"Server(ID: {self.id}, Protocol: {self.protocol.upper()}, Host: {self.host}, Port: {self.port}, Weight: {self.weight})"
@@ -17,4 +25,192 @@ class BackendServer:
                self.host == other.host and \
                self.port == other.port and \
                self.protocol == other.protocol and \
-               self.weight == other.weight
+               self.weight == other.weight and \
+               self.group == other.group
+
+
+class BackendRegistry:
+    # The configured backends, indexed by ID and by host:port so lookups, adds and
+    # removes are dict operations. IDs are stable: a removed backend's ID is never handed
+    # out again and nothing is renumbered, so an ID names the same backend for as long
+    # as it exists.
+    def __init__(self, servers=()):
+        self._by_id = {} # id -> BackendServer, in the order added
+        self._by_address = {} # (host, port) -> BackendServer
+        self._next_id = 1
+        self._lock = threading.Lock()
+        for server in servers:
+            self.register(server)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(list(self._by_id.values()))
+
+    def get(self, id):
+        return self._by_id.get(id)
+
+    def find(self, host, port):
+        return self._by_address.get((host, port))
+
+    def register(self, server):
+        # Adds a BackendServer that already has its ID (e.g. from config.json)
+        with self._lock:
+            if server.id in self._by_id:
+                raise ValueError(f"Duplicate backend server ID {server.id}.")
+            self._check_address(server.host, server.port)
+            self._by_id[server.id] = server
+            self._by_address[(server.host, server.port)] = server
+            self._next_id = max(self._next_id, server.id + 1)
+        return server
+
+    def add(self, host, port, protocol="http", weight=1, group=None):
+        with self._lock:
+            server = BackendServer(self._next_id, host, port, protocol, weight, group)
+        return self.register(server)
+
+    def update(self, id, **fields):
+        # Changes fields of a backend in place; returns it, or None if the ID is unknown
+        with self._lock:
+            server = self._by_id.get(id)
+            if server is None:
+                return None
+            address = (fields.get("host", server.host), fields.get("port", server.port))
+            if address != (server.host, server.port):
+                self._check_address(*address)
+                del self._by_address[(server.host, server.port)]
+                self._by_address[address] = server
+            for name, value in fields.items():
+                setattr(server, name, value)
+            return server
+
+    def remove(self, id):
+        # Returns the removed backend, or None if the ID is unknown
+        with self._lock:
+            server = self._by_id.pop(id, None)
+            if server is not None:
+                del self._by_address[(server.host, server.port)]
+            return server
+
+    def _check_address(self, host, port):
+        existing = self._by_address.get((host, port))
+        if existing is not None:
+            raise ValueError(f"{host}:{port} is already backend server {existing.id}.")
+
+
+class StandInBackend:
+    # Local server standing in for a real backend in benchmarks. "echo" sends back every
+    # byte it receives; "http" answers each HTTP/1.1 request (keep-alive, pipelining and
+    # request bodies included) with a fixed body of response_size bytes. With a server-side
+    # tls_context, connections are TLS and the backend is an "https" one.
+    MODES = ("echo", "http")
+
+    def __init__(self, mode="http", host="127.0.0.1", port=0, response_size=2, backlog=1024, tls_context=None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown stand-in backend mode '{mode}'. Expected one of: {', '.join(self.MODES)}")
+        self.mode = mode
+        self.host = host
+        self.port = port # 0 picks a free port on start()
+        self.response_size = response_size
+        self.backlog = backlog
+        self.tls_context = tls_context
+        self.connections = 0 # Connections accepted
+        self.requests = 0 # HTTP requests answered (http mode)
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+        self._socket = None
+        self._thread = None
+        self._response = (f"HTTP/1.1 200 OK\r\nContent-Length: {response_size}\r\n\r\n".encode()
+                          + b"x" * response_size)
+
+    def as_server(self, id, weight=1, group=None):
+        # The BackendServer entry that routes to this stand-in
+        if self.tls_context:
+            protocol = "https"
+        else:
+            protocol = "http" if self.mode == "http" else "tcp"
+        return BackendServer(id, self.host, self.port, protocol, weight, group)
+
+    def start(self):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, self.port))
+        self._socket.listen(self.backlog)
+        self.port = self._socket.getsockname()[1]
+        self._thread = threading.Thread(target=self._accept_loop, name=f"stand-in-{self.port}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._socket:
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR) # Wakes up the blocked accept()
+            except OSError:
+                pass
+            self._socket.close()
+            self._socket = None
+        if self._thread:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def _accept_loop(self):
+        handler = self._serve_http if self.mode == "http" else self._serve_echo
+        while True:
+            try:
+                conn, _ = self._socket.accept()
+            except (OSError, AttributeError): # Closed by stop()
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self._lock:
+                self.connections += 1
+            threading.Thread(target=self._serve, args=(handler, conn), daemon=True).start()
+
+    def _serve(self, handler, conn):
+        if self.tls_context:
+            try:
+                conn = self.tls_context.wrap_socket(conn, server_side=True)
+            except OSError:
+                conn.close()
+                return
+        handler(conn)
+
+    def _serve_echo(self, conn):
+        with conn:
+            received = 0
+            try:
+                while True:
+                    data = conn.recv(65536)
+                    if not data:
+                        break
+                    received += len(data)
+                    conn.sendall(data)
+            except OSError:
+                pass
+            with self._lock:
+                self.bytes_received += received
+
+    def _serve_http(self, conn):
+        # Counters are updated per batch, not on close: the proxy pools these connections
+        parser = HttpParser()
+        with conn:
+            try:
+                while True:
+                    data = conn.recv(65536)
+                    if not data:
+                        break
+                    keep_alive = True
+                    responses = []
+                    for kind, message in parser.feed(data):
+                        if kind == "end":
+                            responses.append(self._response)
+                            keep_alive = message.keep_alive
+                    with self._lock:
+                        self.bytes_received += len(data)
+                        self.requests += len(responses)
+                    if responses:
+                        conn.sendall(b"".join(responses)) # One write per batch of pipelined requests
+                    if not keep_alive:
+                        break
+            except (OSError, HttpParseError):
+                pass
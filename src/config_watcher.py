@@ -0,0 +1,50 @@
+import os
+import threading
+
+# Watches config.json for server mode: its modification time, size and inode are polled
+# every interval and on_change() runs once the file has changed. One stat() per interval
+# costs next to nothing and, unlike inotify, needs no third-party bindings. Editors that
+# replace the file (write to a temp file, then rename) are covered by the inode check.
+
+
+class ConfigWatcher:
+    def __init__(self, path, on_change, interval=1.0):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self._signature = self._stat()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None # Missing (e.g. mid-rename); the next poll will see the new file
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def check(self):
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+        self.on_change()
+        return True
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="config-watcher", daemon=True)
+        self._thread.start()
+        print(f"Watching {self.path} for changes (every {self.interval}s).")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(self.interval + 1)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Applying changed configuration failed: {e}")
@@ -0,0 +1,191 @@
+import collections
+import socket
+import ssl
+import threading
+import time
+
+# Per-backend pool of connected sockets. A connection released as reusable (an
+# HTTP/1.1 keep-alive exchange that completed cleanly) is parked and handed to the
+# next client routed to the same backend, skipping the TCP handshake. With a
+# tls_context, connections to "https" backends are TLS, and each new one resumes the
+# last TLS session negotiated with that backend when it can.
+
+
+class PoolTimeout(socket.timeout):
+    # Subclass of socket.timeout so ProxyServer answers it with its usual 504
+    pass
+
+
+def is_connection_alive(sock):
+    # An idle keep-alive connection must have nothing to read: EOF means the backend
+    # closed it, and unsolicited bytes mean it is in an unknown state.
+    if isinstance(sock, ssl.SSLSocket) and sock.pending():
+        return False
+    try:
+        # Peeks at the raw socket; SSLSocket.recv() does not take flags
+        socket.socket.recv(sock, 1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+    except (BlockingIOError, InterruptedError):
+        return True
+    except OSError:
+        return False
+    return False # EOF (b"") or unsolicited data
+
+
+class ConnectionPool:
+    def __init__(self, max_size=None, max_idle=32, idle_timeout=30.0, wait_timeout=5.0, connect_timeout=None,
+                 tls_context=None):
+        self.max_size = max_size # Open connections (in use + idle) per backend; None = unlimited
+        self.max_idle = max_idle # Idle connections kept per backend
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout # How long acquire() waits for a slot when max_size is reached
+        self.connect_timeout = connect_timeout
+        self.tls_context = tls_context # ssl.SSLContext for "https" backends; None = pass their bytes through
+        self._tls_sessions = {} # (host, port) -> last ssl.SSLSession, for resumption
+        self._condition = threading.Condition()
+        self._idle = collections.defaultdict(collections.deque) # (host, port) -> deque of (socket, released_at)
+        self._open = collections.Counter() # (host, port) -> open connections, idle or in use
+        self._draining = set() # (host, port) of backends removed from the configuration
+        self.stats = {
+            "created": 0,    # New TCP connections opened
+            "reused": 0,     # Checkouts served by an idle connection
+            "released": 0,   # Connections parked for reuse
+            "discarded": 0,  # Idle connections that failed validation on checkout
+            "expired": 0,    # Idle connections closed after idle_timeout
+            "waits": 0,      # Checkouts that had to wait for a free slot
+            "wait_time": 0.0, # Total seconds spent waiting for a slot
+            "timeouts": 0,   # Checkouts that gave up waiting
+            "tls_resumed": 0, # New TLS connections that resumed an earlier session
+        }
+
+    @staticmethod
+    def key(server):
+        return (server.host, server.port)
+
+    def reuse_rate(self):
+        checkouts = self.stats["created"] + self.stats["reused"]
+        return self.stats["reused"] / checkouts if checkouts else 0.0
+
+    def acquire(self, server, timeout=None):
+        # timeout overrides connect_timeout for this call (e.g. what is left of a retry budget)
+        key = self.key(server)
+        with self._condition:
+            waited_since = None
+            while True:
+                sock = self._take_idle(key)
+                if sock:
+                    self.stats["reused"] += 1
+                    self._record_wait(waited_since)
+                    return sock
+                if self.max_size is None or self._open[key] < self.max_size:
+                    self._open[key] += 1 # Reserve the slot, then connect outside the lock
+                    self._record_wait(waited_since)
+                    break
+                if waited_since is None:
+                    waited_since = time.monotonic()
+                    self.stats["waits"] += 1
+                remaining = self.wait_timeout - (time.monotonic() - waited_since)
+                if remaining <= 0:
+                    self.stats["timeouts"] += 1
+                    self._record_wait(waited_since)
+                    raise PoolTimeout(f"No free connection to {key[0]}:{key[1]} within {self.wait_timeout}s")
+                self._condition.wait(remaining)
+
+        try:
+            sock = socket.create_connection(key, timeout=self.connect_timeout if timeout is None else timeout)
+            if self.tls_context is not None and server.protocol == "https":
+                sock = self._wrap(sock, server, key)
+            sock.settimeout(None)
+        except BaseException:
+            with self._condition:
+                self._open[key] -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self.stats["created"] += 1
+            if isinstance(sock, ssl.SSLSocket) and sock.session_reused:
+                self.stats["tls_resumed"] += 1
+        return sock
+
+    def _wrap(self, sock, server, key):
+        # Handshake under the connect timeout already set on sock
+        try:
+            return self.tls_context.wrap_socket(sock, server_hostname=server.host, session=self._tls_sessions.get(key))
+        except BaseException:
+            sock.close()
+            raise
+
+    def release(self, server, sock, reusable=False):
+        key = self.key(server)
+        now = time.monotonic()
+        if isinstance(sock, ssl.SSLSocket) and sock.session is not None:
+            # Taken now rather than after the handshake: TLS 1.3 tickets arrive with the first response
+            self._tls_sessions[key] = sock.session
+        with self._condition:
+            idle = self._idle[key]
+            self._expire(key, now)
+            if reusable and key not in self._draining and len(idle) < self.max_idle:
+                idle.append((sock, now))
+                self.stats["released"] += 1
+            else:
+                self._open[key] -= 1
+                sock.close()
+            self._condition.notify()
+
+    def discard(self, server, sock):
+        self.release(server, sock, reusable=False)
+
+    def drain(self, server):
+        # The backend was removed: close its idle connections now and the ones in use as they are released
+        key = self.key(server)
+        with self._condition:
+            self._draining.add(key)
+            idle = self._idle.pop(key, ())
+            while idle:
+                sock, _ = idle.pop()
+                self._open[key] -= 1
+                sock.close()
+
+    def resume(self, server):
+        # The backend is (back) in the configuration; its connections may be pooled again
+        with self._condition:
+            self._draining.discard(self.key(server))
+
+    def close(self):
+        with self._condition:
+            for key, idle in self._idle.items():
+                while idle:
+                    sock, _ = idle.pop()
+                    self._open[key] -= 1
+                    sock.close()
+            self._condition.notify_all()
+
+    def idle_count(self, server):
+        with self._condition:
+            return len(self._idle[self.key(server)])
+
+    # Callers hold self._condition for the helpers below
+
+    def _take_idle(self, key):
+        idle = self._idle[key]
+        self._expire(key, time.monotonic())
+        while idle:
+            sock, _ = idle.pop() # Most recently used first: least likely to have been closed by the backend
+            if is_connection_alive(sock):
+                return sock
+            self.stats["discarded"] += 1
+            self._open[key] -= 1
+            sock.close()
+        return None
+
+    def _expire(self, key, now):
+        # Oldest connections sit at the left end, so expiry stops at the first fresh one
+        idle = self._idle[key]
+        while idle and now - idle[0][1] > self.idle_timeout:
+            sock, _ = idle.popleft()
+            self.stats["expired"] += 1
+            self._open[key] -= 1
+            sock.close()
+
+    def _record_wait(self, waited_since):
+        if waited_since is not None:
+            self.stats["wait_time"] += time.monotonic() - waited_since
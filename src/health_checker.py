@@ -0,0 +1,218 @@
+import collections
+import errno
+import os
+import selectors
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Active health checking for server mode. Every interval all configured backends are
+# probed in parallel; a backend that fails `fall` probes in a row is removed from the
+# live load balancer, and put back after `rise` consecutive successful probes.
+
+
+def probe_server(server, timeout=1.0, http_path=None):
+    # Returns (reachable, connect latency in seconds or None, error message or None).
+    # With http_path, "http" backends must also answer GET http_path with a 2xx/3xx status.
+    started = time.monotonic()
+    try:
+        with socket.create_connection((server.host, server.port), timeout=timeout) as sock:
+            latency = time.monotonic() - started
+            if http_path and server.protocol == "http":
+                sock.sendall(f"GET {http_path} HTTP/1.1\r\nHost: {server.host}\r\nConnection: close\r\n\r\n".encode())
+                status_line = sock.makefile("rb").readline(1024)
+                parts = status_line.split(None, 2)
+                if len(parts) < 2 or not parts[1].isdigit():
+                    return False, latency, "invalid HTTP response"
+                if not 200 <= int(parts[1]) < 400:
+                    return False, latency, f"HTTP {int(parts[1])}"
+            return True, latency, None
+    except (socket.timeout, ConnectionRefusedError, OSError) as e:
+        return False, None, str(e) or e.__class__.__name__
+
+
+def probe_servers(servers, timeout=1.0, deadline=None, max_in_flight=512):
+    # Connect probe of many backends at once, on one thread: non-blocking connects
+    # multiplexed on a selector, at most max_in_flight sockets open at a time. Each
+    # connect gets timeout seconds and the whole batch deadline seconds (default: timeout
+    # per max_in_flight servers), so a partial outage costs one timeout, not one per dead
+    # backend. Returns [(server, reachable, connect latency in seconds or None, error
+    # message or None)] in the order given. Host names are resolved before connecting.
+    servers = list(servers)
+    results = [(server, False, None, "deadline exceeded") for server in servers]
+    if deadline is None:
+        deadline = timeout * max(1, -(-len(servers) // max_in_flight))
+    end = time.monotonic() + deadline
+    waiting = iter(range(len(servers)))
+    in_flight = collections.deque() # (connect deadline, index, socket) in start order, so soonest first
+    selector = selectors.DefaultSelector()
+    try:
+        while True:
+            while len(selector.get_map()) < max_in_flight and time.monotonic() < end:
+                index = next(waiting, None)
+                if index is None:
+                    break
+                _start_probe(servers[index], index, selector, in_flight, results, timeout)
+            if not selector.get_map():
+                break
+            now = time.monotonic()
+            while in_flight and (in_flight[0][0] <= now or now >= end):
+                _, index, sock = in_flight.popleft()
+                if sock.fileno() != -1: # Still connecting
+                    selector.unregister(sock)
+                    sock.close()
+                    results[index] = (servers[index], False, None, "timed out")
+            if not in_flight:
+                continue
+            for key, _ in selector.select(max(0.0, min(in_flight[0][0], end) - now)):
+                sock = key.fileobj
+                index, started = key.data
+                latency = time.monotonic() - started
+                error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                selector.unregister(sock)
+                sock.close()
+                if error:
+                    results[index] = (servers[index], False, None, os.strerror(error))
+                else:
+                    results[index] = (servers[index], True, latency, None)
+    finally:
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        selector.close()
+    return results
+
+
+def _start_probe(server, index, selector, in_flight, results, timeout):
+    try:
+        family, kind, proto, _, address = socket.getaddrinfo(server.host, server.port, type=socket.SOCK_STREAM)[0]
+        sock = socket.socket(family, kind, proto)
+    except OSError as e:
+        results[index] = (server, False, None, str(e) or e.__class__.__name__)
+        return
+    sock.setblocking(False)
+    started = time.monotonic()
+    error = sock.connect_ex(address)
+    if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+        sock.close()
+        results[index] = (server, False, None, os.strerror(error))
+        return
+    selector.register(sock, selectors.EVENT_WRITE, (index, started))
+    in_flight.append((started + timeout, index, sock))
+
+
+class HealthState:
+    __slots__ = ("healthy", "successes", "failures", "latency", "error", "changed_at")
+
+    def __init__(self):
+        self.healthy = True # Backends start in rotation until probes say otherwise
+        self.successes = 0 # Consecutive successful probes
+        self.failures = 0 # Consecutive failed probes
+        self.latency = None
+        self.error = None
+        self.changed_at = time.time()
+
+
+class HealthChecker:
+    def __init__(self, proxy_server, interval=5.0, timeout=1.0, rise=2, fall=3, http_path=None, max_workers=32):
+        self.proxy_server = proxy_server # Its servers and load_balancer are re-read every round (config reloads swap them)
+        self.interval = interval
+        self.timeout = timeout
+        self.rise = rise
+        self.fall = fall
+        self.http_path = http_path
+        self.max_workers = max_workers
+        self.states = {} # (host, port) -> HealthState
+        self._ejected = set() # (host, port) currently removed from self._load_balancer
+        self._load_balancer = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._executor = None
+
+    @staticmethod
+    def key(server):
+        return (server.host, server.port)
+
+    def is_healthy(self, server):
+        state = self.states.get(self.key(server))
+        return state.healthy if state else True
+
+    def start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="health-check")
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="health-checker", daemon=True)
+        self._thread.start()
+        print(f"Health checker started (interval {self.interval}s, rise {self.rise}, fall {self.fall}).")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(self.timeout + 1)
+        if self._executor:
+            self._executor.shutdown(wait=False)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Health check round failed: {e}")
+            self._stop_event.wait(self.interval)
+
+    def run_once(self):
+        servers = list(self.proxy_server.servers)
+        if self._executor:
+            results = list(self._executor.map(lambda server: probe_server(server, self.timeout, self.http_path), servers))
+        else:
+            results = [probe_server(server, self.timeout, self.http_path) for server in servers]
+
+        with self._lock:
+            configured = set()
+            for server, (reachable, latency, error) in zip(servers, results):
+                key = self.key(server)
+                configured.add(key)
+                state = self.states.setdefault(key, HealthState())
+                state.latency = latency
+                state.error = error
+                if reachable:
+                    state.successes += 1
+                    state.failures = 0
+                    if not state.healthy and state.successes >= self.rise:
+                        state.healthy = True
+                        state.changed_at = time.time()
+                        print(f"Backend {key[0]}:{key[1]} is UP.")
+                else:
+                    state.failures += 1
+                    state.successes = 0
+                    if state.healthy and state.failures >= self.fall:
+                        state.healthy = False
+                        state.changed_at = time.time()
+                        print(f"Backend {key[0]}:{key[1]} is DOWN ({error}).")
+            for key in set(self.states) - configured: # Removed from config.json
+                del self.states[key]
+            self._ejected &= configured
+            self._apply(servers)
+
+    def sync(self):
+        # Re-apply ejections right away, e.g. after a config reload built a new balancer
+        with self._lock:
+            self._apply(list(self.proxy_server.servers))
+
+    def _apply(self, servers):
+        load_balancer = self.proxy_server.load_balancer
+        if load_balancer is None:
+            return
+        if load_balancer is not self._load_balancer:
+            # A freshly built balancer contains every configured server
+            self._load_balancer = load_balancer
+            self._ejected = set()
+        for server in servers:
+            key = self.key(server)
+            healthy = self.states[key].healthy if key in self.states else True
+            if not healthy and key not in self._ejected:
+                load_balancer.remove_server(server)
+                self._ejected.add(key)
+            elif healthy and key in self._ejected:
+                load_balancer.add_server(server)
+                self._ejected.discard(key)
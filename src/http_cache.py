@@ -0,0 +1,288 @@
+import collections
+import email.utils
+import threading
+import time
+
+# In-memory cache of HTTP responses for the request mode. Only GETs without a body,
+# credentials or a no-store/no-cache directive are looked up, and only responses that
+# say how long they stay fresh (s-maxage, max-age or Expires) are stored; no-store,
+# private, no-cache, Set-Cookie and "Vary: *" keep a response out. Entries are keyed by
+# Host and request target, kept in an LRU and evicted once their bytes exceed
+# max_bytes. A hit is answered without touching a backend, with an Age header, or with
+# a 304 when the client's If-None-Match matches the entry's ETag.
+#
+# Concurrent misses for one key are coalesced: the first request fetches it, the others
+# wait up to coalesce_timeout for its response to be stored. A stale entry is still
+# served for stale-while-revalidate seconds (the response's directive, else the
+# configured default) while a single background request revalidates it, conditionally
+# on its ETag or Last-Modified, so a 304 refreshes the entry without resending the body.
+
+CACHEABLE_STATUSES = {200, 203, 204, 300, 301, 308, 404, 410}
+HOP_BY_HOP = {"age", "connection", "keep-alive", "proxy-connection", "te", "trailer", "upgrade"}
+
+
+def cache_control(message):
+    # Cache-Control directives as {name: value or None}
+    directives = {}
+    for name, value in message.headers:
+        if name != "cache-control":
+            continue
+        for directive in value.split(","):
+            key, _, argument = directive.strip().partition("=")
+            if key:
+                directives[key.lower()] = argument.strip('"') if argument else None
+    return directives
+
+
+def _seconds(value):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _http_date(value):
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _etag_matches(etag, if_none_match):
+    # Weak comparison, as If-None-Match uses
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+class CacheEntry:
+    __slots__ = ("head", "body", "size", "stored", "fresh_for", "stale_for", "etag", "last_modified", "vary")
+
+    def __init__(self, head, body, stored, fresh_for, stale_for, etag, last_modified, vary):
+        self.head = head # Response head without hop-by-hop headers or Age
+        self.body = body # Body bytes as received (chunk framing included)
+        self.size = len(head) + len(body)
+        self.stored = stored # Monotonic time the response was generated (its Age taken off)
+        self.fresh_for = fresh_for # Seconds it stays fresh
+        self.stale_for = stale_for # Seconds it may be served stale while being revalidated
+        self.etag = etag
+        self.last_modified = last_modified
+        self.vary = vary # ((request header, value), ...) the response varies on
+
+
+class ResponseCapture:
+    # Copies one response as ProxyServer relays it to the client, up to limit bytes
+    __slots__ = ("limit", "chunks", "size", "response", "complete")
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.chunks = [] # None once the response turned out not to be storable
+        self.size = 0
+        self.response = None
+        self.complete = False
+
+    def add(self, data, events):
+        if self.chunks is None:
+            return
+        self.size += len(data)
+        if self.size > self.limit:
+            self.chunks = None
+            return
+        self.chunks.append(bytes(data))
+        for kind, message in events:
+            if kind == "head":
+                if message.status < 200 or self.response is not None: # Interim response
+                    self.chunks = None
+                    return
+                self.response = message
+            elif kind == "end" and message is self.response:
+                self.complete = True
+
+    @property
+    def body(self):
+        return b"".join(self.chunks)[len(self.response.raw):]
+
+
+class HttpCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_object_bytes=1024 * 1024,
+                 stale_while_revalidate=0.0, coalesce_timeout=5.0):
+        self.max_bytes = max_bytes # Head and body bytes of every entry together
+        self.max_object_bytes = max_object_bytes # Larger responses are relayed but not stored
+        self.stale_while_revalidate = stale_while_revalidate # Default for responses without the directive
+        self.coalesce_timeout = coalesce_timeout # Seconds a miss waits for another request fetching its key
+        self.size = 0
+        self._entries = collections.OrderedDict() # key -> CacheEntry, least recently used first
+        self._fetching = {} # key -> Event set when the request fetching it is done
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "stale_hits": 0,  # Served stale while a revalidation ran
+            "misses": 0,
+            "coalesced": 0,   # Misses that waited for another request's fetch
+            "stores": 0,
+            "revalidated": 0, # Stale entries refreshed by a 304
+            "evictions": 0,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(request):
+        return ((request.get_header("host") or "").lower(), request.target)
+
+    @staticmethod
+    def cacheable_request(request):
+        if request.method != "GET" or request.version != "HTTP/1.1" or request.is_chunked:
+            return False
+        if request.get_header("content-length") not in (None, "0") or request.get_header("authorization"):
+            return False
+        directives = cache_control(request)
+        return "no-store" not in directives and "no-cache" not in directives and \
+               "no-cache" not in (request.get_header("pragma") or "")
+
+    def lookup(self, key, request, now=None):
+        # Returns (entry, "fresh" or "stale"), or (None, None) for a miss
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and any(request.get_header(name) != value for name, value in entry.vary):
+                entry = None # Stored for a different variant
+            if entry is not None:
+                age = now - entry.stored
+                if age < entry.fresh_for:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return entry, "fresh"
+                if age < entry.fresh_for + entry.stale_for:
+                    self._entries.move_to_end(key)
+                    self.stats["stale_hits"] += 1
+                    return entry, "stale"
+                self._remove(key)
+            self.stats["misses"] += 1
+            return None, None
+
+    def begin_fetch(self, key, wait=True):
+        # True if the caller is now the one request fetching key. Otherwise another
+        # request is fetching it: waits for it to finish (at most coalesce_timeout)
+        # unless wait is False, and returns False.
+        with self._lock:
+            event = self._fetching.get(key)
+            if event is None:
+                self._fetching[key] = threading.Event()
+                return True
+            if wait:
+                self.stats["coalesced"] += 1
+        if wait:
+            event.wait(self.coalesce_timeout)
+        return False
+
+    def end_fetch(self, key):
+        with self._lock:
+            event = self._fetching.pop(key, None)
+        if event:
+            event.set()
+
+    def store(self, key, request, response, body, now=None):
+        # Stores the response to request if it may be cached; True if it was
+        if response.status not in CACHEABLE_STATUSES or response.get_header("set-cookie") is not None:
+            return False
+        directives = cache_control(response)
+        if {"no-store", "no-cache", "private"} & directives.keys():
+            return False
+        vary = [name.strip().lower() for name in (response.get_header("vary") or "").split(",") if name.strip()]
+        if "*" in vary:
+            return False
+        fresh_for = self._lifetime(response, directives)
+        if fresh_for is None:
+            return False
+        stale_for = self._stale_for(directives)
+        if not fresh_for and not stale_for:
+            return False # Would never be served
+        head = self._strip_head(response.raw)
+        if len(head) + len(body) > self.max_object_bytes:
+            return False
+        now = time.monotonic() if now is None else now
+        entry = CacheEntry(head, bytes(body), now - (_seconds(response.get_header("age")) or 0), fresh_for, stale_for,
+                           response.get_header("etag"), response.get_header("last-modified"),
+                           tuple((name, request.get_header(name)) for name in vary))
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self.size += entry.size
+            self.stats["stores"] += 1
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.size
+                self.stats["evictions"] += 1
+        return True
+
+    def refresh(self, key, response, now=None):
+        # A 304 to a revalidation: the stored body is current again
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            directives = cache_control(response)
+            lifetime = self._lifetime(response, directives)
+            entry.stored = now - (_seconds(response.get_header("age")) or 0)
+            if lifetime is not None: # Including max-age=0: the origin wants it revalidated every time
+                entry.fresh_for = lifetime
+            if response.get_header("cache-control") is not None: # Else the stored directives still hold
+                entry.stale_for = self._stale_for(directives)
+            self.stats["revalidated"] += 1
+
+    def revalidation_head(self, request, entry):
+        # A conditional GET for entry, built from the client request that found it stale
+        lines = [f"GET {request.target} HTTP/1.1"]
+        lines.extend(f"{name}: {value}" for name, value in request.headers
+                     if name not in HOP_BY_HOP and not name.startswith("if-"))
+        if entry.etag:
+            lines.append(f"If-None-Match: {entry.etag}")
+        if entry.last_modified:
+            lines.append(f"If-Modified-Since: {entry.last_modified}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    def response_bytes(self, entry, request, now=None):
+        # What to send a client the entry answers: a 304 if it already has the
+        # entry's ETag, else the stored response, with its Age
+        now = time.monotonic() if now is None else now
+        extra = f"Age: {int(max(0, now - entry.stored))}\r\n"
+        if not request.keep_alive:
+            extra += "Connection: close\r\n"
+        if entry.etag and _etag_matches(entry.etag, request.get_header("if-none-match")):
+            return f"HTTP/1.1 304 Not Modified\r\nETag: {entry.etag}\r\n{extra}\r\n".encode("latin-1")
+        return entry.head[:-2] + extra.encode("latin-1") + b"\r\n" + entry.body
+
+    def _stale_for(self, directives):
+        # Seconds a response may be served stale while it is revalidated
+        if "must-revalidate" in directives or "proxy-revalidate" in directives:
+            return 0
+        stale_for = _seconds(directives.get("stale-while-revalidate"))
+        return self.stale_while_revalidate if stale_for is None else stale_for
+
+    def _lifetime(self, response, directives):
+        # Seconds a response is fresh for, None if it does not say
+        for directive in ("s-maxage", "max-age"):
+            if directive in directives:
+                return _seconds(directives[directive])
+        expires = response.get_header("expires")
+        if expires is None:
+            return None
+        expires_at = _http_date(expires)
+        date = _http_date(response.get_header("date")) or time.time()
+        return max(0, int(expires_at - date)) if expires_at is not None else 0 # An invalid date means already expired
+
+    @staticmethod
+    def _strip_head(raw):
+        lines = bytes(raw).split(b"\r\n")
+        kept = [line for line in lines[1:-2] if line.split(b":", 1)[0].strip().lower().decode("latin-1") not in HOP_BY_HOP]
+        return b"\r\n".join([lines[0], *kept, b"", b""])
+
+    def _remove(self, key):
+        # Caller holds self._lock
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
@@ -0,0 +1,288 @@
+from collections import deque
+
+# Incremental HTTP/1.x framing. The proxy forwards bytes verbatim; the parser only
+# finds message boundaries (Content-Length, chunked, read-until-close) so the proxy
+# knows when a request/response exchange is complete.
+#
+# feed() returns a list of events:
+#   ("head", HttpMessage)  - a complete request line/status line plus headers
+#   ("data", memoryview)   - raw body bytes as they appear on the wire (chunk framing included)
+#   ("end", HttpMessage)   - the message body is complete
+# "data" views point into the buffer passed to feed(); copy them if they must outlive it.
+
+MAX_HEAD_SIZE = 65536
+MAX_LINE_SIZE = 4096
+
+_HEX_DIGITS = b"0123456789abcdefABCDEF"
+
+_HEAD, _BODY, _CHUNK_SIZE, _CHUNK_DATA, _TRAILERS, _UNTIL_CLOSE = range(6)
+
+
+class HttpParseError(ValueError):
+    pass
+
+
+class HttpMessage:
+    __slots__ = ("method", "target", "version", "status", "reason", "headers", "raw")
+
+    def __init__(self, raw):
+        self.raw = raw # Head bytes exactly as received, including the blank line
+        self.method = None
+        self.target = None
+        self.status = None
+        self.reason = None
+        self.headers = [] # (lower-cased name, value) pairs in wire order
+
+    def get_header(self, name, default=None):
+        name = name.lower()
+        for header_name, value in self.headers:
+            if header_name == name:
+                return value
+        return default
+
+    @property
+    def keep_alive(self):
+        connection = (self.get_header("connection") or "").lower()
+        if self.version == "HTTP/1.0":
+            return "keep-alive" in connection
+        return "close" not in connection
+
+    @property
+    def transfer_codings(self):
+        # Codings of all Transfer-Encoding headers, in the order they were applied
+        return [coding.strip(" \t").lower() for header_name, value in self.headers
+                if header_name == "transfer-encoding" for coding in value.split(",")]
+
+    @property
+    def is_chunked(self):
+        codings = self.transfer_codings
+        return bool(codings) and codings[-1] == "chunked"
+
+    def __repr__(self):
+        if self.status is not None:
+            return f"HttpMessage({self.version} {self.status})"
+        return f"HttpMessage({self.method} {self.target} {self.version})"
+
+
+def parse_head(raw, is_response):
+    try:
+        lines = bytes(raw).decode("latin-1").split("\r\n")
+    except UnicodeDecodeError as e: # pragma: no cover - latin-1 decodes any byte
+        raise HttpParseError(str(e))
+    message = HttpMessage(bytes(raw))
+    parts = lines[0].split(" ", 2)
+    if len(parts) < 2:
+        raise HttpParseError(f"Malformed start line: {lines[0]!r}")
+    if is_response:
+        message.version = parts[0]
+        try:
+            message.status = int(parts[1])
+        except ValueError:
+            raise HttpParseError(f"Malformed status code: {parts[1]!r}")
+        message.reason = parts[2] if len(parts) > 2 else ""
+    else:
+        if len(parts) != 3:
+            raise HttpParseError(f"Malformed request line: {lines[0]!r}")
+        message.method, message.target, message.version = parts
+    if not message.version.startswith("HTTP/1."):
+        raise HttpParseError(f"Unsupported HTTP version: {message.version!r}")
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, sep, value = line.partition(":")
+        # No whitespace in or around the name: "Content-Length : 5" or a folded line is
+        # read differently by different servers
+        if not sep or not name or any(c in name for c in " \t"):
+            raise HttpParseError(f"Malformed header line: {line!r}")
+        message.headers.append((name.lower(), value.strip(" \t")))
+    return message
+
+
+class HttpParser:
+    def __init__(self, is_response=False):
+        self.is_response = is_response
+        self.state = _HEAD
+        self.message = None # Message currently being received
+        self.remaining = 0
+        self.messages_completed = 0
+        self.keep_alive = True # Whether the last complete message allows connection reuse
+        self.tunnel = False # Set after a 101/CONNECT exchange; bytes are no longer HTTP
+        self.pending_methods = deque() # Response parsers: methods of requests still awaiting a response
+        self._buffer = bytearray()
+        self._scan_from = 0
+
+    @property
+    def is_idle(self):
+        return self.state == _HEAD and not self._buffer and not self.tunnel
+
+    @property
+    def buffered(self):
+        # Bytes received but not returned in an event yet (e.g. the start of the next head)
+        return bytes(self._buffer)
+
+    def expect_response(self, method):
+        self.pending_methods.append(method)
+
+    def feed(self, data):
+        if isinstance(data, memoryview):
+            data = bytes(data) # Need bytes.find() for the in-place scans below
+        events = []
+        view = memoryview(data)
+        pos = 0
+        while pos < len(data):
+            if self.tunnel or self.state == _UNTIL_CLOSE:
+                events.append(("data", view[pos:]))
+                break
+            if self.state == _HEAD:
+                pos = self._feed_head(data, pos, events)
+            elif self.state in (_BODY, _CHUNK_DATA):
+                take = min(self.remaining, len(data) - pos)
+                events.append(("data", view[pos:pos + take]))
+                pos += take
+                self.remaining -= take
+                if not self.remaining:
+                    if self.state == _BODY:
+                        self._finish(events)
+                    else:
+                        self.state = _CHUNK_SIZE
+            elif self.state == _CHUNK_SIZE:
+                pos = self._feed_line(data, pos, events, self._on_chunk_size)
+            else: # _TRAILERS
+                pos = self._feed_line(data, pos, events, self._on_trailer_line)
+        return events
+
+    def close(self):
+        # The peer closed the connection; completes a read-until-close body
+        if self.state == _UNTIL_CLOSE:
+            events = []
+            self._finish(events)
+            return events
+        return []
+
+    def _feed_head(self, data, pos, events):
+        if not self._buffer:
+            # Common case: the whole head arrived in one read, scan it where it lies
+            end = data.find(b"\r\n\r\n", pos)
+            if end >= 0:
+                self._on_head(memoryview(data)[pos:end + 4], events)
+                return end + 4
+        # Head split across reads: reassemble it
+        start = len(self._buffer)
+        self._buffer += memoryview(data)[pos:]
+        end = self._buffer.find(b"\r\n\r\n", max(0, self._scan_from - 3))
+        if end < 0:
+            if len(self._buffer) > MAX_HEAD_SIZE:
+                raise HttpParseError("Message head too large")
+            self._scan_from = len(self._buffer)
+            return len(data)
+        head_end = end + 4
+        raw = bytes(self._buffer[:head_end])
+        self._buffer.clear()
+        self._scan_from = 0
+        self._on_head(raw, events)
+        return pos + head_end - start
+
+    def _on_head(self, raw, events):
+        if len(raw) > MAX_HEAD_SIZE:
+            raise HttpParseError("Message head too large")
+        message = parse_head(raw, self.is_response)
+        self.message = message
+        events.append(("head", message))
+        self._start_body(message, events)
+
+    def _feed_line(self, data, pos, events, on_line):
+        limit = min(len(data), pos + MAX_LINE_SIZE - len(self._buffer))
+        newline = data.find(b"\n", pos, limit) if limit > pos else -1
+        if newline < 0:
+            if limit < len(data):
+                raise HttpParseError("Chunk line too long")
+            self._buffer += memoryview(data)[pos:]
+            return len(data)
+        line_end = newline + 1
+        if self._buffer:
+            self._buffer += memoryview(data)[pos:line_end]
+            line = bytes(self._buffer)
+            self._buffer.clear()
+            events.append(("data", memoryview(line)))
+        else:
+            line = data[pos:line_end]
+            events.append(("data", memoryview(data)[pos:line_end]))
+        on_line(line, events)
+        return line_end
+
+    def _start_body(self, message, events):
+        if self.is_response:
+            if 100 <= message.status < 200 and message.status != 101:
+                # Interim response (e.g. 100 Continue); the final response is still to come
+                self.state = _HEAD
+                events.append(("end", message))
+                return
+            method = self.pending_methods.popleft() if self.pending_methods else None
+            if message.status == 101 or (method == "CONNECT" and 200 <= message.status < 300):
+                self.tunnel = True
+                self.keep_alive = False
+                events.append(("end", message))
+                return
+            if method == "HEAD" or message.status in (204, 304):
+                self._finish(events)
+                return
+        elif message.method == "CONNECT" or (message.get_header("upgrade") and "upgrade" in (message.get_header("connection") or "").lower()):
+            # Requests that switch protocols end at their head; the response decides what follows
+            self._finish(events)
+            return
+
+        # Request mode sends heads unchanged over backend connections that other clients
+        # share, so any framing that another server could read differently is an error:
+        # it would let a client smuggle a request whose response goes to someone else.
+        codings = message.transfer_codings
+        lengths = [value for name, value in message.headers if name == "content-length"]
+        if codings and lengths:
+            raise HttpParseError("Both Transfer-Encoding and Content-Length")
+        if codings:
+            if codings[-1] == "chunked" and "chunked" not in codings[:-1]:
+                self.state = _CHUNK_SIZE
+            elif self.is_response:
+                self.state = _UNTIL_CLOSE # Not chunked last: the body ends when the backend closes
+            else:
+                raise HttpParseError(f"Transfer-Encoding does not end in chunked: {', '.join(codings)!r}")
+            return
+        if lengths:
+            if not all(length.isascii() and length.isdigit() for length in lengths) or len({int(length) for length in lengths}) > 1:
+                raise HttpParseError(f"Invalid Content-Length: {', '.join(lengths)!r}")
+            self.remaining = int(lengths[0])
+            if self.remaining:
+                self.state = _BODY
+            else:
+                self._finish(events)
+            return
+        if self.is_response:
+            self.state = _UNTIL_CLOSE # No framing: the body ends when the backend closes
+        else:
+            self._finish(events)
+
+    def _on_chunk_size(self, line, events):
+        # Only hex digits, then an optional ";extension": int(..., 16) alone would also
+        # take signs, "0x", underscores and whitespace that another hop may read differently
+        line = line[:-2] if line.endswith(b"\r\n") else line[:-1]
+        size_text = line.split(b";", 1)[0]
+        if not size_text or size_text.strip(_HEX_DIGITS) or len(size_text) > 16:
+            raise HttpParseError(f"Invalid chunk size: {size_text!r}")
+        size = int(size_text, 16)
+        if size == 0:
+            self.state = _TRAILERS
+        else:
+            self.remaining = size + 2 # Chunk data plus its trailing CRLF
+            self.state = _CHUNK_DATA
+
+    def _on_trailer_line(self, line, events):
+        if line in (b"\r\n", b"\n"):
+            self._finish(events)
+
+    def _finish(self, events):
+        message = self.message
+        self.state = _HEAD
+        self.remaining = 0
+        self.messages_completed += 1
+        self.keep_alive = message.keep_alive and not self.tunnel
+        self.message = None
+        events.append(("end", message))
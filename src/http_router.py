@@ -0,0 +1,58 @@
+# Host/path-prefix routing for the HTTP request mode. Each rule sends matching requests
+# to a backend group (BackendServer.group); requests no rule matches use every backend.
+# Rules are indexed by host, and within a host the longest matching path prefix wins,
+# so the order of rules in config.json does not matter.
+
+
+class Route:
+    __slots__ = ("host", "path_prefix", "group")
+
+    def __init__(self, group, host=None, path_prefix="/"):
+        self.group = group
+        self.host = host.lower() if host else None # None matches any host
+        self.path_prefix = path_prefix or "/"
+
+    def __repr__(self):
+        return f"Route({self.host or '*'}{self.path_prefix} -> {self.group})"
+
+
+def request_host(message):
+    host = message.get_header("host") or ""
+    if host.startswith("["): # IPv6 literal, e.g. [::1]:8080
+        return host[:host.find("]") + 1].lower()
+    return host.partition(":")[0].lower()
+
+
+def request_path(message):
+    target = message.target or "/"
+    if "://" in target: # Absolute form (requests sent to a proxy)
+        target = target.split("://", 1)[1]
+        slash = target.find("/")
+        target = target[slash:] if slash >= 0 else "/"
+    return target
+
+
+class HttpRouter:
+    def __init__(self, routes=()):
+        self._by_host = {} # host (None = any) -> routes, longest path_prefix first
+        for route in routes:
+            self._by_host.setdefault(route.host, []).append(route)
+        for host_routes in self._by_host.values():
+            host_routes.sort(key=lambda route: len(route.path_prefix), reverse=True)
+
+    @classmethod
+    def from_settings(cls, routes):
+        # routes: the "routes" list of the http_routing section in config.json
+        return cls([Route(entry["group"], entry.get("host"), entry.get("path_prefix", "/")) for entry in routes])
+
+    def __bool__(self):
+        return bool(self._by_host)
+
+    def route(self, message):
+        # Returns the group for a parsed request head, or None
+        path = request_path(message)
+        for host in (request_host(message), None):
+            for route in self._by_host.get(host, ()):
+                if path.startswith(route.path_prefix):
+                    return route.group
+        return None
@@ -0,0 +1,185 @@
+import mmap
+import os
+import struct
+import threading
+import time
+
+# Live stats shared through a memory-mapped file. The server process (each worker, in
+# pre-fork mode) copies its per-backend counters into its own slot of the file every
+# interval from a background thread; the dialog and `main top` map the same file and
+# read it, with no RPC to the server and no lock: every slot is a seqlock, i.e. the
+# writer bumps the slot's sequence number to odd before writing and back to even after,
+# and a reader retries a copy that saw an odd or changed sequence number. The data
+# plane is not involved at all: the publisher reads the lock-free metrics shards.
+#
+# File layout: a header, then `slots` slots of the same size. Each slot holds a slot
+# header (sequence, pid, backend count, update time, open client connections,
+# algorithm) and up to max_backends fixed-size backend records.
+
+MAGIC = b"MLBSTAT1"
+FILE_HEADER = struct.Struct("<8sII") # magic, slots, max_backends
+SLOT_HEADER = struct.Struct("<QIIdI32s") # sequence, pid, backends, updated (wall time), sessions, algorithm
+RECORD = struct.Struct("<i64sHbxIQ") # id, host, port, healthy (1, 0, -1 unknown), active connections, requests
+
+HEALTH = {1: "up", 0: "down", -1: "unknown"}
+
+
+def slot_size(max_backends):
+    return SLOT_HEADER.size + max_backends * RECORD.size
+
+
+def create_stats_file(path, slots=1, max_backends=1024):
+    # Called by the server process before it (forks workers and) starts writing
+    size = FILE_HEADER.size + slots * slot_size(max_backends)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(FILE_HEADER.pack(MAGIC, slots, max_backends))
+        f.truncate(size)
+    os.replace(temp_path, path) # Readers never map a half-initialised file
+
+
+def _encode(text, size):
+    return text.encode("utf-8", "replace")[:size]
+
+
+class StatsWriter:
+    def __init__(self, path, slot=0):
+        self.path = path
+        self.slot = slot
+        with open(path, "r+b") as f:
+            self._map = mmap.mmap(f.fileno(), 0)
+        magic, self.slots, self.max_backends = FILE_HEADER.unpack_from(self._map)
+        if magic != MAGIC or slot >= self.slots:
+            self._map.close()
+            raise ValueError(f"{path} is not a stats file with a slot {slot}.")
+        self._offset = FILE_HEADER.size + slot * slot_size(self.max_backends)
+        self._sequence = SLOT_HEADER.unpack_from(self._map, self._offset)[0] & ~1
+
+    def write(self, algorithm, sessions, backends, pid=None):
+        # backends: (id, host, port, healthy or None, active connections, requests) tuples
+        backends = backends[:self.max_backends]
+        records = bytearray(len(backends) * RECORD.size)
+        for index, (server_id, host, port, healthy, active, requests) in enumerate(backends):
+            RECORD.pack_into(records, index * RECORD.size, server_id, _encode(host, 64), port,
+                             -1 if healthy is None else int(healthy), max(0, int(active)), int(requests))
+        header = SLOT_HEADER.pack(0, os.getpid() if pid is None else pid, len(backends),
+                                  time.time(), max(0, int(sessions)), _encode(algorithm, 32))
+        offset = self._offset
+        self._sequence += 1
+        struct.pack_into("<Q", self._map, offset, self._sequence) # Odd: readers retry
+        self._map[offset + 8:offset + SLOT_HEADER.size] = header[8:] # All but the sequence
+        self._map[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + len(records)] = records
+        self._sequence += 1
+        struct.pack_into("<Q", self._map, offset, self._sequence)
+
+    def clear(self):
+        # Marks the slot as not in use (pid 0), e.g. when the server stops
+        self.write("", 0, [], pid=0)
+
+    def close(self):
+        self._map.close()
+
+
+def read_stats(path, retries=100):
+    # Returns one dict per slot in use; slots of processes that are gone are skipped.
+    # Raises OSError if there is no stats file and ValueError if it is not one.
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, slots, max_backends = FILE_HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a stats file.")
+        result = []
+        for slot in range(slots):
+            offset = FILE_HEADER.size + slot * slot_size(max_backends)
+            snapshot = _read_slot(data, offset, max_backends, retries)
+            if snapshot and _alive(snapshot["pid"]):
+                snapshot["slot"] = slot
+                result.append(snapshot)
+        return result
+    finally:
+        data.close()
+
+
+def _read_slot(data, offset, max_backends, retries):
+    for _ in range(retries):
+        sequence = SLOT_HEADER.unpack_from(data, offset)[0]
+        if sequence & 1:
+            time.sleep(0.0001) # Mid-write
+            continue
+        raw = data[offset:offset + slot_size(max_backends)]
+        if SLOT_HEADER.unpack_from(data, offset)[0] != sequence:
+            continue
+        _, pid, count, updated, sessions, algorithm = SLOT_HEADER.unpack_from(raw)
+        if not pid:
+            return None
+        backends = []
+        for index in range(min(count, max_backends)):
+            server_id, host, port, healthy, active, requests = RECORD.unpack_from(raw, SLOT_HEADER.size + index * RECORD.size)
+            backends.append({"id": server_id, "host": host.rstrip(b"\0").decode("utf-8", "replace"), "port": port,
+                             "health": HEALTH.get(healthy, "unknown"), "active": active, "requests": requests})
+        return {"pid": pid, "updated": updated, "sessions": sessions,
+                "algorithm": algorithm.rstrip(b"\0").decode("utf-8", "replace"), "backends": backends}
+    return None # Kept changing under us; the next read will do
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass # Running as another user
+    return True
+
+
+def merge_slots(slots):
+    # Sums the workers' counters per backend (host, port), in the order first seen
+    merged = {}
+    for slot in slots:
+        for backend in slot["backends"]:
+            key = (backend["host"], backend["port"])
+            total = merged.get(key)
+            if total is None:
+                merged[key] = dict(backend)
+                continue
+            total["active"] += backend["active"]
+            total["requests"] += backend["requests"]
+            if backend["health"] == "down" or total["health"] == "unknown":
+                total["health"] = backend["health"]
+    return list(merged.values())
+
+
+class StatsPublisher:
+    # Writes collect()'s snapshot to a StatsWriter every interval seconds
+    def __init__(self, writer, collect, interval=1.0):
+        self.writer = writer
+        self.collect = collect # Returns (algorithm, open client connections, backend tuples)
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def publish(self):
+        self.writer.write(*self.collect())
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="stats-publisher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(self.interval + 1)
+            self._thread = None
+        self.writer.clear()
+        self.writer.close()
+
+    def _run(self):
+        while True:
+            try:
+                self.publish()
+            except Exception as e:
+                print(f"Publishing live stats failed: {e}")
+            if self._stop_event.wait(self.interval):
+                return
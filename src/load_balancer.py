@@ -1,65 +1,175 @@
+import hashlib
+import heapq
+import importlib
+import itertools
+import random
+import threading
+import time
+
 
 class LoadBalancer:
+    # Members are kept in a dict keyed by id(server), so adding a server and removing
+    # the very object that was added are O(1) however many backends there are. Removing
+    # an equal copy (e.g. one rebuilt from config) still scans the members, since
+    # servers are mutable and may be edited in place while they are members.
+    # self.servers is an immutable tuple snapshot of them, built lazily on the first
+    # read after a change, so the handler threads calling get_next_server() always
+    # index a consistent snapshot and never need a lock, and loading N servers costs
+    # one O(N) snapshot rather than N. Every change bumps self.generation; algorithms
+    # with derived state (schedules, lookup tables) record the generation they built
+    # it from and rebuild when it moves. Writers (add/remove, config reloads)
+    # serialize on self._lock.
     def __init__(self):
-        self.servers = []
+        self._members = {} # id(server) -> server, in the order added
+        self._snapshot = ()
+        self.generation = 0
+        self._lock = threading.RLock()
+        self._next_ramp_step = None # Monotonic time of the next slow start step; None when nothing ramps
+        self.ramp_steps = 0 # Slow start steps taken so far
+
+    @property
+    def servers(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = tuple(self._members.values())
+                snapshot = self._snapshot
+        return snapshot
 
     def add_server(self, server):
-        self.servers.append(server)
+        with self._lock:
+            self._members[id(server)] = server
+            if self.slow_start:
+                now = time.monotonic()
+                self.slow_start.begin(server, now)
+                # Any other ramp's next step is at most one step away too
+                self._next_ramp_step = min(self._next_ramp_step or now + self.slow_start.step, now + self.slow_start.step)
+            self._changed()
 
     def remove_server(self, server_to_remove):
-        self.servers = [server for server in self.servers if server != server_to_remove]
+        with self._lock:
+            for server in self._matching(server_to_remove):
+                del self._members[id(server)]
+                if self.slow_start:
+                    self.slow_start.forget(server)
+            self._changed()
+
+    def _matching(self, server):
+        # Caller holds self._lock. Members equal to server: the live object itself is
+        # found in O(1); only an equal copy (e.g. rebuilt from config) needs a scan.
+        member = self._members.get(id(server))
+        if member is not None:
+            return [member]
+        return [member for member in self._members.values() if member == server]
+
+    def _changed(self):
+        # Caller holds self._lock
+        self._snapshot = None
+        self.generation += 1
+
+    # Slow start (see src/slow_start.py): set by build_load_balancer() when configured.
+    # Weighted algorithms scale a joining server's weight by _ramp_fraction(). The ramp
+    # moves in steps; picks call _check_ramp() only while a ramp is in progress, and it
+    # compares a timestamp until a step is due. A step bumps self.ramp_steps, and only
+    # the end of a server's ramp bumps the generation, so a step never rebuilds the
+    # derived state of the servers that are not ramping.
+    slow_start = None
+
+    def _ramp_fraction(self, server):
+        if self._next_ramp_step is None:
+            return 1.0
+        return self.slow_start.fraction(server, time.monotonic())
+
+    def _check_ramp(self):
+        # Returns the servers whose weight just changed (empty if no step was due)
+        next_step = self._next_ramp_step
+        if next_step is None or time.monotonic() < next_step:
+            return []
+        with self._lock:
+            now = time.monotonic()
+            if self._next_ramp_step is None or now < self._next_ramp_step: # Another thread took the step
+                return []
+            ramping = self.slow_start.ramping()
+            changed = [self._members[key] for key in ramping if key in self._members]
+            self._next_ramp_step = self.slow_start.next_step(now)
+            self.ramp_steps += 1
+            if len(self.slow_start.ramping()) != len(ramping):
+                self._changed() # Servers whose ramp ended are at full weight now
+            return changed
+
+    def end_slow_start(self):
+        # Gives every ramping server its full weight, e.g. once a new balancer has been
+        # loaded with servers that were serving traffic already
+        with self._lock:
+            if self.slow_start:
+                self.slow_start.clear()
+                self._next_ramp_step = None
+                self._changed()
+
+    # Algorithms that route by a per-client key set hash_key (see affinity_key()) and
+    # override get_server_for_key(); everything else ignores the key.
+    hash_key = None
 
     def get_next_server(self):
         raise NotImplementedError("Subclasses must implement this method")
 
+    def get_server_for_key(self, key):
+        return self.get_next_server()
+
+    # Feedback from ProxyServer. Every server it picks gets one on_connection_open() and,
+    # when the client session ends, one on_connection_close(). Algorithms that don't
+    # look at load ignore them.
+    def on_connection_open(self, server):
+        pass
+
+    def on_connection_close(self, server):
+        pass
+
+    def record_response_time(self, server, seconds):
+        pass
+
 class RoundRobinLoadBalancer(LoadBalancer):
     def __init__(self):
         super().__init__()
-        self.current_server_index = 0
-
-    def remove_server(self, server_to_remove):
-        super().remove_server(server_to_remove)
-        if self.servers and self.current_server_index >= len(self.servers):
-            self.current_server_index = 0 # Reset index if it's out of bounds
+        # next() on an itertools.count is a single atomic step under the GIL, so
+        # concurrent handlers each get a distinct position without locking
+        self._counter = itertools.count()
 
     def get_next_server(self):
-        if not self.servers:
+        servers = self.servers
+        if not servers:
             return None
-        server = self.servers[self.current_server_index]
-        self.current_server_index = (self.current_server_index + 1) % len(self.servers)
-        return server
+        return servers[next(self._counter) % len(servers)]
 
 class WeightedRoundRobinLoadBalancer(LoadBalancer):
+    # Classic interleaved WRR: in each round the current weight drops by the gcd of all
+    # weights and every server whose weight reaches it gets one pick. The full cycle is
+    # precomputed into a schedule when the server set changes, so a pick is one list
+    # index instead of a scan that can spin through max_weight/gcd rounds.
+    #
+    # Servers in a slow start ramp are left out of the schedule. While any ramps, a pick
+    # first runs smooth weighted round robin over the ramping servers and one entry that
+    # stands for the whole schedule (its total weight), and only picks from the schedule
+    # when that entry wins. A ramp step then recomputes just those few weights, and the
+    # schedule is only rebuilt when the servers outside a ramp or their weights change:
+    # not when a server joins with a ramp, only once it finishes it.
     def __init__(self):
         super().__init__()
-        self.current_weight_index = -1
-        self.current_server_index = -1
         self.max_weight = 0
         self.gcd_weight = 0
+        # (generation, schedule, counter, total weight, (id, weight) of its servers) swapped
+        # as one tuple; rebuilt lazily on the first pick after a change, since building it
+        # on every add_server would make loading N servers O(N^2)
+        self._schedule_state = (0, [], itertools.count(), 0, ())
+        self._ramp_state = (None, []) # ((generation, ramp_steps), [[current, weight, server or None]])
 
-    def add_server(self, server):
-        super().add_server(server)
-        self._recalculate_weights()
-        if self.servers:
-            self.current_weight_index = self.max_weight
-
-    def remove_server(self, server_to_remove):
-        super().remove_server(server_to_remove)
-        self._recalculate_weights()
-        if self.servers:
-            self.current_weight_index = self.max_weight
-            self.current_server_index = -1 # Reset index for WRR
-        else:
-            self.current_weight_index = -1
-            self.current_server_index = -1
-
-    def _recalculate_weights(self):
-        if not self.servers:
+    def _recalculate_weights(self, weights):
+        if not weights:
             self.max_weight = 0
             self.gcd_weight = 0
             return
 
-        weights = [s.weight for s in self.servers]
         self.max_weight = max(weights)
         self.gcd_weight = self._gcd_list(weights)
 
@@ -76,17 +186,611 @@ class WeightedRoundRobinLoadBalancer(LoadBalancer):
             result = self._gcd(result, numbers[i])
         return result
 
+    def _build_schedule(self, servers):
+        weights = [s.weight for s in servers]
+        self._recalculate_weights(weights)
+        if not self.gcd_weight: # All weights are zero: plain round robin
+            return list(servers), 0
+        rounds = [[s for s, weight in zip(servers, weights) if weight >= current_weight]
+                  for current_weight in range(self.max_weight, 0, -self.gcd_weight)]
+        schedule = [server for round_servers in rounds for server in round_servers]
+        # The first pick after a (re)build comes from the round below max_weight
+        start = len(rounds[0]) % len(schedule) if len(rounds) > 1 else 0
+        return schedule, start
+
+    def _rebuild_schedule(self):
+        with self._lock:
+            if self._schedule_state[0] != self.generation: # Another thread may have rebuilt it while we waited
+                servers = self.servers
+                if self._next_ramp_step is not None: # Ramping servers are picked by _pick_ramping()
+                    ramping = set(self.slow_start.ramping())
+                    servers = [s for s in servers if id(s) not in ramping]
+                members = tuple((id(s), s.weight) for s in servers)
+                if members == self._schedule_state[4]: # E.g. only a ramping server joined: keep the schedule
+                    self._schedule_state = (self.generation,) + self._schedule_state[1:]
+                else:
+                    schedule, start = self._build_schedule(servers)
+                    self._schedule_state = (self.generation, schedule, itertools.count(start), sum(s.weight for s in servers), members)
+            return self._schedule_state
+
+    def _ramp_entries(self, schedule, total_weight):
+        # Caller holds self._lock. Integer weights scaled by the ramp's resolution, so a
+        # weight-1 server really starts at min_fraction of its share.
+        resolution = self.slow_start.resolution
+        all_zero = not total_weight # The schedule is plain round robin
+        entries = [[0, (len(schedule) if all_zero else total_weight) * resolution, None]] if schedule else []
+        for key in self.slow_start.ramping():
+            server = self._members.get(key)
+            weight = server.weight or all_zero if server else 0
+            if weight:
+                entries.append([0, max(1, round(weight * resolution * self._ramp_fraction(server))), server])
+        return entries
+
+    def _pick_ramping(self, state):
+        # A ramping server, or None to pick from the schedule
+        with self._lock:
+            key = (self.generation, self.ramp_steps)
+            if self._ramp_state[0] != key:
+                self._ramp_state = (key, self._ramp_entries(state[1], state[3]))
+            entries = self._ramp_state[1]
+            if not entries:
+                return None
+            best = None
+            for entry in entries:
+                entry[0] += entry[1]
+                if best is None or entry[0] > best[0]:
+                    best = entry
+            best[0] -= sum(entry[1] for entry in entries)
+            return best[2]
+
     def get_next_server(self):
-        if not self.servers:
+        state = self._schedule_state
+        if self._next_ramp_step is not None: # Slow start in progress
+            self._check_ramp()
+            if state[0] != self.generation:
+                state = self._rebuild_schedule()
+            if self._next_ramp_step is not None:
+                server = self._pick_ramping(state)
+                if server is not None:
+                    return server
+        if state[0] != self.generation:
+            state = self._rebuild_schedule()
+        _, schedule, counter, _, _ = state
+        if not schedule:
             return None
+        return schedule[next(counter) % len(schedule)]
+
+class SmoothWeightedRoundRobinLoadBalancer(WeightedRoundRobinLoadBalancer):
+    # Spreads each server's picks evenly across the cycle instead of in bursts: weights
+    # 5/1/1 give a a a b c a a rather than a a a a b c a. Each pick goes to the server
+    # with the earliest virtual time (picks_so_far + 0.5) / weight, which is computed
+    # once per server-set change with a heap and stored in the same O(1) schedule.
+    MAX_SCHEDULE_SIZE = 1 << 20 # Larger cycles are approximated by scaling weights down
+
+    def _build_schedule(self, servers):
+        weights = [s.weight for s in servers]
+        self._recalculate_weights(weights)
+        if not self.gcd_weight:
+            return list(servers), 0
+        weights = [w // self.gcd_weight for w in weights]
+        total = sum(weights)
+        if total > self.MAX_SCHEDULE_SIZE:
+            weights = [max(1, w * self.MAX_SCHEDULE_SIZE // total) if w else 0 for w in weights]
+            total = sum(weights)
+        heap = [(0.5 / w, index, w) for index, w in enumerate(weights) if w]
+        heapq.heapify(heap)
+        schedule = []
+        for _ in range(total):
+            virtual_time, index, weight = heap[0]
+            schedule.append(servers[index])
+            heapq.heapreplace(heap, (virtual_time + 1.0 / weight, index, weight))
+        return schedule, 0
+
+class _IndexedHeap:
+    # Binary min-heap of [key, server] entries plus a position index keyed by server
+    # identity, so a server's key can be updated or removed in O(log n).
+    def __init__(self):
+        self.entries = []
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def peek(self):
+        return self.entries[0][1]
+
+    def push(self, server, key):
+        self.entries.append([key, server])
+        self.positions[id(server)] = len(self.entries) - 1
+        self._sift_up(len(self.entries) - 1)
+
+    def update(self, server, key):
+        index = self.positions[id(server)]
+        old_key = self.entries[index][0]
+        self.entries[index][0] = key
+        if key < old_key:
+            self._sift_up(index)
+        else:
+            self._sift_down(index)
+
+    def remove(self, server):
+        index = self.positions.pop(id(server), None)
+        if index is None:
+            return
+        last = self.entries.pop()
+        if index < len(self.entries):
+            self.entries[index] = last
+            self.positions[id(last[1])] = index
+            self._sift_up(index)
+            self._sift_down(self.positions[id(last[1])])
+
+    def _swap(self, i, j):
+        entries = self.entries
+        entries[i], entries[j] = entries[j], entries[i]
+        self.positions[id(entries[i][1])] = i
+        self.positions[id(entries[j][1])] = j
+
+    def _sift_up(self, index):
+        entries = self.entries
+        while index > 0:
+            parent = (index - 1) // 2
+            if entries[index][0] >= entries[parent][0]:
+                break
+            self._swap(index, parent)
+            index = parent
+
+    def _sift_down(self, index):
+        entries = self.entries
+        size = len(entries)
+        while True:
+            smallest = index
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < size and entries[child][0] < entries[smallest][0]:
+                    smallest = child
+            if smallest == index:
+                return
+            self._swap(index, smallest)
+            index = smallest
+
+class LeastConnectionsLoadBalancer(LoadBalancer):
+    # Picks the server with the fewest active connections relative to its weight.
+    # Ties go to the server picked least recently, so idle servers share load evenly.
+    def __init__(self):
+        super().__init__()
+        self.active_connections = {} # id(server) -> open connections reported by ProxyServer
+        self._last_pick = {} # id(server) -> pick sequence number, the tie-breaker
+        self._picks = 0
+        self._heap = _IndexedHeap() # Shared mutable state: picks and hooks take self._lock
+
+    def add_server(self, server):
+        with self._lock:
+            super().add_server(server)
+            self.active_connections[id(server)] = 0
+            self._last_pick[id(server)] = 0
+            self._heap.push(server, self._key(server))
+
+    def remove_server(self, server_to_remove):
+        with self._lock:
+            removed = self._matching(server_to_remove)
+            super().remove_server(server_to_remove)
+            for server in removed:
+                self._heap.remove(server)
+                self.active_connections.pop(id(server), None)
+                self._last_pick.pop(id(server), None)
+
+    def end_slow_start(self):
+        with self._lock:
+            super().end_slow_start()
+            for server in self._members.values():
+                self._heap.update(server, self._key(server))
+
+    def _key(self, server):
+        weight = max(server.weight, 1) * self._ramp_fraction(server)
+        return (self.active_connections[id(server)] / weight, self._last_pick[id(server)])
+
+    def get_next_server(self):
+        with self._lock:
+            for server in self._check_ramp(): # A slow start step raised their weights
+                self._heap.update(server, self._key(server))
+            if not self._heap:
+                return None
+            server = self._heap.peek()
+            self._picks += 1
+            self._last_pick[id(server)] = self._picks
+            self._heap.update(server, self._key(server))
+            return server
+
+    def on_connection_open(self, server):
+        with self._lock:
+            if id(server) in self.active_connections:
+                self.active_connections[id(server)] += 1
+                self._heap.update(server, self._key(server))
+
+    def on_connection_close(self, server):
+        with self._lock:
+            if self.active_connections.get(id(server), 0) > 0:
+                self.active_connections[id(server)] -= 1
+                self._heap.update(server, self._key(server))
+
+class LeastResponseTimeLoadBalancer(LeastConnectionsLoadBalancer):
+    # Scores each server by its EWMA response time times (active connections + 1), so a
+    # fast server takes more load until its queue makes it as slow as the others.
+    # A server with no samples yet stands in with the pool's mean until its first one,
+    # so a new server is not flooded for scoring 0; before the first sample anywhere,
+    # every server scores (active + 1) / weight, as in least connections.
+    def __init__(self, decay=0.3):
+        self.decay = decay # Weight of the newest sample in the moving average
+        self.response_times = {} # id(server) -> EWMA of response time in seconds, or the seeded mean
+        self._sampled = set() # id(server) of servers with a sample of their own
+        super().__init__()
+
+    def add_server(self, server):
+        with self._lock:
+            if self._sampled:
+                self.response_times[id(server)] = self._mean_response_time()
+            super().add_server(server)
+
+    def remove_server(self, server_to_remove):
+        with self._lock:
+            for server in self._matching(server_to_remove):
+                self.response_times.pop(id(server), None)
+                self._sampled.discard(id(server))
+            super().remove_server(server_to_remove)
+
+    def _mean_response_time(self):
+        return sum(self.response_times[key] for key in self._sampled) / len(self._sampled)
+
+    def _key(self, server):
+        active = self.active_connections[id(server)]
+        weight = max(server.weight, 1) * self._ramp_fraction(server)
+        score = self.response_times.get(id(server), 1.0) * (active + 1) / weight
+        return (score, active, self._last_pick[id(server)])
 
+    def record_response_time(self, server, seconds):
+        with self._lock:
+            if id(server) not in self.active_connections:
+                return
+            if id(server) not in self._sampled: # A seeded mean is only a stand-in
+                self._sampled.add(id(server))
+                self.response_times[id(server)] = seconds
+                if len(self._sampled) == 1: # The pool's first sample seeds the other servers
+                    for other in self.servers:
+                        if id(other) not in self._sampled:
+                            self.response_times[id(other)] = seconds
+                            self._heap.update(other, self._key(other))
+            else:
+                previous = self.response_times[id(server)]
+                self.response_times[id(server)] = self.decay * seconds + (1 - self.decay) * previous
+            self._heap.update(server, self._key(server))
+
+class PowerOfTwoChoicesLoadBalancer(LoadBalancer):
+    # Power of two random choices (Mitzenmacher): sample two servers at random and take
+    # the one with fewer active connections relative to its weight. Almost as even as
+    # least connections, but a pick reads two counters from a snapshot instead of
+    # taking a lock and reordering a heap; only the open/close feedback takes the lock.
+    def __init__(self):
+        super().__init__()
+        self.active_connections = {} # id(server) -> open connections reported by ProxyServer
+
+    def add_server(self, server):
+        with self._lock:
+            super().add_server(server)
+            self.active_connections.setdefault(id(server), 0)
+
+    def remove_server(self, server_to_remove):
+        with self._lock:
+            for server in self._matching(server_to_remove):
+                self.active_connections.pop(id(server), None)
+            super().remove_server(server_to_remove)
+
+    def get_next_server(self):
+        servers = self.servers
+        count = len(servers)
+        if count < 2:
+            return servers[0] if servers else None
+        first = int(random.random() * count) # Cheaper than randrange()
+        second = int(random.random() * (count - 1))
+        if second >= first: # Two distinct servers
+            second += 1
+        a, b = servers[first], servers[second]
+        weight_a, weight_b = a.weight or 1, b.weight or 1
+        if self._next_ramp_step is not None: # Slow start in progress
+            self._check_ramp()
+            weight_a *= self._ramp_fraction(a)
+            weight_b *= self._ramp_fraction(b)
+        active = self.active_connections
+        if active.get(id(b), 0) * weight_a < active.get(id(a), 0) * weight_b:
+            return b
+        return a
+
+    def on_connection_open(self, server):
+        with self._lock:
+            if id(server) in self.active_connections:
+                self.active_connections[id(server)] += 1
+
+    def on_connection_close(self, server):
+        with self._lock:
+            if self.active_connections.get(id(server), 0) > 0:
+                self.active_connections[id(server)] -= 1
+
+def stable_hash(value):
+    # Same value -> same 64-bit hash in every process and across restarts (unlike hash())
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+def affinity_key(hash_key, client_address, request_head=None):
+    # hash_key is "client_ip", "header:<Name>" or "cookie:<name>"; falls back to the
+    # client IP when the request has no such header/cookie.
+    client_ip = client_address[0] if client_address else ""
+    kind, _, name = (hash_key or "client_ip").partition(":")
+    if request_head is not None and name:
+        if kind == "header":
+            value = request_head.get_header(name)
+            if value:
+                return value
+        elif kind == "cookie":
+            for cookie in (request_head.get_header("cookie") or "").split(";"):
+                cookie_name, _, value = cookie.strip().partition("=")
+                if cookie_name == name and value:
+                    return value
+    return client_ip
+
+def _next_prime(n):
+    candidate = max(n, 2)
+    while any(candidate % d == 0 for d in range(2, int(candidate ** 0.5) + 1)):
+        candidate += 1
+    return candidate
+
+class MaglevLoadBalancer(LoadBalancer):
+    # Maglev consistent hashing (Eisenbud et al., NSDI 2016). Every backend walks its own
+    # permutation of a prime-sized lookup table, taking turns claiming free slots
+    # (weight slots per turn), so each owns an even share. A lookup is one hash and one
+    # list index, and when a backend is added or removed only about 1/N of the slots,
+    # and so of the client keys, change owner.
+    def __init__(self, hash_key="client_ip", table_size=None):
+        super().__init__()
+        self.hash_key = hash_key
+        self.table_size = table_size # None = 65537, doubled while below 100 slots per backend
+        self._table = (0, []) # (generation, table); rebuilt lazily on the first lookup after a change
+        self._counter = itertools.count() # Used by key-less picks (e.g. dialog "Send Request")
+
+    def _lookup_table(self):
+        generation, table = self._table
+        if generation != self.generation:
+            with self._lock:
+                if self._table[0] != self.generation:
+                    self._table = (self.generation, self._build_table(self.servers))
+                table = self._table[1]
+        return table
+
+    @staticmethod
+    def _default_table_size(backends):
+        # The size must not track the backend count exactly: a new size remaps every key
+        size = 65536
+        while size < 100 * backends:
+            size *= 2
+        return _next_prime(size)
+
+    def _build_table(self, servers):
+        weights = [max(s.weight, 0) for s in servers]
+        if not any(weights):
+            weights = [1] * len(servers)
+        members = [(s, w) for s, w in zip(servers, weights) if w]
+        if not members:
+            return []
+        size = self.table_size or self._default_table_size(len(members))
+        offsets, skips = [], []
+        for server, _ in members:
+            name = f"{server.host}:{server.port}" # Survives ID renumbering and reordering
+            offsets.append(stable_hash("offset/" + name) % size)
+            skips.append(stable_hash("skip/" + name) % (size - 1) + 1)
+
+        table = [None] * size
+        next_index = [0] * len(members)
+        filled = 0
         while True:
-            self.current_server_index = (self.current_server_index + 1) % len(self.servers)
-            if self.current_server_index == 0:
-                self.current_weight_index -= self.gcd_weight
-                if self.current_weight_index <= 0:
-                    self.current_weight_index = self.max_weight
+            for i, (server, weight) in enumerate(members):
+                offset, skip = offsets[i], skips[i]
+                for _ in range(weight):
+                    slot = (offset + next_index[i] * skip) % size
+                    while table[slot] is not None:
+                        next_index[i] += 1
+                        slot = (offset + next_index[i] * skip) % size
+                    table[slot] = server
+                    next_index[i] += 1
+                    filled += 1
+                    if filled == size:
+                        return table
+
+    def get_server_for_key(self, key):
+        table = self._lookup_table()
+        if not table:
+            return None
+        return table[stable_hash(key) % len(table)]
+
+    def get_next_server(self):
+        table = self._lookup_table()
+        if not table:
+            return None
+        return table[next(self._counter) % len(table)]
+
+class GroupedLoadBalancer(LoadBalancer):
+    # One balancer over every server plus one per backend group (BackendServer.group),
+    # all built by factory, so HTTP routes can pick within a group. Adds and removes
+    # (reloads, health checks) reach both. Picks and feedback through this object use
+    # the all-servers balancer; ProxyServer sends feedback for a group pick to group().
+    def __init__(self, factory):
+        super().__init__()
+        self.factory = factory
+        self.all = factory()
+        self.groups = {} # group name -> balancer
+        self.hash_key = self.all.hash_key
+
+    @property
+    def servers(self):
+        return self.all.servers
+
+    def add_server(self, server):
+        with self._lock:
+            self.all.add_server(server)
+            if server.group is not None:
+                if server.group not in self.groups:
+                    self.groups[server.group] = self.factory()
+                self.groups[server.group].add_server(server)
+            self._changed()
+
+    def remove_server(self, server_to_remove):
+        with self._lock:
+            self.all.remove_server(server_to_remove)
+            group = self.groups.get(server_to_remove.group)
+            if group:
+                group.remove_server(server_to_remove)
+            self._changed()
+
+    def end_slow_start(self):
+        for balancer in [self.all, *self.groups.values()]:
+            balancer.end_slow_start()
+
+    def group(self, name):
+        # None if no server was ever configured in the group
+        return self.groups.get(name)
+
+    def get_next_server(self):
+        return self.all.get_next_server()
+
+    def get_server_for_key(self, key):
+        return self.all.get_server_for_key(key)
+
+    def on_connection_open(self, server):
+        self.all.on_connection_open(server)
+
+    def on_connection_close(self, server):
+        self.all.on_connection_close(server)
+
+    def record_response_time(self, server, seconds):
+        self.all.record_response_time(server, seconds)
+
+class TieredLoadBalancer(LoadBalancer):
+    # Named backend pools in failover order, each with its own balancer built by its
+    # factory. A server joins the pool named by its group (the first pool if it has no
+    # group or names no pool). Traffic goes to the first pool with at least min_healthy
+    # servers in rotation, so a secondary takes over only once the primary is short of
+    # capacity; if none qualifies, the first pool with any server left is used. Health
+    # ejections and config changes both arrive as add/remove calls, and the active pool
+    # is chosen again on each of them, so a pick is just a pick from that pool.
+    def __init__(self, pools):
+        # pools: [(name, factory, min_healthy)], primary first
+        super().__init__()
+        if not pools:
+            raise ValueError("At least one backend pool is needed.")
+        self.pools = [(name, factory(), min_healthy) for name, factory, min_healthy in pools]
+        self._by_name = {name: balancer for name, balancer, _ in self.pools}
+        self._pool_of = {} # id(server) -> the balancer of its pool
+        self.active = self.pools[0][1]
+
+    @property
+    def hash_key(self):
+        # Whatever the active pool's algorithm routes by, so a hashing pool gets affinity
+        # keys after a failover and a non-hashing one is not asked to compute them
+        return self.active.hash_key
+
+    def add_server(self, server):
+        with self._lock:
+            balancer = self._by_name.get(server.group, self.pools[0][1])
+            balancer.add_server(server)
+            self._pool_of[id(server)] = balancer
+            super().add_server(server)
+
+    def remove_server(self, server_to_remove):
+        with self._lock:
+            for server in self._matching(server_to_remove):
+                self._pool_of.pop(id(server)).remove_server(server)
+            super().remove_server(server_to_remove)
+
+    def _changed(self):
+        super()._changed()
+        fallback = None
+        for _, balancer, min_healthy in self.pools:
+            healthy = len(balancer._members)
+            if healthy and healthy >= min_healthy:
+                self.active = balancer
+                return
+            if healthy and fallback is None:
+                fallback = balancer
+        self.active = fallback or self.pools[0][1]
+
+    def end_slow_start(self):
+        for _, balancer, _ in self.pools:
+            balancer.end_slow_start()
+
+    def active_pool(self):
+        for name, balancer, _ in self.pools:
+            if balancer is self.active:
+                return name
+
+    def get_next_server(self):
+        return self.active.get_next_server()
+
+    def get_server_for_key(self, key):
+        return self.active.get_server_for_key(key)
+
+    # Feedback goes to the pool the server is in, whether or not it is the active one
+    def on_connection_open(self, server):
+        balancer = self._pool_of.get(id(server))
+        if balancer:
+            balancer.on_connection_open(server)
+
+    def on_connection_close(self, server):
+        balancer = self._pool_of.get(id(server))
+        if balancer:
+            balancer.on_connection_close(server)
+
+    def record_response_time(self, server, seconds):
+        balancer = self._pool_of.get(id(server))
+        if balancer:
+            balancer.record_response_time(server, seconds)
+
+ALGORITHMS = {
+    "round_robin": RoundRobinLoadBalancer,
+    "weighted_round_robin": WeightedRoundRobinLoadBalancer,
+    "smooth_weighted_round_robin": SmoothWeightedRoundRobinLoadBalancer,
+    "least_connections": LeastConnectionsLoadBalancer,
+    "least_response_time": LeastResponseTimeLoadBalancer,
+    "maglev": MaglevLoadBalancer,
+    "power_of_two_choices": PowerOfTwoChoicesLoadBalancer,
+}
+
+# Plugins: a module named in load_balancer.plugins (config.json) is imported at startup
+# and registers its LoadBalancer subclasses by name, after which "algorithm" can name
+# them like the built-in ones:
+#
+#     @register_algorithm("my_algorithm")
+#     class MyLoadBalancer(LoadBalancer): ...
+
+def register_algorithm(name, cls=None):
+    # Usable directly or as a class decorator
+    if cls is None:
+        return lambda cls: register_algorithm(name, cls)
+    if not (isinstance(cls, type) and issubclass(cls, LoadBalancer)):
+        raise TypeError(f"Algorithm '{name}' must be a LoadBalancer subclass, not {cls!r}.")
+    if ALGORITHMS.get(name, cls) is not cls:
+        raise ValueError(f"Load balancing algorithm '{name}' is already registered.")
+    ALGORITHMS[name] = cls
+    return cls
 
-            if self.servers[self.current_server_index].weight >= self.current_weight_index:
-                return self.servers[self.current_server_index]
+def load_plugins(modules):
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except Exception as e: # A plugin can fail in any way while it imports
+            raise ValueError(f"Cannot load load balancer plugin '{module}': {e}")
 
+def algorithm_name(load_balancer):
+    # The name the balancer is configured by; wrappers report the algorithm picking for them
+    if isinstance(load_balancer, GroupedLoadBalancer):
+        load_balancer = load_balancer.all
+    elif isinstance(load_balancer, TieredLoadBalancer):
+        load_balancer = load_balancer.active
+    for name, cls in ALGORITHMS.items():
+        if type(load_balancer) is cls:
+            return name
+    return type(load_balancer).__name__
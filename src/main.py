@@ -1,20 +1,72 @@
+import argparse
+import contextlib
 import json
 import os
+import signal
 import subprocess
 import sys
 import threading
 import time
-import socket # Added for status check
 
-from src.backend_server import BackendServer
-from src.load_balancer import RoundRobinLoadBalancer, WeightedRoundRobinLoadBalancer
+from src.access_log import AccessLog
+from src.admission import AdmissionController
+from src.backend_server import BackendRegistry, BackendServer
+from src.config_watcher import ConfigWatcher
+from src.connection_pool import ConnectionPool
+from src.health_checker import HealthChecker, probe_servers
+from src.http_cache import HttpCache
+from src.http_router import HttpRouter
+from src.live_stats import StatsPublisher, StatsWriter, create_stats_file, merge_slots, read_stats
+from src.load_balancer import ALGORITHMS, GroupedLoadBalancer, TieredLoadBalancer, algorithm_name, load_plugins
+from src.metrics import MetricsServer, backend_label
+from src.outlier_detector import OutlierDetector
 from src.proxy_server import ProxyServer
+from src.slow_start import SlowStart
+from src.tls import TlsTerminator, backend_context, server_context
+from src.workers import WorkerSupervisor, resolve_worker_count
 
 CONFIG_FILE = "config.json"
 PID_FILE = "magiclb.pid" # Define PID file path
-
-def save_config(servers, listening_port):
-    config_data = {
+STATS_FILE = "magiclb.stats" # Live stats the running service shares with the dialog and `top`
+# Algorithms offered by the dialog's menu: (label, name in ALGORITHMS)
+DIALOG_ALGORITHMS = [
+    ("Round Robin", "round_robin"),
+    ("Weighted Round Robin", "weighted_round_robin"),
+    ("Least Connections", "least_connections"),
+    ("Least Response Time", "least_response_time"),
+    ("Smooth Weighted Round Robin", "smooth_weighted_round_robin"),
+    ("Consistent Hashing (Maglev)", "maglev"),
+    ("Power of Two Choices", "power_of_two_choices"),
+]
+RELOADABLE_SECTIONS = ("load_balancer", "http_routing", "failover") # Applied by a reload; everything else needs a restart
+
+_reload_lock = threading.RLock() # SIGHUP and the config watcher may both trigger a reload
+
+def _read_config_file():
+    if not os.path.exists(CONFIG_FILE):
+        return {}
+    try:
+        with open(CONFIG_FILE, 'r') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, IOError):
+        return {}
+
+def load_settings():
+    # Everything in config.json besides the port and the server list (e.g. the "proxy" section)
+    config_data = _read_config_file()
+    config_data.pop("listening_port", None)
+    config_data.pop("backend_servers", None)
+    return config_data
+
+def save_config(servers, listening_port, algorithm_settings=None):
+    # algorithm_settings: a new load_balancer section; None keeps the saved one
+    config_data = _read_config_file() # Keep sections the dialog does not edit
+    if algorithm_settings is not None:
+        # Keep settings the dialog does not ask for: plugins and slow start
+        previous = config_data.get("load_balancer", {})
+        kept = {name: previous[name] for name in ("plugins", "slow_start") if name in previous}
+        config_data["load_balancer"] = {**kept, **algorithm_settings}
+    config_data.update({
         "listening_port": listening_port,
         "backend_servers": [
             {
@@ -22,17 +74,34 @@ def save_config(servers, listening_port):
                 "host": server.host,
                 "port": server.port,
                 "protocol": server.protocol,
-                "weight": server.weight
+                "weight": server.weight,
+                **({"group": server.group} if server.group is not None else {})
             } for server in servers
         ]
-    }
+    })
     try:
-        with open(CONFIG_FILE, 'w') as f:
+        # Write a temporary file and rename it so a running load balancer never reloads a half-written file
+        temp_file = f"{CONFIG_FILE}.tmp"
+        with open(temp_file, 'w') as f:
             json.dump(config_data, f, indent=4)
+        os.replace(temp_file, CONFIG_FILE)
         print(f"Configuration saved to {CONFIG_FILE}")
     except IOError as e:
         print(f"Error saving configuration: {e}")
 
+def _servers_from_config(config_data):
+    servers = []
+    for s_data in config_data.get("backend_servers", []):
+        servers.append(BackendServer(
+            s_data["id"],
+            s_data["host"],
+            s_data["port"],
+            s_data.get("protocol", "http"), # Default to http for backward compatibility
+            s_data.get("weight", 1),
+            s_data.get("group")
+        ))
+    return servers
+
 def load_config():
     if not os.path.exists(CONFIG_FILE):
         print("No existing configuration found. Starting with empty settings.")
@@ -42,16 +111,7 @@ def load_config():
             config_data = json.load(f)
         
         listening_port = config_data.get("listening_port")
-        backend_servers_data = config_data.get("backend_servers", [])
-        servers = []
-        for s_data in backend_servers_data:
-            servers.append(BackendServer(
-                s_data["id"],
-                s_data["host"],
-                s_data["port"],
-                s_data.get("protocol", "http"), # Default to http for backward compatibility
-                s_data.get("weight", 1)
-            ))
+        servers = _servers_from_config(config_data)
         print(f"Configuration loaded from {CONFIG_FILE}")
         return listening_port, servers
     except json.JSONDecodeError as e:
@@ -78,14 +138,98 @@ def check_lb_status():
             return "Stopped (PID file corrupt)", None
     return "Stopped", None
 
-def check_backend_server_status(host, port, timeout=1):
+def backend_status_report(servers, timeout=1.0, deadline=None):
+    # Probes every backend at once (see probe_servers); one entry per backend, in config order
+    return [{
+        "id": server.id,
+        "host": server.host,
+        "port": server.port,
+        "protocol": server.protocol,
+        "reachable": reachable,
+        "latency_ms": round(latency * 1000, 3) if latency is not None else None,
+        "error": error,
+    } for server, reachable, latency, error in probe_servers(servers, timeout, deadline)]
+
+def run_status_mode(argv):
+    # Non-interactive status for monitoring scripts: JSON on stdout, exit status 1 if
+    # the service is down or any backend is unreachable
+    parser = argparse.ArgumentParser(prog="python3 -m src.main status", description="Print service and backend status as JSON.")
+    parser.add_argument("--timeout", type=float, default=1.0, help="seconds per backend connect")
+    parser.add_argument("--deadline", type=float, default=None, help="seconds for the whole check (default: enough for every backend to get --timeout)")
+    args = parser.parse_args(argv)
+    with contextlib.redirect_stdout(sys.stderr): # Keep stdout pure JSON
+        listening_port, servers = load_config()
+    lb_status, pid = check_lb_status()
+    backends = backend_status_report(servers, args.timeout, args.deadline)
+    unreachable = sum(1 for backend in backends if not backend["reachable"])
+    json.dump({
+        "service": {"status": lb_status, "pid": pid, "listening_port": listening_port},
+        "backends": backends,
+        "reachable": len(backends) - unreachable,
+        "unreachable": unreachable,
+    }, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 0 if pid and not unreachable else 1
+
+def read_live_stats(settings=None):
+    # Slots of the running service's live stats file; [] if it is not running or shares none
+    path = (settings or {}).get("stats", {}).get("path", STATS_FILE)
+    try:
+        return read_stats(path)
+    except (OSError, ValueError):
+        return []
+
+def live_stats_lines(slots, previous=None, elapsed=None):
+    # Table of the live load per backend, summed over worker processes. With the
+    # request totals of an earlier read (previous) elapsed seconds ago, adds req/s.
+    backends = merge_slots(slots)
+    algorithms = sorted({slot["algorithm"] for slot in slots})
+    age = time.time() - max(slot["updated"] for slot in slots)
+    total_active = sum(backend["active"] for backend in backends)
+    lines = [f"{len(slots)} process(es), algorithm: {', '.join(algorithms)}, "
+             f"{sum(slot['sessions'] for slot in slots)} client connections, updated {age:.1f}s ago",
+             f"{'ID':>4}  {'BACKEND':<28}{'HEALTH':<9}{'ACTIVE':>8}{'SHARE':>8}{'REQUESTS':>12}{'REQ/S':>9}"]
+    for backend in backends:
+        share = 100.0 * backend["active"] / total_active if total_active else 0.0
+        rate = ""
+        if previous is not None and elapsed:
+            before = previous.get((backend["host"], backend["port"]), backend["requests"])
+            rate = f"{(backend['requests'] - before) / elapsed:.1f}"
+        lines.append(f"{backend['id']:>4}  {backend['host'] + ':' + str(backend['port']):<28}{backend['health']:<9}"
+                     f"{backend['active']:>8}{share:>7.1f}%{backend['requests']:>12}{rate:>9}")
+    return lines
+
+def run_top_mode(argv):
+    # Live per-backend load of the running service, refreshed like top(1); reads the
+    # shared stats file, so it costs the service nothing
+    parser = argparse.ArgumentParser(prog="python3 -m src.main top", description="Watch the live load of the running service.")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between refreshes")
+    parser.add_argument("--once", action="store_true", help="print the table once and exit")
+    args = parser.parse_args(argv)
+    settings = load_settings()
+    previous, previous_at = None, None
     try:
-        with socket.create_connection((host, port), timeout=timeout):
-            return "Reachable"
-    except (socket.timeout, ConnectionRefusedError, OSError):
-        return "Unreachable"
+        while True:
+            slots = read_live_stats(settings)
+            if not slots:
+                print("No live stats: magicLB is not running, or stats.enabled is false.")
+                return 1
+            now = time.monotonic()
+            lines = live_stats_lines(slots, previous, now - previous_at if previous_at else None)
+            if args.once:
+                print("\n".join(lines))
+                return 0
+            sys.stdout.write("\x1b[H\x1b[2J" + "\n".join(lines) + "\n") # Clear the screen, then draw
+            sys.stdout.flush()
+            previous = {(backend["host"], backend["port"]): backend["requests"] for backend in merge_slots(slots)}
+            previous_at = now
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        return 0
 
 def run_dialog_mode(listening_port, servers, load_balancer):
+    # servers: a BackendRegistry; IDs stay stable across edits and deletes
+    algorithm_settings = None # The load_balancer section once an algorithm is picked here
     while True:
         print("\n--- Main Menu ---")
         print("1. Add Backend Server")
@@ -95,7 +239,7 @@ def run_dialog_mode(listening_port, servers, load_balancer):
         print("5. Edit Backend Server")
         print("6. Delete Backend Server")
         print("7. Set Local Listening Port")
-        print("8. Restart Load Balancer")
+        print("8. Apply Configuration to Running Load Balancer")
         print("9. Save Configuration")
         print("10. Show Status")
         print("11. Exit")
@@ -105,38 +249,46 @@ def run_dialog_mode(listening_port, servers, load_balancer):
         if choice == '1':
             # Add Server logic
             try:
-                server_id = len(servers) + 1
                 host = input("Enter server host (e.g., 127.0.0.1): ")
                 protocol = input("Enter server protocol (e.g., http, https, tcp, default http): ").lower() or "http"
                 port = int(input("Enter server port (e.g., 8000): "))
                 weight = int(input("Enter server weight (for Weighted Round Robin, default 1): "))
-                new_server = BackendServer(server_id, host, port, protocol, weight)
-                servers.append(new_server)
+            except ValueError:
+                print("Invalid input. Please enter valid numbers for port and weight.")
+                continue
+            try:
+                new_server = servers.add(host, port, protocol, weight) # Next unused ID
                 if load_balancer: # If an algorithm is already selected, add server to it
                     load_balancer.add_server(new_server)
                 print(f"Server {new_server} added.")
-            except ValueError:
-                print("Invalid input. Please enter valid numbers for port and weight.")
+            except ValueError as e:
+                print(f"Server not added: {e}")
             except Exception as e:
                 print(f"An error occurred: {e}")
 
         elif choice == '2':
             # Select Algorithm logic
             print("\n--- Select Algorithm ---")
-            print("1. Round Robin")
-            print("2. Weighted Round Robin")
+            for number, (label, _) in enumerate(DIALOG_ALGORITHMS, 1):
+                print(f"{number}. {label}")
+            print(f"{len(DIALOG_ALGORITHMS) + 1}. Other (registered by a plugin)")
             algo_choice = input("Enter algorithm choice: ")
 
-            if algo_choice == '1':
-                load_balancer = RoundRobinLoadBalancer()
-                for server in servers:
-                    load_balancer.add_server(server)
-                print("Round Robin algorithm selected.")
-            elif algo_choice == '2':
-                load_balancer = WeightedRoundRobinLoadBalancer()
-                for server in servers:
-                    load_balancer.add_server(server)
-                print("Weighted Round Robin algorithm selected.")
+            algorithm = None
+            if algo_choice.isdigit() and 1 <= int(algo_choice) <= len(DIALOG_ALGORITHMS):
+                label, algorithm = DIALOG_ALGORITHMS[int(algo_choice) - 1]
+            elif algo_choice == str(len(DIALOG_ALGORITHMS) + 1):
+                algorithm = label = input(f"Algorithm name ({', '.join(sorted(ALGORITHMS))}): ")
+            if algorithm:
+                selected = {"algorithm": algorithm}
+                if algorithm == "maglev":
+                    selected["hash_key"] = input("Hash on (client_ip, header:<Name>, cookie:<name>, default client_ip): ") or "client_ip"
+                try:
+                    load_balancer = build_load_balancer(servers, {"load_balancer": selected})
+                    algorithm_settings = selected # Saved to config.json with the servers
+                    print(f"{label} algorithm selected.")
+                except ValueError as e:
+                    print(f"Error: {e}")
             else:
                 print("Invalid algorithm choice.")
 
@@ -169,34 +321,28 @@ def run_dialog_mode(listening_port, servers, load_balancer):
                 continue
             try:
                 server_id_to_edit = int(input("Enter the ID of the server to edit: "))
-                server_found = False
-                for i, server in enumerate(servers):
-                    if server.id == server_id_to_edit:
-                        print(f"Editing Server: {server}")
-                        new_host = input(f"Enter new host (current: {server.host}): ") or server.host
-                        new_protocol = input(f"Enter new protocol (current: {server.protocol}, default http): ").lower() or server.protocol
-                        new_port = input(f"Enter new port (current: {server.port}): ")
-                        new_weight = input(f"Enter new weight (current: {server.weight}, default 1): ")
-
-                        server.host = new_host
-                        server.protocol = new_protocol
-                        server.port = int(new_port) if new_port else server.port
-                        server.weight = int(new_weight) if new_weight else server.weight
-
-                        # If load balancer is active, update the server in it
-                        if load_balancer:
-                            # For simplicity, we'll re-add the server to update its properties
-                            # A more robust solution might involve specific update methods in load_balancer
-                            load_balancer.remove_server(server) # Remove old instance
-                            load_balancer.add_server(server)    # Add updated instance
-
-                        print(f"Server {server.id} updated to: {server}")
-                        server_found = True
-                        break
-                if not server_found:
+                server = servers.get(server_id_to_edit)
+                if server is None:
                     print(f"Server with ID {server_id_to_edit} not found.")
-            except ValueError:
-                print("Invalid input. Please enter valid numbers for ID, port, and weight.")
+                    continue
+                print(f"Editing Server: {server}")
+                new_host = input(f"Enter new host (current: {server.host}): ") or server.host
+                new_protocol = input(f"Enter new protocol (current: {server.protocol}, default http): ").lower() or server.protocol
+                new_port = input(f"Enter new port (current: {server.port}): ")
+                new_weight = input(f"Enter new weight (current: {server.weight}, default 1): ")
+
+                servers.update(server.id, host=new_host, protocol=new_protocol,
+                               port=int(new_port) if new_port else server.port,
+                               weight=int(new_weight) if new_weight else server.weight)
+
+                # If load balancer is active, re-add the server so it rebuilds with the new properties
+                if load_balancer:
+                    load_balancer.remove_server(server)
+                    load_balancer.add_server(server)
+
+                print(f"Server {server.id} updated to: {server}")
+            except ValueError as e:
+                print(f"Server not updated: {e}")
             except Exception as e:
                 print(f"An error occurred: {e}")
 
@@ -207,20 +353,13 @@ def run_dialog_mode(listening_port, servers, load_balancer):
                 continue
             try:
                 server_id_to_delete = int(input("Enter the ID of the server to delete: "))
-                server_found = False
-                for i, server in enumerate(servers):
-                    if server.id == server_id_to_delete:
-                        if load_balancer:
-                            load_balancer.remove_server(server)
-                        servers.pop(i)
-                        print(f"Server {server.id} deleted.")
-                        server_found = True
-                        # Re-assign IDs to maintain sequential order after deletion
-                        for j in range(i, len(servers)):
-                            servers[j].id = j + 1
-                        break
-                if not server_found:
+                server = servers.remove(server_id_to_delete) # Other servers keep their IDs
+                if server is None:
                     print(f"Server with ID {server_id_to_delete} not found.")
+                    continue
+                if load_balancer:
+                    load_balancer.remove_server(server)
+                print(f"Server {server.id} deleted.")
             except ValueError:
                 print("Invalid input. Please enter a valid integer for ID.")
             except Exception as e:
@@ -240,19 +379,22 @@ def run_dialog_mode(listening_port, servers, load_balancer):
                 print("Invalid port number. Please enter a valid integer.")
 
         elif choice == '8':
-            # Restart Load Balancer
-            print("Restarting magicLB...")
-            save_config(servers, listening_port) # Save current state before restarting
-            try:
-                subprocess.run(["./runServer.sh", "restart"], check=True)
-                print("magicLB restart command sent.")
-            except subprocess.CalledProcessError as e:
-                print(f"Error executing restart command: {e}")
-            except FileNotFoundError:
-                print("Error: runServer.sh script not found. Make sure it's in the same directory and executable.")
+            # Reload the running service in place; open connections are not dropped
+            save_config(servers, listening_port, algorithm_settings) # The service reloads from config.json
+            lb_status, pid = check_lb_status()
+            if not pid:
+                print(f"magicLB is not running ({lb_status}). Start it with ./runServer.sh start.")
+            else:
+                try:
+                    subprocess.run(["./runServer.sh", "reload"], check=True)
+                    print("magicLB reload command sent. Listening port changes need ./runServer.sh restart.")
+                except subprocess.CalledProcessError as e:
+                    print(f"Error executing reload command: {e}")
+                except FileNotFoundError:
+                    print("Error: runServer.sh script not found. Make sure it's in the same directory and executable.")
 
         elif choice == '9':
-            save_config(servers, listening_port)
+            save_config(servers, listening_port, algorithm_settings)
 
         elif choice == '10':
             # Show Status
@@ -263,60 +405,433 @@ def run_dialog_mode(listening_port, servers, load_balancer):
             print(f"Listening IP: 0.0.0.0") # Proxy listens on all interfaces
             print(f"Listening Port: {listening_port if listening_port else 'Not Set'}")
 
+            slots = read_live_stats(load_settings()) if pid else []
+            if slots:
+                print("\n--- Live Load (from the running service) ---")
+                for line in live_stats_lines(slots):
+                    print(line)
+
             print("\n--- Backend Server Status ---")
             if not servers:
                 print("No backend servers configured.")
             else:
-                for server in servers:
-                    status = check_backend_server_status(server.host, server.port)
-                    print(f"  {server.host}:{server.port} ({server.protocol.upper()}): {status}")
+                # All backends are probed at once, so dead ones cost one timeout in total
+                for backend in backend_status_report(servers):
+                    if backend["reachable"]:
+                        status = f"Reachable ({backend['latency_ms']:.1f} ms)"
+                    else:
+                        status = f"Unreachable ({backend['error']})"
+                    print(f"  {backend['host']}:{backend['port']} ({backend['protocol'].upper()}): {status}")
 
         elif choice == '11':
-            save_config(servers, listening_port) # Save before exiting
+            save_config(servers, listening_port, algorithm_settings) # Save before exiting
             print("Exiting magicLB. Goodbye!")
             break
         else:
             print("Invalid choice. Please try again.")
 
-def run_server_mode(listening_port, servers):
+def _balancer_factory(params):
+    # params: an algorithm name plus its parameters, e.g. {"algorithm": "maglev", "hash_key": "client_ip"}
+    params = dict(params)
+    load_plugins(params.pop("plugins", [])) # Modules registering more algorithms by name
+    algorithm = params.pop("algorithm", "round_robin") # Round Robin is the server mode default
+    slow_start = params.pop("slow_start", None) # e.g. {"window": 30, "curve": "linear"}
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unknown load balancing algorithm '{algorithm}'. Expected one of: {', '.join(ALGORITHMS)}")
+    try:
+        ALGORITHMS[algorithm](**params) # Remaining keys are algorithm parameters, e.g. hash_key
+    except TypeError as e:
+        raise ValueError(f"Invalid parameters for algorithm '{algorithm}': {e}")
+    if slow_start is not None:
+        try:
+            SlowStart(**slow_start)
+        except TypeError as e:
+            raise ValueError(f"Invalid slow start settings: {e}")
+
+    def factory():
+        load_balancer = ALGORITHMS[algorithm](**params)
+        if slow_start is not None:
+            load_balancer.slow_start = SlowStart(**slow_start) # Ramp state is per balancer
+        return load_balancer
+    return factory
+
+def _pool_factories(settings):
+    # failover.pools: [(name, balancer factory, min_healthy)] in failover order.
+    # A pool without an algorithm uses the load_balancer section's.
+    default = settings.get("load_balancer", {})
+    pools = []
+    for pool in settings.get("failover", {}).get("pools", []):
+        if not isinstance(pool, dict) or "name" not in pool:
+            raise ValueError("Every backend pool needs a name (the group of its backend servers).")
+        params = {name: value for name, value in pool.items() if name not in ("name", "min_healthy")}
+        if pool["name"] in (name for name, _, _ in pools):
+            raise ValueError(f"Backend pool '{pool['name']}' is defined twice.")
+        pools.append((pool["name"], _balancer_factory(params or default), pool.get("min_healthy", 1)))
+    return pools
+
+def build_load_balancer(servers, settings):
+    factory = _balancer_factory(settings.get("load_balancer", {}))
+    load_balancer = factory()
+    pools = _pool_factories(settings)
+    if pools and settings.get("http_routing", {}).get("routes"):
+        raise ValueError("Backend pools and HTTP routing rules both use backend groups; configure one or the other.")
+    if pools:
+        load_balancer = TieredLoadBalancer(pools)
+    elif settings.get("http_routing", {}).get("routes"):
+        # HTTP routes pick within backend groups, so each group gets a balancer of its own
+        load_balancer = GroupedLoadBalancer(factory)
+    for server in servers:
+        load_balancer.add_server(server)
+    load_balancer.end_slow_start() # Only servers joining later ramp up
+    return load_balancer
+
+def build_router(settings):
+    routes = settings.get("http_routing", {}).get("routes", [])
+    try:
+        return HttpRouter.from_settings(routes)
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Invalid HTTP routing rule (each needs a group, plus host and/or path_prefix): {e}")
+
+def build_access_log(settings, slot=None):
+    log_settings = settings.get("access_log", {})
+    if not log_settings.get("enabled", False):
+        return None
+    path = log_settings.get("path", "access.log")
+    if slot is not None: # Worker processes each write their own file
+        root, ext = os.path.splitext(path)
+        path = f"{root}-worker{slot}{ext}"
+    return AccessLog(path,
+                     max_queue=log_settings.get("max_queue", 10000),
+                     batch_size=log_settings.get("batch_size", 256),
+                     flush_interval=log_settings.get("flush_interval", 0.5),
+                     sample_rate=log_settings.get("sample_rate", 1.0),
+                     max_bytes=log_settings.get("max_bytes", 100 * 1024 * 1024),
+                     backup_count=log_settings.get("backup_count", 5))
+
+def build_tls_contexts(settings):
+    # Returns (listener context, backend context), or (None, None) with TLS off. Built
+    # once, before workers are forked, so that every worker shares the ticket keys.
+    tls_settings = settings.get("tls", {})
+    if not tls_settings.get("enabled", False):
+        return None, None
+    certfile = tls_settings.get("certfile")
+    if not certfile:
+        raise ValueError("TLS is enabled but tls.certfile is not set.")
+    try:
+        listener_context = server_context(certfile, tls_settings.get("keyfile"),
+                                          min_version=tls_settings.get("min_version", "TLSv1.2"),
+                                          ciphers=tls_settings.get("ciphers"),
+                                          session_tickets=tls_settings.get("session_tickets", True))
+        upstream_context = backend_context(verify=tls_settings.get("backend_verify", True),
+                                           ca_file=tls_settings.get("backend_ca_file"))
+    except OSError as e: # Includes ssl.SSLError
+        raise ValueError(f"Cannot set up TLS: {e}")
+    return listener_context, upstream_context
+
+def build_proxy_server(listening_port, servers, settings, reuse_port=False, access_log=None, tls_contexts=(None, None)):
+    proxy_settings = settings.get("proxy", {})
+    pool_settings = settings.get("pool", {})
+    tls_settings = settings.get("tls", {})
+    listener_context, upstream_context = tls_contexts
+    connection_pool = ConnectionPool(max_size=pool_settings.get("max_size"),
+                                     max_idle=pool_settings.get("max_idle", 32),
+                                     idle_timeout=pool_settings.get("idle_timeout", 30.0),
+                                     wait_timeout=pool_settings.get("wait_timeout", 5.0),
+                                     tls_context=upstream_context)
+    tls = None
+    if listener_context:
+        tls = TlsTerminator(listener_context,
+                            handshake_timeout=tls_settings.get("handshake_timeout", 10.0),
+                            hello_timeout=tls_settings.get("hello_timeout", 2.0),
+                            max_pending=tls_settings.get("max_pending_handshakes", 1024))
+    reload_settings = settings.get("reload", {})
+    retry_settings = settings.get("retry", {})
+    outlier_settings = settings.get("outlier_detection", {})
+    outlier_detector = OutlierDetector(consecutive_failures=outlier_settings.get("consecutive_failures", 3),
+                                       base_ejection_time=outlier_settings.get("base_ejection_time", 5.0),
+                                       max_ejection_time=outlier_settings.get("max_ejection_time", 300.0),
+                                       max_ejection_percent=outlier_settings.get("max_ejection_percent", 50))
+    admission_settings = settings.get("admission", {})
+    admission = AdmissionController(max_connections=admission_settings.get("max_connections"),
+                                    queue_timeout=admission_settings.get("queue_timeout", 0.0),
+                                    max_queued=admission_settings.get("max_queued", 1024),
+                                    rate=admission_settings.get("rate"),
+                                    burst=admission_settings.get("burst"),
+                                    max_clients=admission_settings.get("max_clients", 65536),
+                                    max_backend_connections=admission_settings.get("max_backend_connections"))
+    cache_settings = settings.get("cache", {})
+    cache = None
+    if cache_settings.get("enabled", False):
+        cache = HttpCache(max_bytes=cache_settings.get("max_bytes", 64 * 1024 * 1024),
+                          max_object_bytes=cache_settings.get("max_object_bytes", 1024 * 1024),
+                          stale_while_revalidate=cache_settings.get("stale_while_revalidate", 0.0),
+                          coalesce_timeout=cache_settings.get("coalesce_timeout", 5.0))
+    return ProxyServer("0.0.0.0", listening_port, build_load_balancer(servers, settings), servers,
+                       engine=proxy_settings.get("engine", "threaded"),
+                       relay_mode=proxy_settings.get("relay_mode", "auto"),
+                       relay_buffer_size=proxy_settings.get("relay_buffer_size", 65536),
+                       backlog=proxy_settings.get("backlog", 128),
+                       reuse_port=reuse_port,
+                       connection_pool=connection_pool,
+                       connect_timeout=proxy_settings.get("connect_timeout"),
+                       max_connect_attempts=retry_settings.get("max_attempts", 3),
+                       retry_budget=retry_settings.get("budget", 2.0),
+                       outlier_detector=outlier_detector,
+                       drain_timeout=reload_settings.get("drain_timeout", 30.0),
+                       access_log=access_log,
+                       http_mode=proxy_settings.get("http_mode", "connection"),
+                       router=build_router(settings),
+                       admission=admission,
+                       tls=tls,
+                       first_byte_timeout=proxy_settings.get("first_byte_timeout"),
+                       idle_timeout=proxy_settings.get("idle_timeout"),
+                       session_timeout=proxy_settings.get("session_timeout"),
+                       shutdown_timeout=proxy_settings.get("shutdown_timeout", 30.0),
+                       cache=cache)
+
+def build_health_checker(proxy_server, settings):
+    health_settings = settings.get("health_check", {})
+    if not health_settings.get("enabled", True):
+        return None
+    return HealthChecker(proxy_server,
+                         interval=health_settings.get("interval", 5.0),
+                         timeout=health_settings.get("timeout", 1.0),
+                         rise=health_settings.get("rise", 2),
+                         fall=health_settings.get("fall", 3),
+                         http_path=health_settings.get("http_path"))
+
+def reload_proxy_config(proxy_server, health_checker=None, settings=None):
+    # settings: the settings currently in effect; updated in place to the reloaded ones.
+    # Backends are diffed against the live ones and connections to removed backends drain.
+    with _reload_lock:
+        config_data = _read_config_file()
+        if not config_data:
+            print(f"Configuration not reloaded: {CONFIG_FILE} is missing or invalid.")
+            return
+        try:
+            servers = _servers_from_config(config_data)
+        except (KeyError, TypeError) as e:
+            print(f"Configuration not reloaded: invalid backend server entry ({e}).")
+            return
+        new_settings = {name: value for name, value in config_data.items() if name not in ("listening_port", "backend_servers")}
+
+        load_balancer = None
+        router = None
+        if settings is None or any(new_settings.get(name, {}) != settings.get(name, {}) for name in RELOADABLE_SECTIONS):
+            try:
+                # The algorithm or the routes changed: validate them before touching anything
+                load_balancer = build_load_balancer([], new_settings)
+                router = build_router(new_settings)
+            except ValueError as e:
+                print(f"Error reloading configuration: {e}")
+                return
+
+        is_healthy = health_checker.is_healthy if health_checker else None
+        added, removed = proxy_server.update_servers(servers, is_healthy)
+        if load_balancer:
+            for server in proxy_server.servers:
+                load_balancer.add_server(server)
+            load_balancer.end_slow_start() # These servers are serving already
+            # Swapping the balancer is a single reference assignment; new connections pick it up immediately
+            proxy_server.load_balancer = load_balancer
+            proxy_server.router = router
+            if health_checker:
+                health_checker.sync() # Keep known-dead backends out of the new balancer
+        print(f"Configuration reloaded: {len(added)} backend servers added, {len(removed)} removed, {len(servers)} configured.")
+
+        if config_data.get("listening_port") != proxy_server.port:
+            print("The listening port changes after a restart (./runServer.sh restart).")
+        if settings is not None:
+            changed = sorted(name for name in set(settings) | set(new_settings)
+                             if name not in RELOADABLE_SECTIONS and settings.get(name) != new_settings.get(name))
+            if changed:
+                print(f"Changes to {', '.join(changed)} take effect after a restart.")
+            for name in RELOADABLE_SECTIONS:
+                settings[name] = new_settings.get(name, {})
+
+def build_config_watcher(on_change, settings):
+    reload_settings = settings.get("reload", {})
+    if not reload_settings.get("watch", False):
+        return None
+    return ConfigWatcher(CONFIG_FILE, on_change, interval=reload_settings.get("watch_interval", 1.0))
+
+def build_metrics_server(proxy_server, settings, slot=0):
+    metrics_settings = settings.get("metrics", {})
+    if not metrics_settings.get("enabled", False):
+        return None
+    # Each worker process has its own metrics, served on port + worker number
+    return MetricsServer(proxy_server.metrics.registry,
+                         host=metrics_settings.get("host", "127.0.0.1"),
+                         port=metrics_settings.get("port", 9100) + slot)
+
+def live_stats_snapshot(proxy_server, health_checker=None):
+    # (algorithm, open client connections, backend rows) for the live stats file. Reads
+    # the lock-free metrics shards, so publishing never holds up the data plane.
+    active = proxy_server.metrics.active_connections.collect()
+    requests = proxy_server.metrics.requests.collect()
+    rows = []
+    for server in list(proxy_server.servers):
+        label = (backend_label(server),)
+        healthy = None
+        if health_checker:
+            state = health_checker.states.get(health_checker.key(server))
+            healthy = state.healthy if state else None
+        rows.append((server.id, server.host, server.port, healthy, active.get(label, 0), requests.get(label, 0)))
+    return algorithm_name(proxy_server.load_balancer), proxy_server.open_sessions(), rows
+
+def create_live_stats(settings, slots=1):
+    # Creates the stats file before workers are forked; False if stats are off or it cannot be created
+    stats_settings = settings.get("stats", {})
+    if not stats_settings.get("enabled", True):
+        return False
+    path = stats_settings.get("path", STATS_FILE)
+    try:
+        create_stats_file(path, slots, stats_settings.get("max_backends", 1024))
+    except OSError as e:
+        print(f"Live stats disabled: cannot create {path}: {e}")
+        return False
+    return True
+
+def build_stats_publisher(proxy_server, health_checker, settings, slot=0):
+    stats_settings = settings.get("stats", {})
+    try:
+        writer = StatsWriter(stats_settings.get("path", STATS_FILE), slot)
+    except (OSError, ValueError) as e:
+        print(f"Live stats disabled: {e}")
+        return None
+    return StatsPublisher(writer, lambda: live_stats_snapshot(proxy_server, health_checker),
+                          interval=stats_settings.get("interval", 1.0))
+
+def run_worker(settings, slot=0, tls_contexts=(None, None), live_stats=False):
+    # Runs inside each pre-forked worker process
+    listening_port, servers = load_config()
+    access_log = build_access_log(settings, slot)
+    proxy_server = build_proxy_server(listening_port, servers, settings, reuse_port=True, access_log=access_log,
+                                      tls_contexts=tls_contexts)
+    health_checker = build_health_checker(proxy_server, settings)
+    metrics_server = build_metrics_server(proxy_server, settings, slot)
+    stats_publisher = build_stats_publisher(proxy_server, health_checker, settings, slot) if live_stats else None
+    reload = lambda *_: reload_proxy_config(proxy_server, health_checker, settings)
+    config_watcher = build_config_watcher(reload, settings)
+    signal.signal(signal.SIGHUP, reload)
+    signal.signal(signal.SIGTERM, lambda *_: proxy_server.stop())
+    if health_checker:
+        health_checker.start()
+    if stats_publisher:
+        stats_publisher.start()
+    if config_watcher:
+        config_watcher.start()
+    if metrics_server:
+        metrics_server.start()
+    if access_log:
+        access_log.start()
+    try:
+        proxy_server.start()
+    finally:
+        if stats_publisher:
+            stats_publisher.stop()
+        if access_log:
+            access_log.stop()
+        if metrics_server:
+            metrics_server.stop()
+        if config_watcher:
+            config_watcher.stop()
+        if health_checker:
+            health_checker.stop()
+
+def run_server_mode(listening_port, servers, settings=None):
     if not listening_port:
         print("Error: Listening port not set. Cannot start proxy server.")
         return
+    settings = settings or {}
 
-    load_balancer = RoundRobinLoadBalancer() # Default algorithm for server mode
-    for server in servers:
-        load_balancer.add_server(server)
+    shutdown_timeout = settings.get("proxy", {}).get("shutdown_timeout", 30.0)
 
-    proxy_server = ProxyServer("0.0.0.0", listening_port, load_balancer, servers)
+    try:
+        worker_count = resolve_worker_count(settings.get("proxy", {}).get("workers", 1))
+        tls_contexts = build_tls_contexts(settings)
+        if worker_count > 1:
+            build_load_balancer(servers, settings) # Fail on a bad algorithm here rather than in every worker
+            live_stats = create_live_stats(settings, slots=worker_count) # One slot per worker
+            # Workers drain on SIGTERM; give them that long before killing them
+            WorkerSupervisor(worker_count, lambda slot: run_worker(settings, slot, tls_contexts, live_stats),
+                             shutdown_timeout=shutdown_timeout + 5.0).run()
+            return
+        access_log = build_access_log(settings)
+        proxy_server = build_proxy_server(listening_port, servers, settings, access_log=access_log, tls_contexts=tls_contexts)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    health_checker = build_health_checker(proxy_server, settings)
+    reload = lambda *_: reload_proxy_config(proxy_server, health_checker, settings)
+    config_watcher = build_config_watcher(reload, settings)
+    metrics_server = build_metrics_server(proxy_server, settings)
+    stats_publisher = build_stats_publisher(proxy_server, health_checker, settings) if create_live_stats(settings) else None
+    signal.signal(signal.SIGHUP, reload)
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set()) # runServer.sh stop
     proxy_thread = threading.Thread(target=proxy_server.start)
     proxy_thread.daemon = True
     proxy_thread.start()
+    if health_checker:
+        health_checker.start()
+    if config_watcher:
+        config_watcher.start()
+    if metrics_server:
+        metrics_server.start()
+    if access_log:
+        access_log.start()
+    if stats_publisher:
+        stats_publisher.start()
 
     # Keep the main thread alive while the proxy thread runs
     try:
-        while True:
-            time.sleep(1) # Keep main thread alive
+        while not stopping.wait(1): # Keep main thread alive
+            pass
     except KeyboardInterrupt:
         print("Server mode interrupted.")
     finally:
+        # Open connections drain first (up to shutdown_timeout), with health checks still running
         proxy_server.stop()
+        proxy_thread.join(shutdown_timeout + 10.0)
+        if stats_publisher:
+            stats_publisher.stop()
+        if metrics_server:
+            metrics_server.stop()
+        if config_watcher:
+            config_watcher.stop()
+        if health_checker:
+            health_checker.stop()
+        if access_log:
+            access_log.stop() # After the proxy, so the last connections are written too
 
 
 if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1] == "server_mode":
         listening_port, servers = load_config()
-        run_server_mode(listening_port, servers)
+        run_server_mode(listening_port, servers, load_settings())
     elif len(sys.argv) > 1 and sys.argv[1] == "dialog_mode":
         listening_port, servers = load_config()
-        load_balancer = None
-        if servers:
-            load_balancer = RoundRobinLoadBalancer() 
-            for server in servers:
-                load_balancer.add_server(server)
-            print("Load balancer initialized with loaded servers (Round Robin default).")
+        try:
+            servers = BackendRegistry(servers)
+        except ValueError as e:
+            print(f"Error in {CONFIG_FILE}: {e}")
+            sys.exit(1)
+        settings = load_settings()
+        try:
+            load_balancer = build_load_balancer(servers, settings) # Also loads algorithm plugins
+            algorithm = settings.get("load_balancer", {}).get("algorithm", "round_robin")
+            print(f"Load balancer initialized with loaded servers ({algorithm} from {CONFIG_FILE}).")
+        except ValueError as e:
+            load_balancer = build_load_balancer(servers, {})
+            print(f"Error: {e} Using round_robin instead.")
         run_dialog_mode(listening_port, servers, load_balancer)
+    elif len(sys.argv) > 1 and sys.argv[1] == "status":
+        sys.exit(run_status_mode(sys.argv[2:]))
+    elif len(sys.argv) > 1 and sys.argv[1] == "top":
+        sys.exit(run_top_mode(sys.argv[2:]))
     else:
-        print("Usage: python3 -m src.main {server_mode|dialog_mode}")
+        print("Usage: python3 -m src.main {server_mode|dialog_mode|status|top}")
         print("Please use runServer.sh to start the application.")
 
 
@@ -0,0 +1,305 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Metrics for the proxy, served in the Prometheus text format. Recording happens on the
+# relay path, so it takes no lock: every thread updates its own shard of each metric
+# (a plain dict only that thread writes to) and shards are only summed when the
+# metrics are scraped. Histograms use fixed buckets, so an observation is one bisect
+# and two additions. Shards of threads that have exited are folded into a single
+# total, which keeps thread-per-connection from growing the shard list without bound.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0)
+PICK_BUCKETS = (1e-7, 2.5e-7, 5e-7, 1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 1e-4, 1e-3)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels) # Label names; record calls pass the values as a tuple in this order
+        self._local = threading.local()
+        self._shards = [] # (thread, values) for every live thread that has recorded
+        self._retired = {} # Totals of threads that have exited
+        self._lock = threading.Lock() # Taken only to add a shard and to collect
+        self._compact_at = 256
+
+    def _new_shard(self):
+        values = {}
+        self._local.values = values
+        with self._lock:
+            self._shards.append((threading.current_thread(), values))
+            if len(self._shards) >= self._compact_at:
+                self._compact()
+                self._compact_at = max(256, 2 * len(self._shards))
+        return values
+
+    def _compact(self):
+        # Caller holds self._lock
+        live = []
+        for thread, values in self._shards:
+            if thread.is_alive():
+                live.append((thread, values))
+            else:
+                self._merge(self._retired, values)
+        self._shards = live
+
+    def collect(self):
+        # Returns {label values: value} summed over every thread
+        with self._lock:
+            self._compact()
+            totals = {}
+            self._merge(totals, self._retired)
+            for _, values in self._shards:
+                self._merge(totals, values)
+        return totals
+
+    def _merge(self, totals, values):
+        for labels, value in list(values.items()): # list() snapshots the dict in one step
+            totals[labels] = totals.get(labels, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, labels=(), amount=1):
+        try:
+            values = self._local.values
+        except AttributeError:
+            values = self._new_shard()
+        values[labels] = values.get(labels, 0) + amount
+
+
+class Gauge(Counter):
+    # Sum of increments and decrements, so it shards like a counter (there is no set())
+    kind = "gauge"
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        try:
+            values = self._local.values
+        except AttributeError:
+            values = self._new_shard()
+        counts = values.get(labels)
+        if counts is None:
+            counts = values[labels] = [0] * (len(self.buckets) + 2) # One per bucket, +Inf, then the sum
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def _merge(self, totals, values):
+        for labels, counts in list(values.items()):
+            total = totals.get(labels)
+            if total is None:
+                totals[labels] = list(counts)
+            else:
+                for i, count in enumerate(counts):
+                    total[i] += count
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, counts in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == "+Inf" else f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class _CallbackMetric:
+    # Read from elsewhere (e.g. ConnectionPool.stats) when scraped; nothing to record
+    def __init__(self, name, help, kind, labels, callback):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labels = tuple(labels)
+        self.callback = callback # Returns {label values: value}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self.callback().items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def callback(self, name, help, callback, kind="gauge", labels=()):
+        return self.register(_CallbackMetric(name, help, kind, labels, callback))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def backend_label(server):
+    return f"{server.host}:{server.port}"
+
+
+class ProxyMetrics:
+    # The metrics ProxyServer records; one instance per proxy (i.e. per worker process)
+    def __init__(self, registry=None):
+        self.registry = registry or MetricsRegistry()
+        registry = self.registry
+        self.requests = registry.counter("magiclb_backend_requests_total", "Requests routed to each backend (connections for non-HTTP backends).", ("backend",))
+        self.active_connections = registry.gauge("magiclb_backend_active_connections", "Client connections currently relayed to each backend.", ("backend",))
+        self.bytes_sent = registry.counter("magiclb_backend_sent_bytes_total", "Bytes relayed from clients to each backend.", ("backend",))
+        self.bytes_received = registry.counter("magiclb_backend_received_bytes_total", "Bytes relayed from each backend to clients.", ("backend",))
+        self.connect_seconds = registry.histogram("magiclb_backend_connect_seconds", "Time to get a connection to the backend (pooled or new).", ("backend",))
+        self.response_seconds = registry.histogram("magiclb_backend_response_seconds", "Time from sending an HTTP request to its complete response.", ("backend",))
+        self.session_seconds = registry.histogram("magiclb_session_duration_seconds", "Lifetime of relayed client connections.", ("backend",), DURATION_BUCKETS)
+        self.errors = registry.counter("magiclb_errors_total", "Errors by type.", ("type",))
+        self.pick_seconds = registry.histogram("magiclb_balancer_pick_seconds", "Time the load balancer takes to pick a backend.", ("algorithm",), PICK_BUCKETS)
+
+    def watch_pool(self, connection_pool):
+        stats = connection_pool.stats
+        self.registry.callback("magiclb_pool_connections_created_total", "Backend connections opened by the pool.",
+                               lambda: {(): stats["created"]}, kind="counter")
+        self.registry.callback("magiclb_pool_connections_reused_total", "Checkouts served by an idle pooled connection.",
+                               lambda: {(): stats["reused"]}, kind="counter")
+        self.registry.callback("magiclb_pool_wait_seconds_total", "Time checkouts spent waiting for a free pool slot.",
+                               lambda: {(): stats["wait_time"]}, kind="counter")
+        self.registry.callback("magiclb_pool_reuse_ratio", "Share of checkouts served by an idle pooled connection.",
+                               lambda: {(): connection_pool.reuse_rate()})
+
+    def watch_outlier_detector(self, outlier_detector):
+        self.registry.callback("magiclb_outlier_ejected_backends", "Backends currently ejected by outlier detection.",
+                               lambda: {(): outlier_detector.ejected_count()})
+        self.registry.callback("magiclb_outlier_ejections_total", "Outlier ejections so far.",
+                               lambda: {(): outlier_detector.ejections_total}, kind="counter")
+
+    def watch_admission(self, admission):
+        stats = admission.stats
+        self.registry.callback("magiclb_admitted_connections", "Client connections currently admitted.",
+                               lambda: {(): admission.active})
+        self.registry.callback("magiclb_admission_rejected_total", "Client connections turned away by admission control.",
+                               lambda: {("rate_limited",): stats["rate_limited"], ("over_capacity",): stats["over_capacity"]},
+                               kind="counter", labels=("reason",))
+        self.registry.callback("magiclb_admission_queued_total", "Client connections that waited for a free slot.",
+                               lambda: {(): stats["queued"]}, kind="counter")
+        self.registry.callback("magiclb_admission_waiting", "Client connections waiting for a free slot now.",
+                               lambda: {(): admission.queued})
+        self.registry.callback("magiclb_admission_backend_full_total", "Connects skipped because the backend was at its connection limit.",
+                               lambda: {(): stats["backend_full"]}, kind="counter")
+        self.registry.callback("magiclb_admission_tracked_clients", "Client IPs with a rate limit bucket.",
+                               lambda: {(): admission.tracked_clients()})
+
+    def watch_cache(self, cache):
+        stats = cache.stats
+        self.registry.callback("magiclb_cache_lookups_total", "HTTP cache lookups by result (hit, stale, miss).",
+                               lambda: {("hit",): stats["hits"], ("stale",): stats["stale_hits"], ("miss",): stats["misses"]},
+                               kind="counter", labels=("result",))
+        self.registry.callback("magiclb_cache_coalesced_total", "Cache misses that waited for another request fetching the same response.",
+                               lambda: {(): stats["coalesced"]}, kind="counter")
+        self.registry.callback("magiclb_cache_revalidated_total", "Stale cache entries refreshed by a 304 from the backend.",
+                               lambda: {(): stats["revalidated"]}, kind="counter")
+        self.registry.callback("magiclb_cache_evictions_total", "Cache entries evicted to stay within the byte budget.",
+                               lambda: {(): stats["evictions"]}, kind="counter")
+        self.registry.callback("magiclb_cache_entries", "Responses in the HTTP cache.", lambda: {(): len(cache)})
+        self.registry.callback("magiclb_cache_bytes", "Bytes of the responses in the HTTP cache.", lambda: {(): cache.size})
+
+    def watch_failover(self, get_load_balancer):
+        # Reloads swap the balancer, so every scrape looks up the current one
+        def per_pool(value):
+            load_balancer = get_load_balancer()
+            return {(name,): value(load_balancer, balancer) for name, balancer, _ in getattr(load_balancer, "pools", ())}
+        self.registry.callback("magiclb_failover_pool_backends", "Backends in rotation in each failover pool.",
+                               lambda: per_pool(lambda load_balancer, balancer: len(balancer.servers)), labels=("pool",))
+        self.registry.callback("magiclb_failover_pool_active", "1 for the failover pool taking traffic, 0 for the others.",
+                               lambda: per_pool(lambda load_balancer, balancer: int(balancer is load_balancer.active)), labels=("pool",))
+
+
+class MetricsServer:
+    # Serves GET /metrics from a background thread; meant for a local or internal address
+    def __init__(self, registry, host="127.0.0.1", port=9100):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._httpd = None
+        self._thread = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # Scrapes every few seconds would drown the output
+
+        self._httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1] # Resolves port 0
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="metrics-server", daemon=True)
+        self._thread.start()
+        print(f"Metrics available at http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
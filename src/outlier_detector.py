@@ -0,0 +1,69 @@
+import threading
+import time
+
+# Passive outlier detection: ProxyServer reports the result of every backend connect.
+# A backend with `consecutive_failures` failed connects (refusals, timeouts) in a row is
+# ejected, i.e. skipped when picking, for base_ejection_time * 2^(n-1) seconds on its
+# n-th ejection (capped at max_ejection_time). It does not touch the load balancer
+# itself, so it never fights the active health checker over membership.
+
+
+class OutlierState:
+    __slots__ = ("failures", "ejections", "ejected_until", "ejection_time")
+
+    def __init__(self):
+        self.failures = 0 # Consecutive failed connects
+        self.ejections = 0 # Ejections so far; drives the exponential backoff
+        self.ejected_until = 0.0 # Monotonic time the current ejection ends
+        self.ejection_time = 0.0 # Length of the most recent ejection
+
+
+class OutlierDetector:
+    def __init__(self, consecutive_failures=3, base_ejection_time=5.0, max_ejection_time=300.0, max_ejection_percent=50):
+        self.consecutive_failures = consecutive_failures
+        self.base_ejection_time = base_ejection_time
+        self.max_ejection_time = max_ejection_time
+        self.max_ejection_percent = max_ejection_percent # Never eject more than this share of the backends
+        self.states = {} # (host, port) -> OutlierState
+        self.ejections_total = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(server):
+        return (server.host, server.port)
+
+    def is_ejected(self, server):
+        state = self.states.get(self.key(server))
+        return state is not None and state.ejected_until > time.monotonic()
+
+    def ejected_count(self):
+        now = time.monotonic()
+        return sum(1 for state in self.states.values() if state.ejected_until > now)
+
+    def record_success(self, server):
+        state = self.states.get(self.key(server))
+        if state is None or not (state.failures or state.ejections):
+            return # Fast path for healthy backends: no lock, no allocation
+        with self._lock:
+            state.failures = 0
+            # A backend that stayed in rotation as long as its last ejection lasted starts over
+            if state.ejections and time.monotonic() - state.ejected_until > state.ejection_time:
+                state.ejections = 0
+
+    def record_failure(self, server, backend_count):
+        with self._lock:
+            state = self.states.setdefault(self.key(server), OutlierState())
+            state.failures += 1
+            now = time.monotonic()
+            if state.failures < self.consecutive_failures or state.ejected_until > now:
+                return False
+            ejected = sum(1 for s in self.states.values() if s.ejected_until > now)
+            if (ejected + 1) * 100 > self.max_ejection_percent * max(backend_count, 1):
+                return False
+            state.ejections += 1
+            state.ejection_time = min(self.base_ejection_time * 2 ** (state.ejections - 1), self.max_ejection_time)
+            state.ejected_until = now + state.ejection_time
+            state.failures = 0
+            self.ejections_total += 1
+        print(f"Backend {server.host}:{server.port} ejected for {state.ejection_time:.0f}s after repeated connect failures.")
+        return True
@@ -1,37 +1,172 @@
+import asyncio
+import collections
+import functools
 import socket
 import threading
 import select
 import time
 
+from src.admission import AdmissionController
+from src.connection_pool import ConnectionPool, PoolTimeout
+from src.http_cache import ResponseCapture
+from src.http_parser import MAX_HEAD_SIZE, HttpParseError, HttpParser, parse_head
+from src.load_balancer import GroupedLoadBalancer, affinity_key
+from src.metrics import ProxyMetrics, backend_label
+from src.outlier_detector import OutlierDetector
+from src.relay import DEFAULT_BUFFER_SIZE, relay, resolve_relay_mode
+from src.timer_wheel import TimerWheel
+
+ENGINES = ("threaded", "asyncio")
+HTTP_MODES = ("connection", "request")
+
+# Answers to connections turned away by admission control
+GATEWAY_TIMEOUT = b"HTTP/1.1 504 Gateway Timeout\r\nConnection: close\r\nContent-Length: 0\r\n\r\n"
+
+REJECTIONS = {
+    "rate_limited": b"HTTP/1.1 429 Too Many Requests\r\nConnection: close\r\nContent-Length: 0\r\n\r\n",
+    "over_capacity": b"HTTP/1.1 503 Service Unavailable\r\nConnection: close\r\nContent-Length: 0\r\n\r\n",
+}
+
+
+class _Session:
+    # Per-client bookkeeping for metrics, the access log and timeouts
+    __slots__ = ("started", "server", "traffic", "counted", "requests", "outcome",
+                 "close_client", "close_backend", "awaiting_since", "timer", "seen", "last_active", "timed_out")
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.server = None # Backend currently (or, once closed, last) relayed to
+        self.traffic = [0, 0] # Bytes relayed [to backend, to client]
+        self.counted = None # traffic when self.server was opened; None once its metrics are recorded
+        self.requests = 0
+        self.outcome = "ok" # Or the error type counted in magiclb_errors_total
+        self.close_client = None # Callables that end the relay by closing either side
+        self.close_backend = None
+        self.awaiting_since = None # When a request was sent whose response has not started yet
+        self.timer = None # Timeout check in ProxyServer.timers; None once the session ended
+        self.seen = 0 # Bytes relayed at the last timeout check
+        self.last_active = self.started # When that check (or the start) first saw the current byte count
+        self.timed_out = None # Set by a timeout; the kind is recorded as the outcome
+
+
+def _shutdown(sock):
+    # Wakes up whatever thread is blocked on sock
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def _server_identity(server):
+    # Two configurations describe the same backend only if every field matches
+    return (server.id, server.host, server.port, server.protocol, server.weight, server.group)
+
+
 class ProxyServer:
-    def __init__(self, host, port, load_balancer, servers):
+    def __init__(self, host, port, load_balancer, servers, engine="threaded",
+                 relay_mode="auto", relay_buffer_size=DEFAULT_BUFFER_SIZE,
+                 backlog=128, reuse_port=False, connection_pool=None,
+                 connect_timeout=None, max_connect_attempts=3, retry_budget=2.0, outlier_detector=None,
+                 drain_timeout=30.0, metrics=None, access_log=None, http_mode="connection", router=None,
+                 admission=None, tls=None, first_byte_timeout=None, idle_timeout=None, session_timeout=None,
+                 shutdown_timeout=30.0, cache=None):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown proxy engine '{engine}'. Expected one of: {', '.join(ENGINES)}")
+        if http_mode not in HTTP_MODES:
+            raise ValueError(f"Unknown HTTP mode '{http_mode}'. Expected one of: {', '.join(HTTP_MODES)}")
+        if http_mode == "request" and engine != "threaded":
+            raise ValueError("The HTTP request mode needs the threaded engine.")
+        if cache is not None and http_mode != "request":
+            raise ValueError("The HTTP response cache needs the HTTP request mode.")
+        if tls and engine == "asyncio" and not hasattr(asyncio.StreamWriter, "start_tls"):
+            raise ValueError("TLS termination with the asyncio engine needs Python 3.11 or later.")
         self.host = host
         self.port = port
         self.load_balancer = load_balancer
         self.servers = servers # Reference to the main servers list
-        self.running = False
+        self.engine = engine # "threaded" (thread per connection) or "asyncio" (single event loop)
+        self.relay_mode = resolve_relay_mode(relay_mode) # Used for "tcp" backends: splice, buffer or copy
+        self.relay_buffer_size = relay_buffer_size
+        self.backlog = backlog
+        self.reuse_port = reuse_port # Lets several worker processes bind the same port (SO_REUSEPORT)
+        self.connection_pool = connection_pool or ConnectionPool() # Backend connections, kept alive between HTTP clients
+        self.connect_timeout = connect_timeout # Seconds per backend connect; None = OS default
+        self.max_connect_attempts = max_connect_attempts # Backends tried per client before giving up
+        self.retry_budget = retry_budget # Seconds after the first attempt within which retries may start
+        self.outlier_detector = outlier_detector or OutlierDetector()
+        self.drain_timeout = drain_timeout # Seconds connections to a removed backend may run on; None = until they end
+        self.metrics = metrics or ProxyMetrics()
+        self.metrics.watch_pool(self.connection_pool)
+        self.metrics.watch_outlier_detector(self.outlier_detector)
+        self.access_log = access_log # AccessLog for one record per client connection; None = off
+        if access_log:
+            self.metrics.registry.register(access_log.dropped)
+        self.http_mode = http_mode # "request": balance every HTTP request on its own (see _serve_http_requests)
+        self.router = router # HttpRouter sending requests to backend groups in request mode; None = no rules
+        self.admission = admission or AdmissionController() # Connection limits; the default one limits nothing
+        self.metrics.watch_admission(self.admission)
+        self.metrics.watch_failover(lambda: self.load_balancer)
+        self.tls = tls # TlsTerminator for TLS on the listener; None = plain TCP
+        if tls:
+            self.metrics.registry.register(tls.handshakes)
+            self.metrics.registry.register(tls.handshake_seconds)
+        self.first_byte_timeout = first_byte_timeout # Seconds for an HTTP backend to start answering a request
+        self.idle_timeout = idle_timeout # Seconds without a byte relayed either way
+        self.session_timeout = session_timeout # Seconds a client connection may last in total
+        self.shutdown_timeout = shutdown_timeout # Seconds stop() lets in-flight sessions finish
+        self.cache = cache # HttpCache answering repeated GETs in request mode; None = off
+        if cache is not None:
+            self.metrics.watch_cache(cache)
+        self.timers = TimerWheel() # Serves every session's timeouts from one thread
+        self.running = False # Accepting new connections
+        self._relaying = False # Relaying for open sessions; stays on while they drain after stop()
         self.server_socket = None
-        print(f"ProxyServer initialized to listen on {self.host}:{self.port}")
+        self._loop = None
+        self._stop_event = None
+        self._client_tasks = set()
+        self._active = collections.defaultdict(set) # (host, port) -> callables closing the open backend connections
+        self._sessions = set() # Open client sessions
+        self._active_lock = threading.Condition() # Guards the two above; notified when a session ends
+        print(f"ProxyServer initialized to listen on {self.host}:{self.port} ({self.engine} engine)")
 
     def start(self):
         if self.running:
             print("Proxy server is already running.")
             return
 
+        if self.engine == "asyncio":
+            self._start_asyncio()
+            return
+
         try:
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
+            self.server_socket.listen(self.backlog)
             self.server_socket.settimeout(1.0) # Timeout for accept to allow checking self.running
+            self.timers.start()
+            self._relaying = True
             self.running = True
             print(f"Proxy server listening on {self.host}:{self.port}")
 
             while self.running:
                 try:
                     client_socket, client_address = self.server_socket.accept()
-                    print(f"Accepted connection from {client_address}")
-                    client_handler = threading.Thread(target=self.handle_client, args=(client_socket,))
+                    # Admission happens here, before a thread is spent on the client
+                    rejection = self._admit(client_address)
+                    if rejection == "queued":
+                        self._queue(client_socket, client_address)
+                        continue
+                    if rejection:
+                        self._reject(client_socket, client_address, rejection)
+                        continue
+                    if self.tls:
+                        # The handler thread starts once the handshake is done, off this loop
+                        self._start_handshake(client_socket, client_address)
+                        continue
+                    client_handler = threading.Thread(target=self._handle_admitted, args=(client_socket, client_address))
                     client_handler.daemon = True
                     client_handler.start()
                 except socket.timeout:
@@ -46,40 +181,325 @@ class ProxyServer:
             if self.server_socket:
                 self.server_socket.close()
                 print("Proxy server socket closed.")
+            self._drain_sessions()
+            self._shut_down()
 
     def stop(self):
+        # Stops accepting at once; start() returns once open sessions have finished or
+        # shutdown_timeout has passed
         if self.running:
             print("Stopping proxy server...")
             self.running = False
-            if self.server_socket:
+            if self._loop and self._stop_event:
+                # The event loop runs in the thread that called start(); wake it up from here
+                self._loop.call_soon_threadsafe(self._stop_event.set)
+            elif self.server_socket:
                 self.server_socket.close()
-            print("Proxy server stopped.")
+            print("Proxy server stopped accepting connections.")
         else:
             print("Proxy server is not running.")
 
-    def handle_client(self, client_socket):
+    def _drain_sessions(self):
+        # Threaded engine: wait for open sessions, then close whatever outlives the deadline
+        with self._active_lock:
+            self._active_lock.wait_for(lambda: not self._sessions, self.shutdown_timeout)
+            remaining = list(self._sessions)
+        for session in remaining:
+            self._expire(session, "shutdown")
+        if remaining:
+            print(f"Closed {len(remaining)} connections still open after the {self.shutdown_timeout}s shutdown timeout.")
+            with self._active_lock:
+                self._active_lock.wait_for(lambda: not self._sessions, 5.0)
+
+    def _shut_down(self):
+        self._relaying = False
+        self.timers.stop()
+        self.connection_pool.close()
+        if self.tls:
+            self.tls.close()
+        print("Proxy server stopped.")
+
+    def update_servers(self, servers, is_healthy=None):
+        # Applies a new backend list to the live load balancer. Only added and removed
+        # servers are touched, so unchanged backends keep their balancer state (connection
+        # counts, schedule position, hash table slots). is_healthy, if given, keeps backends
+        # the health checker has ejected out of the balancer. Returns (added, removed).
+        load_balancer = self.load_balancer
+        current = collections.defaultdict(list)
+        for server in self.servers:
+            current[_server_identity(server)].append(server)
+        updated, added = [], []
+        for server in servers:
+            matches = current.get(_server_identity(server))
+            if matches:
+                updated.append(matches.pop(0)) # Keep the live object: balancers key their state on it
+            else:
+                updated.append(server)
+                added.append(server)
+        removed = [server for matches in current.values() for server in matches]
+
+        if load_balancer:
+            for server in removed:
+                load_balancer.remove_server(server)
+            for server in added:
+                if is_healthy is None or is_healthy(server):
+                    load_balancer.add_server(server)
+        self.servers = updated
+
+        live_keys = {self.connection_pool.key(server) for server in updated}
+        for server in added:
+            self.connection_pool.resume(server)
+        drained = {self.connection_pool.key(server) for server in removed} - live_keys
+        for server in removed:
+            if self.connection_pool.key(server) in drained:
+                self.connection_pool.drain(server)
+        if drained and self.drain_timeout is not None:
+            timer = threading.Timer(self.drain_timeout, self._close_drained, args=(drained,))
+            timer.daemon = True
+            timer.start()
+        return added, removed
+
+    def open_sessions(self):
+        # Client connections open right now; len() of a set needs no lock
+        return len(self._sessions)
+
+    def active_connections(self, server):
+        with self._active_lock:
+            return len(self._active.get(self.connection_pool.key(server), ()))
+
+    def _track(self, server, close):
+        with self._active_lock:
+            self._active[self.connection_pool.key(server)].add(close)
+
+    def _untrack(self, server, close):
+        key = self.connection_pool.key(server)
+        with self._active_lock:
+            self._active[key].discard(close)
+            if not self._active[key]:
+                del self._active[key]
+
+    def _close_drained(self, keys):
+        # drain_timeout is up: close what is still open to backends that stayed removed
+        with self._active_lock:
+            live_keys = {self.connection_pool.key(server) for server in self.servers}
+            closers = [close for key in keys - live_keys for close in self._active.get(key, ())]
+        for close in closers:
+            try:
+                close()
+            except (OSError, RuntimeError): # Already closed, or its event loop has stopped
+                pass
+        if closers:
+            print(f"Closed {len(closers)} connections to removed backends after the {self.drain_timeout}s drain timeout.")
+
+    # --- Session timeouts ---
+    # Each session has one timer in self.timers that fires at its nearest deadline. Idle
+    # time is judged by whether session.traffic moved between checks, so the relay loops
+    # themselves never touch a timer.
+
+    def _open_session(self, session, close_client):
+        session.close_client = close_client
+        with self._active_lock:
+            self._sessions.add(session)
+            if self.first_byte_timeout or self.idle_timeout or self.session_timeout:
+                self._schedule_check(session, session.started)
+
+    def _end_session(self, session):
+        with self._active_lock:
+            self._sessions.discard(session)
+            if session.timer:
+                self.timers.cancel(session.timer)
+                session.timer = None
+            self._active_lock.notify_all()
+
+    def _schedule_check(self, session, now):
+        # Caller holds self._active_lock
+        deadlines = []
+        if self.session_timeout:
+            deadlines.append(session.started + self.session_timeout)
+        if self.idle_timeout:
+            deadlines.append(session.last_active + self.idle_timeout)
+        if self.first_byte_timeout:
+            awaiting_since = session.awaiting_since
+            deadlines.append((now if awaiting_since is None else awaiting_since) + self.first_byte_timeout)
+        session.timer = self.timers.schedule(min(deadlines) - now, functools.partial(self._check_session, session))
+
+    def _check_session(self, session):
+        # Runs on the timer wheel thread
+        now = time.monotonic()
+        relayed = session.traffic[0] + session.traffic[1]
+        if relayed != session.seen:
+            session.seen = relayed
+            session.last_active = now
+        awaiting_since = session.awaiting_since
+        kind = None
+        if self.session_timeout and now - session.started >= self.session_timeout:
+            kind = "session_timeout"
+        elif self.idle_timeout and now - session.last_active >= self.idle_timeout:
+            kind = "idle_timeout"
+        elif self.first_byte_timeout and awaiting_since is not None and now - awaiting_since >= self.first_byte_timeout:
+            kind = "first_byte_timeout"
+        with self._active_lock:
+            if session not in self._sessions:
+                return
+            if kind is None:
+                self._schedule_check(session, now)
+                return
+            session.timer = None
+        self._expire(session, kind)
+
+    def _expire(self, session, kind):
+        # A first-byte timeout only gives up on the backend, so the client still gets a 504
+        self._failed(session, kind)
+        session.timed_out = kind
+        closers = [session.close_backend]
+        if kind != "first_byte_timeout" or session.close_backend is None:
+            closers.append(session.close_client)
+        for close in closers:
+            if close:
+                try:
+                    close()
+                except (OSError, RuntimeError): # Already closed, or its event loop has stopped
+                    pass
+
+    def _admit(self, client_address):
+        # Returns the reason to turn the client away, None once it holds a connection slot,
+        # or "queued" if it may wait for one. Never blocks: the accept loop calls it, and
+        # the wait happens in the admission queue (see _queue()).
+        if not self.admission.allow(client_address[0] if client_address else None):
+            return "rate_limited"
+        if self.admission.queue_timeout <= 0:
+            return None if self.admission.acquire() else "over_capacity"
+        return None if self.admission.try_acquire() else "queued"
+
+    def _queue(self, client_socket, client_address):
+        # The proxy is full: the client waits in the admission queue, without a thread of
+        # its own. A freed slot dispatches it on the thread that freed it; the timer wheel
+        # turns it away after queue_timeout unless it got a slot first.
+        waiter = self.admission.queue(functools.partial(self._dispatch_queued, client_socket, client_address))
+        if waiter is None: # max_queued clients are waiting already
+            self._reject(client_socket, client_address, "over_capacity")
+            return
+        self.timers.schedule(self.admission.queue_timeout,
+                             functools.partial(self._queue_timed_out, waiter, client_socket, client_address))
+
+    def _queue_timed_out(self, waiter, client_socket, client_address):
+        if self.admission.cancel(waiter):
+            self._reject(client_socket, client_address, "over_capacity")
+
+    def _dispatch_queued(self, client_socket, client_address):
+        if not self.running: # Stopped while it waited
+            self.admission.release()
+            client_socket.close()
+            return
+        if self.tls:
+            self._start_handshake(client_socket, client_address)
+            return
+        threading.Thread(target=self._handle_admitted, args=(client_socket, client_address), daemon=True).start()
+
+    def _reject(self, client_socket, client_address, kind):
+        session = _Session()
+        self._failed(session, kind)
+        try:
+            client_socket.setblocking(False) # Never let a client stall the accept loop
+            client_socket.send(REJECTIONS[kind])
+        except OSError:
+            pass
+        finally:
+            client_socket.close()
+            self._session_closed(session, client_address)
+
+    def _start_handshake(self, client_socket, client_address):
+        # The handler thread starts once the handshake is done; until then the client holds
+        # its admission slot but no thread
+        started = self.tls.submit(client_socket,
+                                  functools.partial(self._handshake_done, client_address),
+                                  functools.partial(self._handshake_failed, client_address))
+        if not started: # Too many handshakes in progress; the client sees the 503 as a failed handshake
+            self.admission.release()
+            self._reject(client_socket, client_address, "over_capacity")
+
+    def _handshake_done(self, client_address, tls_socket):
+        # Runs on the TLS handshake thread
+        if not self.running:
+            self.admission.release()
+            tls_socket.close()
+            return
+        threading.Thread(target=self._handle_admitted, args=(tls_socket, client_address), daemon=True).start()
+
+    def _handshake_failed(self, client_address):
+        session = _Session()
+        self._failed(session, "tls_handshake")
+        self._session_closed(session, client_address)
+        self.admission.release()
+
+    def _handle_admitted(self, client_socket, client_address):
+        try:
+            self.handle_client(client_socket, client_address)
+        finally:
+            self.admission.release()
+
+    def handle_client(self, client_socket, client_address=None):
+        load_balancer = self.load_balancer # A config reload may swap it; open/close must hit the same one
         backend_server_info = None
         backend_socket = None
+        close_backend = None
+        reusable = False
+        initial_data = b"" # Client bytes read before a backend was chosen
+        session = _Session()
+        self._open_session(session, functools.partial(_shutdown, client_socket))
         try:
-            if not self.load_balancer or not self.load_balancer.servers:
+            if not load_balancer or not load_balancer.servers:
                 print("No load balancing algorithm selected or no backend servers available.")
+                self._failed(session, "no_backend")
                 client_socket.sendall(b"HTTP/1.1 503 Service Unavailable\r\n\r\nNo backend servers available.")
                 return
 
-            backend_server_info = self.load_balancer.get_next_server()
+            if self.http_mode == "request":
+                self._serve_http_requests(client_socket, client_address, load_balancer, session)
+                return
+
+            key = None
+            if load_balancer.hash_key is not None:
+                request_head = None
+                if load_balancer.hash_key != "client_ip":
+                    initial_data, request_head = self._read_request_head(client_socket)
+                key = affinity_key(load_balancer.hash_key, client_address, request_head)
+
+            backend_server_info, backend_socket, connect_time = self._connect_backend(load_balancer, key)
             if not backend_server_info:
                 print("Load balancer returned no available server.")
+                self._failed(session, "no_backend")
                 client_socket.sendall(b"HTTP/1.1 503 Service Unavailable\r\n\r\nNo available backend servers.")
                 return
+            self._session_opened(session, backend_server_info, connect_time)
+            close_backend = functools.partial(_shutdown, backend_socket) # Ends the relay loops
+            self._track(backend_server_info, close_backend)
+            session.close_backend = close_backend
 
-            print(f"Routing request to backend: {backend_server_info}")
+            if self._speaks_http(backend_server_info):
+                reusable = self._relay_http(client_socket, backend_socket, backend_server_info, load_balancer, initial_data, session)
+                return
+
+            # Without request framing, connect latency is the response time we can observe
+            load_balancer.record_response_time(backend_server_info, connect_time)
+            self._count_request(session)
+            if initial_data:
+                backend_socket.sendall(initial_data)
+                session.traffic[0] += len(initial_data)
 
-            backend_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            backend_socket.connect((backend_server_info.host, backend_server_info.port))
+            if backend_server_info.protocol == "tcp" and self.relay_mode != "copy":
+                # Raw TCP needs no inspection, so keep the bytes out of Python objects
+                try:
+                    relay(client_socket, backend_socket, lambda: self._relaying,
+                          self.relay_mode, self.relay_buffer_size, session.traffic)
+                except (socket.error, ConnectionResetError) as e:
+                    print(f"Socket error during data transfer: {e}")
+                    self._failed(session, "relay")
+                return
 
             # Proxy data between client and backend
             inputs = [client_socket, backend_socket]
-            while self.running:
+            while self._relaying:
                 try:
                     readable, _, _ = select.select(inputs, [], [], 1.0) # 1-second timeout
                     if not readable:
@@ -87,40 +507,764 @@ class ProxyServer:
 
                     for sock in readable:
                         if sock is client_socket:
-                            data = client_socket.recv(4096)
+                            data = client_socket.recv(65536) # A whole TLS record, so select() sees the rest
                             if not data:
                                 # Client closed connection
                                 return
                             backend_socket.sendall(data)
+                            session.traffic[0] += len(data)
                         elif sock is backend_socket:
-                            data = backend_socket.recv(4096)
+                            data = backend_socket.recv(65536)
                             if not data:
                                 # Backend closed connection
                                 return
                             client_socket.sendall(data)
+                            session.traffic[1] += len(data)
                 except (socket.error, ConnectionResetError) as e:
                     print(f"Socket error during data transfer: {e}")
+                    self._failed(session, "relay")
                     break # Exit loop on socket error
                 except Exception as e:
                     print(f"Unexpected error during data transfer: {e}")
                     break
 
         except ConnectionRefusedError:
-            print(f"Connection to backend {backend_server_info} refused. It might be down.")
+            print("Connection to backend refused. It might be down.")
+            self._failed(session, "backend_refused")
             if client_socket:
                 client_socket.sendall(b"HTTP/1.1 503 Service Unavailable\r\n\r\nBackend server refused connection.\r\n")
         except socket.timeout:
             print("Socket timeout during initial connection or data transfer.")
+            self._failed(session, "backend_timeout")
             if client_socket:
                 client_socket.sendall(b"HTTP/1.1 504 Gateway Timeout\r\n\r\nBackend server connection timed out.\r\n")
         except Exception as e:
             print(f"Error handling client connection: {e}")
+            self._failed(session, "internal")
             if client_socket:
                 client_socket.sendall(b"HTTP/1.1 500 Internal Server Error\r\n\r\nLoad balancer internal error.\r\n")
         finally:
             if client_socket:
                 client_socket.close()
                 # print("Client socket closed.") # Keep commented for less verbose output
+            if close_backend:
+                self._untrack(backend_server_info, close_backend)
+            session.close_backend = None
+            self._end_session(session)
+            self._session_closed(session, client_address)
             if backend_socket:
-                backend_socket.close()
+                self.connection_pool.release(backend_server_info, backend_socket, reusable)
                 # print("Backend socket closed.") # Keep commented for less verbose output
+            if backend_server_info:
+                self._backend_released(load_balancer, backend_server_info)
+
+    def _speaks_http(self, server):
+        # "https" backends are plain HTTP to the proxy once it re-encrypts to them itself
+        return server.protocol == "http" or (server.protocol == "https" and self.connection_pool.tls_context is not None)
+
+    def _pick_backend(self, load_balancer, key, tried):
+        # Skips backends already tried for this client and backends the outlier detector
+        # has ejected. If every candidate is ejected, the first untried one is used anyway
+        # rather than failing the client outright.
+        fallback = None
+        for probe in range(max(len(load_balancer.servers), 1)):
+            pick_started = time.perf_counter()
+            if key is None:
+                server = load_balancer.get_next_server()
+            elif not tried and not probe:
+                server = load_balancer.get_server_for_key(key)
+            else:
+                # Derived keys send retries to a different, but still stable, backend
+                server = load_balancer.get_server_for_key(f"{key}#{len(tried)}.{probe}")
+            self.metrics.pick_seconds.observe(time.perf_counter() - pick_started, (type(load_balancer).__name__,))
+            if server is None:
+                return fallback
+            if any(server is previous for previous in tried) or self.admission.backend_full(server):
+                continue
+            if not self.outlier_detector.is_ejected(server):
+                return server
+            fallback = fallback or server
+        return fallback
+
+    def _connect_attempts(self, load_balancer, key):
+        # Yields (server, connect timeout) for each backend worth trying: up to
+        # max_connect_attempts of them, with retries only while the budget lasts
+        deadline = time.monotonic() + self.retry_budget
+        tried = []
+        for attempt in range(self.max_connect_attempts):
+            remaining = deadline - time.monotonic()
+            if attempt and remaining <= 0:
+                return
+            server = self._pick_backend(load_balancer, key, tried)
+            if not server:
+                return
+            tried.append(server)
+            timeout = self.connect_timeout
+            if attempt:
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            yield server, timeout
+
+    def _session_opened(self, session, server, connect_time):
+        session.server = server
+        session.counted = list(session.traffic)
+        label = (backend_label(server),)
+        self.metrics.connect_seconds.observe(connect_time, label)
+        self.metrics.active_connections.inc(label)
+
+    def _count_request(self, session):
+        session.requests += 1
+        self.metrics.requests.inc((backend_label(session.server),))
+
+    def _failed(self, session, kind):
+        if session.timed_out:
+            return # Errors after a timeout are its consequence
+        session.outcome = kind
+        self.metrics.errors.inc((kind,))
+
+    def _backend_closed(self, session):
+        # Records what was relayed to session.server since it was opened
+        if session.counted is None:
+            return
+        label = (backend_label(session.server),)
+        self.metrics.active_connections.dec(label)
+        self.metrics.bytes_sent.inc(label, session.traffic[0] - session.counted[0])
+        self.metrics.bytes_received.inc(label, session.traffic[1] - session.counted[1])
+        session.counted = None
+
+    def _session_closed(self, session, client_address):
+        duration = time.monotonic() - session.started
+        backend = None
+        if session.server is not None:
+            self._backend_closed(session)
+            backend = backend_label(session.server)
+            self.metrics.session_seconds.observe(duration, (backend,))
+        if self.access_log:
+            self.access_log.log(client_address, backend, session.outcome, duration,
+                                session.traffic[0], session.traffic[1], session.requests)
+
+    def _backend_released(self, load_balancer, server):
+        # Undoes what _connect_backend did when it opened a connection to server
+        load_balancer.on_connection_close(server)
+        self.admission.release_backend(server)
+
+    def _connect_failed(self, load_balancer, server, error):
+        self.metrics.errors.inc(("pool_timeout" if isinstance(error, PoolTimeout) else "connect_failed",))
+        self._backend_released(load_balancer, server)
+        if not isinstance(error, PoolTimeout): # A full pool is our limit, not the backend's fault
+            self.outlier_detector.record_failure(server, len(load_balancer.servers))
+        print(f"Connection to backend {server} failed: {error}")
+
+    def _connect_backend(self, load_balancer, key=None):
+        # Returns (server, socket, connect seconds), moving on to the next backend when a
+        # connect fails. (None, None, None) means nothing could be picked; if every attempt
+        # failed, the last connect error is raised for handle_client to answer.
+        last_error = None
+        for server, timeout in self._connect_attempts(load_balancer, key):
+            if not self.admission.reserve_backend(server):
+                continue # Filled up since it was picked
+            load_balancer.on_connection_open(server)
+            started = time.monotonic()
+            try:
+                backend_socket = self.connection_pool.acquire(server, timeout=timeout)
+            except OSError as e:
+                self._connect_failed(load_balancer, server, e)
+                last_error = e
+                continue
+            self.outlier_detector.record_success(server)
+            return server, backend_socket, time.monotonic() - started
+        if last_error:
+            raise last_error
+        return None, None, None
+
+    def _read_request_head(self, client_socket, timeout=5.0):
+        # Header/cookie affinity needs the first request head before a backend is chosen.
+        # Returns everything read so far (to be forwarded) and the parsed head, or None
+        # when the client sent something that isn't an HTTP request.
+        data = b""
+        client_socket.settimeout(timeout)
+        try:
+            while b"\r\n\r\n" not in data and len(data) < MAX_HEAD_SIZE:
+                chunk = client_socket.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+        except socket.timeout:
+            pass
+        finally:
+            client_socket.settimeout(None)
+        end = data.find(b"\r\n\r\n")
+        if end < 0:
+            return data, None
+        try:
+            return data, parse_head(data[:end + 4], is_response=False)
+        except HttpParseError:
+            return data, None
+
+    def _relay_http(self, client_socket, backend_socket, backend_server_info, load_balancer, initial_data=b"", session=None):
+        # Same copy loop as handle_client, but it also frames the HTTP/1.x messages in both
+        # directions. Returns True when the client left with every request answered in full
+        # on a keep-alive connection, i.e. the backend connection can serve another client.
+        requests = HttpParser()
+        responses = HttpParser(is_response=True)
+        request_started = collections.deque() # Send times of requests still waiting for their response
+        tracking = True
+        if session is None:
+            session = _Session()
+            session.server = backend_server_info
+        traffic = session.traffic
+        label = (backend_label(backend_server_info),)
+
+        def forward_request_bytes(data):
+            nonlocal tracking
+            if tracking:
+                try:
+                    for kind, message in requests.feed(data):
+                        if kind == "head":
+                            responses.expect_response(message.method)
+                            request_started.append(time.monotonic())
+                            if responses.is_idle and session.awaiting_since is None:
+                                session.awaiting_since = request_started[-1]
+                            self._count_request(session)
+                except HttpParseError:
+                    tracking = False # Not HTTP we understand; keep relaying but never reuse
+            backend_socket.sendall(data)
+            traffic[0] += len(data)
+
+        inputs = [client_socket, backend_socket]
+        while self._relaying:
+            try:
+                if initial_data:
+                    forward_request_bytes(initial_data)
+                    initial_data = b""
+                if not self.running and not request_started and requests.is_idle and responses.is_idle:
+                    return False # Shutting down and between requests: close the keep-alive connection
+                readable, _, _ = select.select(inputs, [], [], 1.0)
+                for sock in readable:
+                    if sock is client_socket:
+                        data = client_socket.recv(65536)
+                        if not data:
+                            return (tracking and requests.is_idle and responses.is_idle
+                                    and requests.messages_completed == responses.messages_completed
+                                    and requests.keep_alive and responses.keep_alive)
+                        forward_request_bytes(data)
+                    else:
+                        data = backend_socket.recv(65536)
+                        if not data:
+                            if session.timed_out == "first_byte_timeout" and responses.is_idle:
+                                client_socket.sendall(GATEWAY_TIMEOUT)
+                            return False
+                        if tracking:
+                            try:
+                                completed = responses.messages_completed
+                                responses.feed(data)
+                                for _ in range(responses.messages_completed - completed):
+                                    if request_started:
+                                        response_time = time.monotonic() - request_started.popleft()
+                                        load_balancer.record_response_time(backend_server_info, response_time)
+                                        self.metrics.response_seconds.observe(response_time, label)
+                            except HttpParseError:
+                                tracking = False
+                        # Waiting for a first byte again only if a sent request has no response under way
+                        session.awaiting_since = time.monotonic() if tracking and request_started and responses.is_idle else None
+                        client_socket.sendall(data)
+                        traffic[1] += len(data)
+            except (socket.error, ConnectionResetError) as e:
+                print(f"Socket error during data transfer: {e}")
+                self._failed(session, "relay")
+                return False
+        return False
+
+    # --- HTTP request mode ---
+    # The client connection is parsed as HTTP/1.x and every request is balanced on its
+    # own: it borrows a pooled backend connection for exactly one request/response
+    # exchange, so a keep-alive client spreads its requests over all backends instead of
+    # sticking to the one its connection landed on.
+
+    def _serve_http_requests(self, client_socket, client_address, load_balancer, session):
+        requests = HttpParser()
+        pending = collections.deque() # Parsed client events not forwarded yet
+        while True:
+            if not self.running:
+                return # Shutting down: no new requests on this connection
+            while not pending:
+                if not self._wait_readable(client_socket):
+                    return
+                data = client_socket.recv(65536)
+                if not data:
+                    return # Client closed between requests
+                try:
+                    pending.extend(requests.feed(data))
+                except HttpParseError as e:
+                    print(f"Bad request from {client_address}: {e}")
+                    self._failed(session, "bad_request")
+                    client_socket.sendall(b"HTTP/1.1 400 Bad Request\r\nConnection: close\r\nContent-Length: 0\r\n\r\n")
+                    return
+            _, request = pending.popleft() # Every message starts with its "head" event
+
+            keep_alive = None
+            cache_key = None
+            fetching = False # This request fetches cache_key for others that miss it meanwhile
+            if self.cache is not None and self.cache.cacheable_request(request):
+                cache_key = self.cache.key(request)
+                keep_alive = self._serve_cached(client_socket, load_balancer, request, cache_key, pending, session)
+                if keep_alive is None:
+                    fetching = self.cache.begin_fetch(cache_key) # Waits while another request fetches it
+                    if not fetching:
+                        keep_alive = self._serve_cached(client_socket, load_balancer, request, cache_key, pending, session)
+            if keep_alive is None:
+                try:
+                    keep_alive = self._forward_request(client_socket, client_address, load_balancer, request,
+                                                       requests, pending, session, cache_key)
+                finally:
+                    if fetching:
+                        self.cache.end_fetch(cache_key)
+            if not keep_alive:
+                return
+
+    def _forward_request(self, client_socket, client_address, load_balancer, request, requests, pending, session, cache_key=None):
+        # Sends one request to a backend and relays its response; returns whether the
+        # client connection may carry another request. With a cache_key, the response is
+        # stored in the cache if it may be.
+        balancer = self._route(load_balancer, request)
+        server = None
+        if balancer is not None:
+            key = None
+            if balancer.hash_key is not None:
+                key = affinity_key(balancer.hash_key, client_address, request)
+            server, backend_socket, connect_time = self._connect_backend(balancer, key)
+        if not server:
+            print(f"No available backend server for {request.method} {request.target}.")
+            self._failed(session, "no_backend")
+            client_socket.sendall(b"HTTP/1.1 503 Service Unavailable\r\nConnection: close\r\nContent-Length: 0\r\n\r\n")
+            return False
+
+        self._session_opened(session, server, connect_time)
+        self._count_request(session)
+        close_backend = functools.partial(_shutdown, backend_socket)
+        self._track(server, close_backend)
+        session.close_backend = close_backend
+        reusable = False
+        capture = ResponseCapture(self.cache.max_object_bytes) if cache_key is not None else None
+        try:
+            if not self._speaks_http(server):
+                # Not an HTTP backend: hand it the rest of the connection as plain bytes
+                self._relay_rest(client_socket, backend_socket, request.raw, pending, requests, session)
+                return False
+            reusable, keep_alive = self._exchange_http(client_socket, backend_socket, server, balancer,
+                                                       request, requests, pending, session, capture)
+        except (socket.error, ConnectionResetError) as e:
+            print(f"Socket error during data transfer: {e}")
+            self._failed(session, "relay")
+            return False
+        finally:
+            self._untrack(server, close_backend)
+            session.close_backend = None
+            self._backend_closed(session)
+            self.connection_pool.release(server, backend_socket, reusable)
+            self._backend_released(balancer, server)
+        if capture and capture.complete and capture.chunks is not None:
+            self.cache.store(cache_key, request, capture.response, capture.body)
+        return keep_alive
+
+    def _serve_cached(self, client_socket, load_balancer, request, cache_key, pending, session):
+        # Answers request from the cache without a backend. Returns whether the client
+        # connection may carry another request, or None on a miss. A stale hit also
+        # starts its revalidation in the background.
+        entry, state = self.cache.lookup(cache_key, request)
+        if entry is None:
+            return None
+        if pending and pending[0][0] == "end": # Cacheable requests have no body
+            pending.popleft()
+        if state == "stale" and self.cache.begin_fetch(cache_key, wait=False):
+            threading.Thread(target=self._revalidate, args=(load_balancer, request, cache_key, entry),
+                             name="cache-revalidate", daemon=True).start()
+        response = self.cache.response_bytes(entry, request)
+        client_socket.sendall(response)
+        session.traffic[1] += len(response)
+        session.requests += 1
+        return request.keep_alive
+
+    def _revalidate(self, load_balancer, request, cache_key, entry):
+        # Fetches a stale entry again, conditionally if it has a validator, and updates
+        # the cache with the answer. Runs on its own thread; no client is waiting for it.
+        try:
+            balancer = self._route(load_balancer, request)
+            server = None
+            if balancer is not None:
+                server, backend_socket, _ = self._connect_backend(balancer)
+            if not server or not self._speaks_http(server):
+                if server:
+                    self.connection_pool.release(server, backend_socket, False)
+                    self._backend_released(balancer, server)
+                return
+            reusable = False
+            try:
+                reusable = self._fetch_into_cache(backend_socket, server, balancer, request, cache_key, entry)
+            finally:
+                self.connection_pool.release(server, backend_socket, reusable)
+                self._backend_released(balancer, server)
+        except OSError as e:
+            print(f"Error revalidating {request.target}: {e}")
+        finally:
+            self.cache.end_fetch(cache_key)
+
+    def _fetch_into_cache(self, backend_socket, server, balancer, request, cache_key, entry):
+        # Returns True if the backend connection can be reused
+        head = self.cache.revalidation_head(request, entry)
+        responses = HttpParser(is_response=True)
+        responses.expect_response("GET")
+        capture = ResponseCapture(self.cache.max_object_bytes)
+        label = (backend_label(server),)
+        self.metrics.requests.inc(label)
+        started = time.monotonic()
+        backend_socket.settimeout(self.first_byte_timeout or 30.0)
+        try:
+            backend_socket.sendall(head)
+            while not responses.messages_completed:
+                data = backend_socket.recv(65536)
+                if not data:
+                    return False
+                capture.add(data, responses.feed(data))
+                if capture.chunks is None: # Too large to store: give up on this connection
+                    return False
+        except (socket.timeout, HttpParseError):
+            return False
+        finally:
+            backend_socket.settimeout(None)
+        response_time = time.monotonic() - started
+        balancer.record_response_time(server, response_time)
+        self.metrics.response_seconds.observe(response_time, label)
+        if capture.response.status == 304:
+            self.cache.refresh(cache_key, capture.response)
+        elif capture.complete:
+            self.cache.store(cache_key, request, capture.response, capture.body)
+        return responses.is_idle and responses.keep_alive
+
+    def _route(self, load_balancer, request):
+        # The balancer to pick from: a group's for requests a routing rule matches, None
+        # if that group has no backends
+        if not self.router:
+            return load_balancer
+        group = self.router.route(request)
+        if group is None:
+            return load_balancer
+        if isinstance(load_balancer, GroupedLoadBalancer):
+            return load_balancer.group(group)
+        return None
+
+    def _exchange_http(self, client_socket, backend_socket, server, balancer, request, requests, pending, session, capture=None):
+        # Sends one request (its body events are in pending or still to come from the
+        # client) and relays the response. Returns (backend connection reusable, client
+        # connection may carry another request). A ResponseCapture gets a copy of the
+        # response for the cache.
+        traffic = session.traffic
+        responses = HttpParser(is_response=True)
+        responses.expect_response(request.method)
+        label = (backend_label(server),)
+        backend_socket.sendall(request.raw)
+        traffic[0] += len(request.raw)
+        request_done = self._forward_request_body(backend_socket, pending, traffic)
+        sent_at = time.monotonic()
+        session.awaiting_since = sent_at if request_done else None # The first-byte clock starts once the body is sent
+        relayed_before = traffic[1]
+
+        while self._relaying:
+            inputs = [backend_socket] if request_done else [backend_socket, client_socket]
+            readable, _, _ = select.select(inputs, [], [], 1.0)
+            if client_socket in readable:
+                data = client_socket.recv(65536)
+                if not data:
+                    return False, False # Client left mid-request
+                try:
+                    pending.extend(requests.feed(data))
+                except HttpParseError:
+                    return False, False # Malformed body framing; the backend connection is in an unknown state
+                request_done = self._forward_request_body(backend_socket, pending, traffic)
+                if request_done and traffic[1] == relayed_before:
+                    session.awaiting_since = time.monotonic()
+            if backend_socket not in readable:
+                continue
+
+            data = backend_socket.recv(65536)
+            session.awaiting_since = None
+            if not data:
+                if traffic[1] == relayed_before: # Closed without answering (e.g. a keep-alive connection it timed out)
+                    self._failed(session, "bad_response")
+                    client_socket.sendall(GATEWAY_TIMEOUT if session.timed_out else
+                                          b"HTTP/1.1 502 Bad Gateway\r\nConnection: close\r\nContent-Length: 0\r\n\r\n")
+                return False, False # Otherwise a read-until-close body just ended, and so does the client connection
+            completed = responses.messages_completed
+            try:
+                events = responses.feed(data)
+            except HttpParseError:
+                # Can't frame the response: pass everything through until either side closes
+                client_socket.sendall(data)
+                traffic[1] += len(data)
+                self._relay_rest(client_socket, backend_socket, b"", pending, requests, session)
+                return False, False
+            if capture is not None:
+                capture.add(data, events)
+            client_socket.sendall(data)
+            traffic[1] += len(data)
+            if responses.tunnel:
+                # 101 Switching Protocols or CONNECT: from here on the bytes are not HTTP
+                self._relay_rest(client_socket, backend_socket, b"", pending, requests, session)
+                return False, False
+            if responses.messages_completed > completed:
+                response_time = time.monotonic() - sent_at
+                balancer.record_response_time(server, response_time)
+                self.metrics.response_seconds.observe(response_time, label)
+                if not request_done:
+                    return False, False # Answered before the body was sent (e.g. 413); neither side is reusable
+                return (responses.is_idle and responses.keep_alive,
+                        request.keep_alive and responses.keep_alive)
+        return False, False
+
+    def _forward_request_body(self, backend_socket, pending, traffic):
+        # Sends pending body bytes of the current request; True once its "end" is reached
+        while pending:
+            kind, value = pending.popleft()
+            if kind == "end":
+                return True
+            backend_socket.sendall(value)
+            traffic[0] += len(value)
+        return False
+
+    def _relay_rest(self, client_socket, backend_socket, head, pending, requests, session):
+        # Stops parsing: sends what was read from the client but not forwarded yet, then
+        # relays raw bytes until either side closes
+        unsent = [head]
+        unsent.extend(value.raw if kind == "head" else value for kind, value in pending if kind != "end")
+        unsent.append(requests.buffered)
+        data = b"".join(unsent)
+        if data:
+            backend_socket.sendall(data)
+            session.traffic[0] += len(data)
+        pending.clear()
+        relay(client_socket, backend_socket, lambda: self._relaying, self.relay_mode, self.relay_buffer_size, session.traffic)
+
+    def _wait_readable(self, sock):
+        # False if the proxy stops first
+        while self.running:
+            readable, _, _ = select.select([sock], [], [], 1.0)
+            if readable:
+                return True
+        return False
+
+    # --- asyncio engine ---
+    # One event loop multiplexes every client/backend pair, so concurrent connections
+    # cost a pair of small coroutines instead of a thread each.
+
+    def _start_asyncio(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._serve_asyncio())
+        except Exception as e:
+            print(f"Failed to start proxy server on {self.host}:{self.port}: {e}")
+            self.running = False
+        finally:
+            self._loop.close()
+            self._loop = None
+            self._stop_event = None
+            self._shut_down()
+
+    async def _serve_asyncio(self):
+        self._stop_event = asyncio.Event()
+        self._client_tasks = set()
+        server = await asyncio.start_server(self._client_connected, self.host, self.port, reuse_address=True,
+                                            reuse_port=self.reuse_port or None, backlog=self.backlog)
+        self.timers.start()
+        self._relaying = True
+        self.running = True
+        print(f"Proxy server listening on {self.host}:{self.port}")
+        try:
+            await self._stop_event.wait()
+        finally:
+            server.close()
+            print("Proxy server socket closed.")
+            # Let open connections finish, then cancel the rest so their sockets close before the loop does
+            tasks = set(self._client_tasks)
+            if tasks:
+                _, remaining = await asyncio.wait(tasks, timeout=self.shutdown_timeout)
+                for task in remaining:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                if remaining:
+                    print(f"Closed {len(remaining)} connections still open after the {self.shutdown_timeout}s shutdown timeout.")
+            await server.wait_closed()
+
+    def _client_connected(self, client_reader, client_writer):
+        # Runs synchronously when a connection is accepted. With TLS, reading stops right
+        # away so the ClientHello cannot land in the plain stream before start_tls() takes over.
+        if self.tls:
+            client_writer.transport.pause_reading()
+        return self.handle_client_async(client_reader, client_writer)
+
+    async def handle_client_async(self, client_reader, client_writer):
+        load_balancer = self.load_balancer
+        backend_server_info = None
+        backend_writer = None
+        close_backend = None
+        session = _Session()
+        admitted = False
+        task = asyncio.current_task()
+        self._client_tasks.add(task)
+        try:
+            rejection = await self._admit_async(client_writer.get_extra_info("peername"))
+            if rejection:
+                self._failed(session, rejection)
+                await self._send_error_async(client_writer, REJECTIONS[rejection])
+                return
+            admitted = True
+            self._open_session(session, functools.partial(self._loop.call_soon_threadsafe, client_writer.close))
+            if self.tls and not await self._handshake_async(client_writer):
+                self._failed(session, "tls_handshake")
+                return
+
+            if not load_balancer or not load_balancer.servers:
+                print("No load balancing algorithm selected or no backend servers available.")
+                self._failed(session, "no_backend")
+                client_writer.write(b"HTTP/1.1 503 Service Unavailable\r\n\r\nNo backend servers available.")
+                await client_writer.drain()
+                return
+
+            initial_data = b""
+            key = None
+            if load_balancer.hash_key is not None:
+                request_head = None
+                if load_balancer.hash_key != "client_ip":
+                    initial_data, request_head = await self._read_request_head_async(client_reader)
+                key = affinity_key(load_balancer.hash_key, client_writer.get_extra_info("peername"), request_head)
+
+            backend_server_info, backend_reader, backend_writer, connect_time = await self._connect_backend_async(load_balancer, key)
+            if not backend_server_info:
+                print("Load balancer returned no available server.")
+                self._failed(session, "no_backend")
+                client_writer.write(b"HTTP/1.1 503 Service Unavailable\r\n\r\nNo available backend servers.")
+                await client_writer.drain()
+                return
+
+            load_balancer.record_response_time(backend_server_info, connect_time)
+            self._session_opened(session, backend_server_info, connect_time)
+            self._count_request(session)
+            close_backend = functools.partial(self._loop.call_soon_threadsafe, backend_writer.close)
+            self._track(backend_server_info, close_backend)
+            session.close_backend = close_backend
+            if initial_data:
+                backend_writer.write(initial_data)
+                session.traffic[0] += len(initial_data)
+
+            # Proxy data in both directions until either side closes
+            pipes = [
+                asyncio.ensure_future(self._pipe_async(client_reader, backend_writer, session, 0)),
+                asyncio.ensure_future(self._pipe_async(backend_reader, client_writer, session, 1)),
+            ]
+            try:
+                await asyncio.wait(pipes, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for pipe in pipes:
+                    pipe.cancel()
+                await asyncio.gather(*pipes, return_exceptions=True)
+
+        except ConnectionRefusedError:
+            print("Connection to backend refused. It might be down.")
+            self._failed(session, "backend_refused")
+            await self._send_error_async(client_writer, b"HTTP/1.1 503 Service Unavailable\r\n\r\nBackend server refused connection.\r\n")
+        except (socket.timeout, asyncio.TimeoutError):
+            print("Socket timeout during initial connection or data transfer.")
+            self._failed(session, "backend_timeout")
+            await self._send_error_async(client_writer, b"HTTP/1.1 504 Gateway Timeout\r\n\r\nBackend server connection timed out.\r\n")
+        except Exception as e:
+            print(f"Error handling client connection: {e}")
+            self._failed(session, "internal")
+            await self._send_error_async(client_writer, b"HTTP/1.1 500 Internal Server Error\r\n\r\nLoad balancer internal error.\r\n")
+        finally:
+            self._client_tasks.discard(task)
+            if close_backend:
+                self._untrack(backend_server_info, close_backend)
+            session.close_backend = None
+            self._end_session(session)
+            self._session_closed(session, client_writer.get_extra_info("peername"))
+            client_writer.close()
+            if backend_writer:
+                backend_writer.close()
+            if backend_server_info:
+                self._backend_released(load_balancer, backend_server_info)
+            if admitted:
+                self.admission.release()
+
+    async def _admit_async(self, client_address):
+        # asyncio counterpart of _admit; waiting for a slot does not block the loop
+        if not self.admission.allow(client_address[0] if client_address else None):
+            return "rate_limited"
+        if not await self.admission.acquire_async():
+            return "over_capacity"
+        return None
+
+    async def _handshake_async(self, client_writer):
+        # The loop does the handshake without blocking other connections; False if it failed
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(client_writer.start_tls(self.tls.context), self.tls.handshake_timeout)
+        except (OSError, asyncio.TimeoutError): # ssl.SSLError is an OSError
+            self.tls.handshakes.inc(("failed",))
+            return False
+        self.tls.record(client_writer.get_extra_info("ssl_object"), time.monotonic() - started)
+        return True
+
+    async def _connect_backend_async(self, load_balancer, key=None):
+        # asyncio counterpart of _connect_backend; returns (server, reader, writer, connect seconds)
+        last_error = None
+        for server, timeout in self._connect_attempts(load_balancer, key):
+            if not self.admission.reserve_backend(server):
+                continue # Filled up since it was picked
+            load_balancer.on_connection_open(server)
+            started = time.monotonic()
+            try:
+                tls_context = self.connection_pool.tls_context if server.protocol == "https" else None
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(server.host, server.port, ssl=tls_context,
+                                            server_hostname=server.host if tls_context else None), timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                self._connect_failed(load_balancer, server, e)
+                last_error = e
+                continue
+            self.outlier_detector.record_success(server)
+            return server, reader, writer, time.monotonic() - started
+        if last_error:
+            raise last_error
+        return None, None, None, None
+
+    async def _pipe_async(self, reader, writer, session, direction):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    return
+                writer.write(data)
+                session.traffic[direction] += len(data)
+                await writer.drain()
+        except (socket.error, ConnectionResetError) as e:
+            print(f"Socket error during data transfer: {e}")
+            self._failed(session, "relay")
+
+    async def _read_request_head_async(self, reader, timeout=5.0):
+        try:
+            data = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+        except asyncio.IncompleteReadError as e:
+            return e.partial, None
+        except asyncio.LimitOverrunError:
+            return await reader.read(65536), None # Head longer than the stream limit; no affinity
+        except asyncio.TimeoutError:
+            return b"", None
+        try:
+            return data, parse_head(data, is_response=False)
+        except HttpParseError:
+            return data, None
+
+    async def _send_error_async(self, writer, response):
+        try:
+            writer.write(response)
+            await writer.drain()
+        except (socket.error, ConnectionResetError):
+            pass # Client already went away
@@ -0,0 +1,175 @@
+import os
+import select
+import ssl
+
+# Byte relays used by ProxyServer for raw TCP backends. Both keep data out of
+# freshly allocated Python objects:
+#  - "splice" moves bytes socket -> pipe -> socket inside the kernel (Linux only)
+#  - "buffer" reads into one reusable buffer per direction with recv_into()
+# TLS sockets always use "buffer": their bytes have to pass through OpenSSL.
+
+try:
+    import fcntl
+    F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+except ImportError: # Non-Unix platforms
+    fcntl = None
+
+SPLICE_AVAILABLE = hasattr(os, "splice") and fcntl is not None
+DEFAULT_BUFFER_SIZE = 65536
+RELAY_MODES = ("auto", "splice", "buffer", "copy")
+
+
+def resolve_relay_mode(mode):
+    if mode not in RELAY_MODES:
+        raise ValueError(f"Unknown relay mode '{mode}'. Expected one of: {', '.join(RELAY_MODES)}")
+    if mode == "auto":
+        return "splice" if SPLICE_AVAILABLE else "buffer"
+    if mode == "splice" and not SPLICE_AVAILABLE:
+        return "buffer" # Fall back rather than fail on kernels/platforms without splice(2)
+    return mode
+
+
+def relay(client_socket, backend_socket, is_running, mode="auto", buffer_size=DEFAULT_BUFFER_SIZE, counts=None):
+    # Returns when either side closes its connection (after passing on the bytes already
+    # read) or is_running() turns false. Socket errors are left to the caller, matching
+    # the copy loop in ProxyServer.
+    # counts, if given, is a two-item list that accumulates bytes [to backend, to client].
+    #
+    # Both relays keep the bytes read but not yet written per direction and wait for
+    # readable sources and writable destinations in one select(). A direction reads
+    # again only once its bytes are out, so a peer that stops reading stalls its own
+    # direction but never the other one: with a blocking write per read, a client that
+    # sends while the backend echoes back to it would deadlock with the relay.
+    # The sockets are non-blocking while the relay runs.
+    mode = resolve_relay_mode(mode)
+    if isinstance(client_socket, ssl.SSLSocket) or isinstance(backend_socket, ssl.SSLSocket):
+        mode = "buffer"
+    if counts is None:
+        counts = [0, 0]
+    timeouts = [sock.gettimeout() for sock in (client_socket, backend_socket)]
+    try:
+        for sock in (client_socket, backend_socket):
+            sock.setblocking(False)
+        if mode == "splice":
+            _splice_relay(client_socket, backend_socket, is_running, buffer_size, counts)
+        else:
+            _buffer_relay(client_socket, backend_socket, is_running, buffer_size, counts)
+    finally:
+        for sock, timeout in zip((client_socket, backend_socket), timeouts):
+            if sock.fileno() != -1:
+                sock.settimeout(timeout)
+
+
+def _buffer_relay(client_socket, backend_socket, is_running, buffer_size, counts):
+    # Per direction: [source, destination, buffer, start, end, direction]; buffer[start:end] is still to be sent
+    directions = [[client_socket, backend_socket, memoryview(bytearray(buffer_size)), 0, 0, 0],
+                  [backend_socket, client_socket, memoryview(bytearray(buffer_size)), 0, 0, 1]]
+    closing = False # A side closed: only send what is left
+    progress = False
+    while is_running():
+        if closing and all(d[3] == d[4] for d in directions):
+            return
+        readers = [d[0] for d in directions if not closing and d[3] == d[4]]
+        writers = [d[1] for d in directions if d[3] < d[4]]
+        if progress: # Bytes moved last time: try again before paying for a select()
+            readable, writable = readers, writers
+        else:
+            # Decrypted bytes OpenSSL already holds don't make the socket readable for select()
+            readable = [sock for sock in readers if isinstance(sock, ssl.SSLSocket) and sock.pending()]
+            writable = []
+            if not readable:
+                readable, writable, _ = select.select(readers, writers, [], 1.0)
+        progress = False
+        for d in directions:
+            source, destination, view = d[0], d[1], d[2]
+            if d[3] == d[4]:
+                if closing or source not in readable:
+                    continue
+                received = _recv_into(source, view)
+                if received == 0:
+                    closing = True
+                if not received:
+                    continue
+                d[4] = received
+                counts[d[5]] += received
+                progress = True
+            elif destination not in writable:
+                continue
+            # Just read, or the destination has room again: most of the time it all goes now
+            sent = _send(destination, view[d[3]:d[4]])
+            d[3] += sent
+            progress = progress or sent > 0
+            if d[3] == d[4]:
+                d[3] = d[4] = 0
+
+
+def _recv_into(sock, view):
+    # Bytes read, 0 at EOF, or None if there was nothing to read after all
+    try:
+        return sock.recv_into(view)
+    except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+        return None
+
+
+def _send(sock, view):
+    try:
+        return sock.send(view)
+    except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+        return 0
+
+
+def _open_pipe(buffer_size):
+    read_fd, write_fd = os.pipe()
+    try:
+        fcntl.fcntl(write_fd, F_SETPIPE_SZ, buffer_size)
+    except OSError:
+        pass # Keep the default pipe size if the requested one exceeds /proc/sys/fs/pipe-max-size
+    return read_fd, write_fd
+
+
+def _splice_relay(client_socket, backend_socket, is_running, buffer_size, counts):
+    flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+    client_fd = client_socket.fileno()
+    backend_fd = backend_socket.fileno()
+    # Per direction: [source fd, destination fd, pipe read fd, pipe write fd, bytes in the pipe, direction]
+    directions = []
+    try:
+        for source_fd, destination_fd, direction in ((client_fd, backend_fd, 0), (backend_fd, client_fd, 1)):
+            read_fd, write_fd = _open_pipe(buffer_size)
+            directions.append([source_fd, destination_fd, read_fd, write_fd, 0, direction])
+        closing = False # A side closed: only pass on what is in the pipes
+        progress = False
+        while is_running():
+            if closing and not any(d[4] for d in directions):
+                return
+            readers = [d[0] for d in directions if not closing and not d[4]]
+            writers = [d[1] for d in directions if d[4]]
+            if progress: # Bytes moved last time: try again before paying for a select()
+                readable, writable = readers, writers
+            else:
+                readable, writable, _ = select.select(readers, writers, [], 1.0)
+            progress = False
+            for d in directions:
+                source_fd, destination_fd, read_fd, write_fd = d[0], d[1], d[2], d[3]
+                try:
+                    if not d[4]:
+                        if closing or source_fd not in readable:
+                            continue
+                        moved = os.splice(source_fd, write_fd, buffer_size, flags=flags)
+                        if not moved:
+                            closing = True
+                            continue
+                        d[4] = moved
+                        counts[d[5]] += moved
+                        progress = True
+                    elif destination_fd not in writable:
+                        continue
+                    # Just read, or the destination has room again: most of the time it all goes now
+                    d[4] -= os.splice(read_fd, destination_fd, d[4], flags=flags)
+                    progress = True
+                except BlockingIOError:
+                    continue
+    finally:
+        for d in directions:
+            os.close(d[2])
+            os.close(d[3])
@@ -0,0 +1,67 @@
+import math
+
+# Slow start: a backend that joins a balancer (added by config, or put back by the health
+# checker after a restart) does not get its full weight at once. Its effective weight
+# starts at min_fraction of its weight and reaches all of it after window seconds, along
+# a linear or an exponential curve. The ramp moves in `steps` discrete steps, so a
+# balancer only has to update its weight tables a bounded number of times per window,
+# never on every pick.
+
+CURVES = ("linear", "exponential")
+
+
+class SlowStart:
+    def __init__(self, window=30.0, curve="linear", min_fraction=0.1, steps=10):
+        if curve not in CURVES:
+            raise ValueError(f"Unknown slow start curve '{curve}'. Expected one of: {', '.join(CURVES)}")
+        if window <= 0 or steps < 1 or not 0 < min_fraction <= 1:
+            raise ValueError("Slow start needs window > 0, steps >= 1 and 0 < min_fraction <= 1.")
+        self.window = window
+        self.curve = curve
+        self.min_fraction = min_fraction
+        self.steps = steps
+        self.step = window / steps # Seconds between weight changes
+        # Integer weights are scaled by this while a ramp runs, so that every step of the
+        # smallest ramp is still a whole number
+        self.resolution = math.ceil(steps / min_fraction)
+        self._started = {} # id(server) -> monotonic time its ramp began
+
+    def begin(self, server, now):
+        self._started[id(server)] = now
+
+    def forget(self, server):
+        self._started.pop(id(server), None)
+
+    def clear(self):
+        self._started.clear()
+
+    def ramping(self):
+        return list(self._started)
+
+    def fraction(self, server, now):
+        # Share of its configured weight the server gets now
+        started = self._started.get(id(server))
+        if started is None:
+            return 1.0
+        progress = math.floor((now - started) / self.step) / self.steps
+        if progress >= 1:
+            return 1.0
+        if self.curve == "linear":
+            return self.min_fraction + (1 - self.min_fraction) * progress
+        return self.min_fraction ** (1 - progress)
+
+    def weight(self, server, now):
+        return server.weight * self.fraction(server, now)
+
+    def next_step(self, now):
+        # When the next ramp step is due, or None once no server is ramping. Servers that
+        # finished their ramp are dropped.
+        next_step = None
+        for key, started in list(self._started.items()):
+            if now - started >= self.window:
+                del self._started[key]
+                continue
+            due = started + (math.floor((now - started) / self.step) + 1) * self.step
+            if next_step is None or due < next_step:
+                next_step = due
+        return next_step
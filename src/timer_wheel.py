@@ -0,0 +1,84 @@
+import math
+import threading
+import time
+
+# Hashed timer wheel: one background thread serves every timeout in the proxy. A timer
+# lands in the slot its deadline hashes to, with the number of full turns of the
+# wheel still to wait, so scheduling and cancelling are O(1) and each tick only looks
+# at one slot. Deadlines are kept to the tick (0.1s by default); callbacks run on the wheel
+# thread and must be quick (e.g. shutting down a socket).
+
+
+class Timer:
+    __slots__ = ("callback", "slot", "rounds")
+
+    def __init__(self, callback, slot, rounds):
+        self.callback = callback
+        self.slot = slot
+        self.rounds = rounds # Turns of the wheel left before it fires
+
+
+class TimerWheel:
+    def __init__(self, tick=0.1, slots=512):
+        self.tick = tick
+        self.slots = slots
+        self._wheel = [set() for _ in range(slots)]
+        self._cursor = 0 # Slot of the tick in progress
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="timer-wheel", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def schedule(self, delay, callback):
+        # Calls callback() once delay seconds have passed, give or take a tick
+        ticks = max(1, math.ceil(delay / self.tick))
+        with self._lock:
+            slot = (self._cursor + ticks) % self.slots
+            timer = Timer(callback, slot, (ticks - 1) // self.slots)
+            self._wheel[slot].add(timer)
+        return timer
+
+    def cancel(self, timer):
+        with self._lock:
+            self._wheel[timer.slot].discard(timer)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(slot) for slot in self._wheel)
+
+    def _run(self):
+        next_tick = time.monotonic() + self.tick
+        while not self._stop_event.wait(max(0.0, next_tick - time.monotonic())):
+            # Catch up tick by tick if the thread fell behind
+            while time.monotonic() >= next_tick:
+                self._advance()
+                next_tick += self.tick
+
+    def _advance(self):
+        due = []
+        with self._lock:
+            self._cursor = (self._cursor + 1) % self.slots
+            slot = self._wheel[self._cursor]
+            for timer in list(slot):
+                if timer.rounds:
+                    timer.rounds -= 1
+                else:
+                    slot.discard(timer)
+                    due.append(timer)
+        for timer in due:
+            try:
+                timer.callback()
+            except Exception as e:
+                print(f"Error in timer callback: {e}")
@@ -0,0 +1,200 @@
+import heapq
+import itertools
+import selectors
+import socket
+import ssl
+import threading
+import time
+
+from src.metrics import Counter, Histogram
+
+# TLS termination for the listener and re-encryption to "https" backends.
+# The threaded engine drives every client handshake from one handshake thread: the
+# sockets are non-blocking, and a selector steps each handshake only when its bytes
+# have arrived, so slow or idle clients cost a file descriptor, not a thread. The
+# accept loop hands the socket over and goes straight back to accepting, and a
+# connection gets its handler thread only once it has completed a handshake. At most
+# max_pending handshakes run at once; a client gets hello_timeout seconds to send its
+# ClientHello and handshake_timeout seconds for the whole handshake. The crypto runs
+# on the handshake thread too: use worker processes to spread it over CPUs.
+# Clients resume sessions with TLS 1.3 session tickets (or TLS 1.2 tickets / OpenSSL's
+# server-side session cache); build the server context before forking workers so that
+# they all share the ticket keys.
+
+TLS_VERSIONS = ("TLSv1.2", "TLSv1.3")
+
+
+def server_context(certfile, keyfile=None, min_version="TLSv1.2", ciphers=None, session_tickets=True):
+    if min_version not in TLS_VERSIONS:
+        raise ValueError(f"Unknown TLS version '{min_version}'. Expected one of: {', '.join(TLS_VERSIONS)}")
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = getattr(ssl.TLSVersion, min_version.replace(".", "_"))
+    context.load_cert_chain(certfile, keyfile)
+    if ciphers:
+        context.set_ciphers(ciphers)
+    if not session_tickets:
+        context.options |= ssl.OP_NO_TICKET # TLS 1.2 falls back to the session cache
+        context.num_tickets = 0
+    context.set_alpn_protocols(["http/1.1"]) # The proxy only frames HTTP/1.x
+    return context
+
+
+def backend_context(verify=True, ca_file=None):
+    context = ssl.create_default_context(cafile=ca_file)
+    if not verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+class _Handshake:
+    __slots__ = ("sock", "on_done", "on_failed", "started", "deadline", "hello")
+
+    def __init__(self, sock, on_done, on_failed, started, deadline):
+        self.sock = sock
+        self.on_done = on_done
+        self.on_failed = on_failed
+        self.started = started
+        self.deadline = deadline
+        self.hello = False # Bytes of the ClientHello have arrived
+
+
+class TlsTerminator:
+    def __init__(self, context, handshake_timeout=10.0, hello_timeout=2.0, max_pending=1024):
+        self.context = context
+        self.handshake_timeout = handshake_timeout # Seconds a client gets to complete its handshake
+        self.hello_timeout = hello_timeout # Seconds a client gets to start it (threaded engine)
+        self.max_pending = max_pending # Handshakes in progress at once (threaded engine)
+        self.handshakes = Counter("magiclb_tls_handshakes_total", "TLS handshakes with clients by result (full, resumed, failed, refused).", ("result",))
+        self.handshake_seconds = Histogram("magiclb_tls_handshake_seconds", "Time to complete a TLS handshake with a client.", ("result",))
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._incoming = [] # Handshakes submitted but not yet registered with the selector
+        self._selector = None
+        self._wakeup = None # (read end, write end)
+        self._thread = None
+        self._closed = False
+
+    def submit(self, sock, on_done, on_failed):
+        # Starts a server-side handshake without blocking. On the handshake thread, and
+        # quickly: on_done(tls_socket) runs once it completes, on_failed() once it failed
+        # or timed out and the socket is closed. False (and nothing called) when
+        # max_pending handshakes are in progress already; sock is left to the caller.
+        with self._lock:
+            if self._closed or (self.max_pending is not None and self.pending >= self.max_pending):
+                self.handshakes.inc(("refused",))
+                return False
+            if self._thread is None:
+                self._selector = selectors.DefaultSelector()
+                self._wakeup = socket.socketpair()
+                for end in self._wakeup:
+                    end.setblocking(False)
+                self._selector.register(self._wakeup[0], selectors.EVENT_READ)
+                self._thread = threading.Thread(target=self._run, name="tls-handshake", daemon=True)
+                self._thread.start()
+            self.pending += 1
+            started = time.monotonic()
+            self._incoming.append(_Handshake(sock, on_done, on_failed, started, started + self.hello_timeout))
+            wake = len(self._incoming) == 1
+        if wake:
+            self._wake()
+        return True
+
+    def record(self, ssl_object, seconds):
+        # ssl_object: an SSLSocket, or the SSLObject of an asyncio transport
+        result = "resumed" if ssl_object.session_reused else "full"
+        self.handshakes.inc((result,))
+        self.handshake_seconds.observe(seconds, (result,))
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            running = self._thread is not None
+        if running:
+            self._wake()
+
+    def _wake(self):
+        try:
+            self._wakeup[1].send(b"\0")
+        except OSError:
+            pass # Wakeup buffer full: the thread is woken already
+
+    def _run(self):
+        deadlines = [] # Heap of (deadline, sequence, handshake); stale entries are skipped
+        sequence = itertools.count()
+        while True:
+            timeout = max(0.0, deadlines[0][0] - time.monotonic()) if deadlines else None
+            for key, _ in self._selector.select(timeout):
+                if key.data is None:
+                    try:
+                        self._wakeup[0].recv(4096)
+                    except OSError:
+                        pass
+                else:
+                    self._step(key.data, deadlines, sequence)
+            with self._lock:
+                incoming, self._incoming = self._incoming, []
+                closed = self._closed
+            for handshake in incoming:
+                self._start(handshake, deadlines, sequence)
+            if closed:
+                break
+            now = time.monotonic()
+            while deadlines and deadlines[0][0] <= now:
+                _, _, handshake = heapq.heappop(deadlines)
+                if handshake.deadline <= now and handshake.sock is not None:
+                    self._fail(handshake)
+        for key in list(self._selector.get_map().values()):
+            if key.data is not None:
+                self._fail(key.data)
+        self._selector.close()
+        for end in self._wakeup:
+            end.close()
+
+    def _start(self, handshake, deadlines, sequence):
+        try:
+            handshake.sock.setblocking(False)
+            handshake.sock = self.context.wrap_socket(handshake.sock, server_side=True, do_handshake_on_connect=False)
+            self._selector.register(handshake.sock, selectors.EVENT_READ, handshake)
+        except (OSError, ValueError):
+            self._fail(handshake)
+            return
+        heapq.heappush(deadlines, (handshake.deadline, next(sequence), handshake))
+
+    def _step(self, handshake, deadlines, sequence):
+        # The socket is ready: take the handshake as far as the bytes that have arrived allow
+        if not handshake.hello:
+            handshake.hello = True
+            handshake.deadline = handshake.started + self.handshake_timeout
+            heapq.heappush(deadlines, (handshake.deadline, next(sequence), handshake))
+        sock = handshake.sock
+        try:
+            sock.do_handshake()
+        except ssl.SSLWantReadError:
+            self._selector.modify(sock, selectors.EVENT_READ, handshake)
+            return
+        except ssl.SSLWantWriteError:
+            self._selector.modify(sock, selectors.EVENT_WRITE, handshake)
+            return
+        except (OSError, ValueError):
+            self._fail(handshake)
+            return
+        self._selector.unregister(sock)
+        handshake.sock = None
+        with self._lock:
+            self.pending -= 1
+        sock.setblocking(True)
+        self.record(sock, time.monotonic() - handshake.started)
+        handshake.on_done(sock)
+
+    def _fail(self, handshake):
+        sock, handshake.sock = handshake.sock, None
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass # Not registered yet
+        sock.close()
+        with self._lock:
+            self.pending -= 1
+        self.handshakes.inc(("failed",))
+        handshake.on_failed()
@@ -0,0 +1,88 @@
+import multiprocessing
+import os
+import signal
+import time
+
+# Pre-fork worker mode: the supervisor (the process runServer.sh tracks) forks N
+# workers that each run their own ProxyServer bound to the same port with
+# SO_REUSEPORT, so the kernel spreads incoming connections across all of them.
+
+
+def resolve_worker_count(workers):
+    if workers in (None, "auto", 0):
+        return os.cpu_count() or 1
+    workers = int(workers)
+    if workers < 1:
+        raise ValueError("Worker count must be at least 1 (or 'auto').")
+    return workers
+
+
+class WorkerSupervisor:
+    def __init__(self, worker_count, worker_target, restart_delay=1.0, shutdown_timeout=5.0):
+        self.worker_count = worker_count
+        self.worker_target = worker_target # Called with the worker number in each child process
+        self.restart_delay = restart_delay # Minimum seconds between restarts of the same worker slot
+        self.shutdown_timeout = shutdown_timeout # Seconds workers get to drain after SIGTERM before SIGKILL
+        self.workers = [None] * worker_count
+        self.last_started = [0.0] * worker_count
+        self.running = False
+        self._context = multiprocessing.get_context("fork")
+
+    def _spawn(self, slot):
+        process = self._context.Process(target=self._run_worker, args=(slot,), name=f"magicLB-worker-{slot}")
+        process.start()
+        self.workers[slot] = process
+        self.last_started[slot] = time.monotonic()
+        print(f"Started worker {slot} (PID: {process.pid})")
+
+    def _run_worker(self, slot):
+        # Workers get default signal handling back; the supervisor owns restarts and reloads
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        self.worker_target(slot)
+
+    def reload(self, *_):
+        # Spread a config change to every worker; each one re-reads config.json on SIGHUP
+        for process in self.workers:
+            if process and process.is_alive():
+                os.kill(process.pid, signal.SIGHUP)
+
+    def stop(self, *_):
+        self.running = False
+
+    def run(self):
+        self.running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, self.reload)
+        print(f"Supervisor (PID: {os.getpid()}) starting {self.worker_count} workers")
+        for slot in range(self.worker_count):
+            self._spawn(slot)
+
+        try:
+            while self.running:
+                for slot, process in enumerate(self.workers):
+                    if process.is_alive():
+                        continue
+                    if time.monotonic() - self.last_started[slot] < self.restart_delay:
+                        continue # Don't spin if a worker keeps dying right after start
+                    print(f"Worker {slot} (PID: {process.pid}) exited with code {process.exitcode}. Restarting.")
+                    self._spawn(slot)
+                time.sleep(0.2)
+        finally:
+            self.shutdown()
+
+    def shutdown(self, timeout=None):
+        timeout = self.shutdown_timeout if timeout is None else timeout
+        for process in self.workers:
+            if process and process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in self.workers:
+            if process:
+                process.join(max(0.0, deadline - time.monotonic()))
+                if process.is_alive():
+                    process.kill()
+                    process.join()
+        print("All workers stopped.")
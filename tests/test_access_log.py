@@ -0,0 +1,69 @@
+import json
+import os
+import tempfile
+import unittest
+
+from src.access_log import AccessLog
+
+
+class TestAccessLog(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "access.log")
+
+    def read_lines(self, path=None):
+        with open(path or self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_writes_json_lines(self):
+        log = AccessLog(self.path)
+        log.start()
+        log.log(("10.0.0.7", 51234), "10.0.0.2:8000", "ok", 0.5, 10, 20, 1)
+        log.log(("10.0.0.8", 51235), None, "no_backend", 0.001)
+        log.stop()
+        first, second = self.read_lines()
+        self.assertEqual(first["client"], "10.0.0.7:51234")
+        self.assertEqual(first["backend"], "10.0.0.2:8000")
+        self.assertEqual((first["bytes_in"], first["bytes_out"], first["requests"]), (10, 20, 1))
+        self.assertEqual(second["outcome"], "no_backend")
+        self.assertIsNone(second["backend"])
+
+    def test_full_queue_drops_and_counts(self):
+        log = AccessLog(self.path, max_queue=2)
+        for _ in range(5):
+            log.log(None, "b:1", "ok", 0.1)
+        self.assertEqual(log.dropped.collect(), {(): 3})
+        log.start()
+        log.stop()
+        self.assertEqual(len(self.read_lines()), 2)
+
+    def test_sampling_keeps_errors(self):
+        log = AccessLog(self.path, sample_rate=0.0)
+        log.log(None, "b:1", "ok", 0.1)
+        log.log(None, "b:1", "backend_refused", 0.1)
+        log.start()
+        log.stop()
+        self.assertEqual([entry["outcome"] for entry in self.read_lines()], ["backend_refused"])
+
+    def test_rotation(self):
+        log = AccessLog(self.path, max_bytes=200, backup_count=2, batch_size=1)
+        log.start()
+        for _ in range(20):
+            log.log(None, "b:1", "ok", 0.1)
+        log.stop()
+        self.assertTrue(os.path.exists(self.path + ".1"))
+        self.assertTrue(os.path.exists(self.path + ".2"))
+        self.assertFalse(os.path.exists(self.path + ".3"))
+        self.assertLess(os.path.getsize(self.path + ".1"), 400)
+
+    def test_size_counts_bytes(self):
+        log = AccessLog(self.path, batch_size=1)
+        log._open()
+        log._write(['{"backend":"bücher:1"}\n'])
+        self.assertEqual(log._size, os.path.getsize(self.path))
+        log._file.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from src.admission import AdmissionController
+from src.backend_server import BackendServer
+
+
+class TestAdmissionController(unittest.TestCase):
+    def test_token_bucket_allows_burst_then_refills(self):
+        admission = AdmissionController(rate=20, burst=3)
+        self.assertEqual([admission.allow("10.0.0.1") for _ in range(4)], [True, True, True, False])
+        self.assertTrue(admission.allow("10.0.0.2")) # Buckets are per client
+        time.sleep(0.1) # Two tokens at 20/s
+        self.assertEqual([admission.allow("10.0.0.1") for _ in range(3)], [True, True, False])
+        self.assertEqual(admission.stats["rate_limited"], 2)
+
+    def test_client_buckets_are_bounded(self):
+        admission = AdmissionController(rate=1, max_clients=100)
+        for i in range(1000):
+            admission.allow(f"10.0.{i // 256}.{i % 256}")
+        self.assertEqual(admission.tracked_clients(), 100)
+
+    def test_connection_cap_with_bounded_wait(self):
+        admission = AdmissionController(max_connections=2)
+        self.assertTrue(admission.acquire())
+        self.assertTrue(admission.acquire())
+        self.assertFalse(admission.acquire())
+        self.assertFalse(admission.acquire(timeout=0.05))
+        threading.Timer(0.05, admission.release).start()
+        self.assertTrue(admission.acquire(timeout=2))
+        self.assertEqual(admission.stats, {"admitted": 3, "queued": 2, "rate_limited": 0, "over_capacity": 2, "backend_full": 0})
+
+    def test_queue_is_fifo_and_bounded(self):
+        admission = AdmissionController(max_connections=1, queue_timeout=1, max_queued=2)
+        self.assertTrue(admission.try_acquire())
+        admitted = []
+        first = admission.queue(lambda: admitted.append("first"))
+        second = admission.queue(lambda: admitted.append("second"))
+        self.assertIsNone(admission.queue(lambda: admitted.append("third"))) # Queue full
+        self.assertTrue(admission.cancel(first))
+        self.assertFalse(admission.try_acquire()) # A new arrival does not jump the queue
+        admission.release()
+        self.assertEqual(admitted, ["second"]) # The cancelled waiter is skipped
+        self.assertFalse(admission.cancel(second))
+        admission.release()
+        self.assertEqual((admission.active, admission.queued), (0, 0))
+        self.assertEqual((admission.stats["queued"], admission.stats["over_capacity"]), (2, 2))
+
+    def test_async_wait_for_slot(self):
+        admission = AdmissionController(max_connections=1, queue_timeout=2)
+
+        async def run():
+            self.assertTrue(await admission.acquire_async())
+            asyncio.get_running_loop().call_later(0.05, admission.release)
+            self.assertTrue(await admission.acquire_async())
+            self.assertFalse(await admission.acquire_async(timeout=0.05))
+
+        asyncio.run(run())
+        self.assertEqual(admission.active, 1)
+
+    def test_backend_limit(self):
+        admission = AdmissionController(max_backend_connections=1)
+        server = BackendServer(1, "127.0.0.1", 8000)
+        self.assertTrue(admission.reserve_backend(server))
+        self.assertTrue(admission.backend_full(server))
+        self.assertFalse(admission.reserve_backend(server))
+        admission.release_backend(server)
+        self.assertFalse(admission.backend_full(server))
+        self.assertEqual(admission.backend_connections(server), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import socket
+import unittest
+
+from src.backend_server import BackendRegistry, BackendServer, StandInBackend
+
+
+def read_until(sock, predicate):
+    data = b""
+    while not predicate(data):
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+class TestStandInBackend(unittest.TestCase):
+    def start(self, mode, **kwargs):
+        backend = StandInBackend(mode, **kwargs).start()
+        self.addCleanup(backend.stop)
+        return backend
+
+    def test_http_answers_pipelined_requests_with_bodies(self):
+        backend = self.start("http", response_size=3)
+        with socket.create_connection(("127.0.0.1", backend.port), timeout=2) as client:
+            client.sendall(b"POST / HTTP/1.1\r\nContent-Length: 4\r\n\r\nbody"
+                           b"GET / HTTP/1.1\r\nConnection: close\r\n\r\n")
+            response = read_until(client, lambda data: data.count(b"xxx") == 2)
+        self.assertEqual(response.count(b"HTTP/1.1 200 OK\r\nContent-Length: 3\r\n\r\nxxx"), 2)
+        self.assertEqual(backend.requests, 2)
+
+    def test_echo_returns_every_byte(self):
+        backend = self.start("echo")
+        with socket.create_connection(("127.0.0.1", backend.port), timeout=2) as client:
+            client.sendall(b"ping" * 1000)
+            self.assertEqual(read_until(client, lambda data: len(data) >= 4000), b"ping" * 1000)
+
+    def test_as_server(self):
+        server = self.start("echo").as_server(7, weight=3)
+        self.assertEqual((server.id, server.protocol, server.weight), (7, "tcp", 3))
+        with self.assertRaises(ValueError):
+            StandInBackend("smtp")
+
+
+class TestBackendRegistry(unittest.TestCase):
+    def test_ids_are_stable(self):
+        registry = BackendRegistry([BackendServer(1, "10.0.0.1", 80), BackendServer(5, "10.0.0.2", 80)])
+        self.assertEqual(registry.add("10.0.0.3", 80).id, 6) # Past the highest ID, not len + 1
+        registry.remove(5)
+        self.assertEqual(registry.add("10.0.0.4", 80).id, 7) # Removed IDs are not reused
+        self.assertEqual([server.id for server in registry], [1, 6, 7]) # Nothing renumbered
+
+    def test_lookups_follow_updates(self):
+        registry = BackendRegistry()
+        server = registry.add("10.0.0.1", 80)
+        self.assertIs(registry.get(server.id), server)
+        self.assertIs(registry.find("10.0.0.1", 80), server)
+        registry.update(server.id, port=8080, weight=3)
+        self.assertIsNone(registry.find("10.0.0.1", 80))
+        self.assertIs(registry.find("10.0.0.1", 8080), server)
+        self.assertEqual(server.weight, 3)
+        self.assertIsNone(registry.update(99, weight=2))
+        self.assertIsNone(registry.remove(99))
+
+    def test_duplicates_rejected(self):
+        registry = BackendRegistry([BackendServer(1, "10.0.0.1", 80)])
+        with self.assertRaises(ValueError):
+            registry.register(BackendServer(1, "10.0.0.2", 80))
+        with self.assertRaises(ValueError):
+            registry.add("10.0.0.1", 80)
+        other = registry.add("10.0.0.2", 80)
+        with self.assertRaises(ValueError):
+            registry.update(other.id, host="10.0.0.1")
+        self.assertIs(registry.find("10.0.0.2", 80), other)
+
+    def test_update_and_remove(self):
+        registry = BackendRegistry()
+        server = registry.add("10.0.0.1", 80)
+        self.assertIs(registry.update(server.id, weight=2), server)
+        self.assertEqual(server.weight, 2)
+        self.assertIs(registry.remove(server.id), server)
+        self.assertIsNone(registry.remove(server.id))
+        self.assertEqual(len(registry), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
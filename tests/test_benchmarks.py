@@ -0,0 +1,27 @@
+import unittest
+
+from benchmarks.compare import compare
+from benchmarks.report import fairness, percentile
+
+
+class TestBenchmarkReport(unittest.TestCase):
+    def test_percentile(self):
+        values = list(range(1, 1001))
+        self.assertEqual(percentile(values, 0.5), 500)
+        self.assertEqual(percentile(values, 0.99), 990)
+        self.assertEqual(percentile(values, 0.999), 999)
+        self.assertEqual(percentile([], 0.5), 0.0)
+
+    def test_fairness_is_weight_aware(self):
+        self.assertAlmostEqual(fairness([100, 200], [1, 2]), 1.0)
+        self.assertAlmostEqual(fairness([300, 0, 0], [1, 1, 1]), 1 / 3)
+
+    def test_compare_flags_regressions_by_direction(self):
+        baseline = {"results": {"requests_per_sec": 1000, "latency": {"p99_ms": 2.0}, "backends": {"a:1": 5}}}
+        current = {"results": {"requests_per_sec": 800, "latency": {"p99_ms": 1.0}, "backends": {"b:2": 5}}}
+        rows = {name: regressed for name, _, _, _, regressed in compare(baseline, current, 0.1)}
+        self.assertEqual(rows, {"latency.p99_ms": False, "requests_per_sec": True})
+
+
+if __name__ == '__main__':
+    unittest.main()
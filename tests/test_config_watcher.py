@@ -0,0 +1,38 @@
+import os
+import tempfile
+import unittest
+
+from src.config_watcher import ConfigWatcher
+
+
+class TestConfigWatcher(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".json")
+        os.write(fd, b"{}")
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+        self.changes = 0
+
+    def on_change(self):
+        self.changes += 1
+
+    def test_detects_replaced_file(self):
+        watcher = ConfigWatcher(self.path, self.on_change)
+        self.assertFalse(watcher.check())
+        with open(self.path + ".tmp", "w") as f:
+            f.write('{"listening_port": 8080}')
+        os.replace(self.path + ".tmp", self.path)
+        self.assertTrue(watcher.check())
+        self.assertFalse(watcher.check()) # Reported once per change
+        self.assertEqual(self.changes, 1)
+
+    def test_missing_file_is_not_a_change(self):
+        watcher = ConfigWatcher(self.path, self.on_change)
+        os.rename(self.path, self.path + ".moved")
+        self.addCleanup(os.rename, self.path + ".moved", self.path)
+        self.assertFalse(watcher.check())
+        self.assertEqual(self.changes, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
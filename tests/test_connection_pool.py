@@ -0,0 +1,103 @@
+import socket
+import threading
+import time
+import unittest
+
+from src.backend_server import BackendServer
+from src.connection_pool import ConnectionPool, PoolTimeout
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(50)
+        self.addCleanup(self.listener.close)
+        self.accepted = []
+        self.server = BackendServer(1, "127.0.0.1", self.listener.getsockname()[1])
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            self.accepted.append(conn)
+
+    def tearDown(self):
+        for conn in self.accepted:
+            conn.close()
+
+    def test_released_connection_is_reused(self):
+        pool = ConnectionPool()
+        sock = pool.acquire(self.server)
+        pool.release(self.server, sock, reusable=True)
+        self.assertIs(pool.acquire(self.server), sock)
+        self.assertEqual(pool.stats["created"], 1)
+        self.assertEqual(pool.stats["reused"], 1)
+        self.assertEqual(pool.reuse_rate(), 0.5)
+        pool.close()
+
+    def test_non_reusable_connection_is_closed(self):
+        pool = ConnectionPool()
+        sock = pool.acquire(self.server)
+        pool.release(self.server, sock)
+        self.assertEqual(sock.fileno(), -1)
+        self.assertEqual(pool.idle_count(self.server), 0)
+
+    def test_connection_closed_by_backend_is_discarded(self):
+        pool = ConnectionPool()
+        sock = pool.acquire(self.server)
+        pool.release(self.server, sock, reusable=True)
+        deadline = time.time() + 2
+        while not self.accepted and time.time() < deadline:
+            time.sleep(0.01)
+        self.accepted[0].close() # Backend drops the idle keep-alive connection
+        time.sleep(0.05)
+        self.assertIsNot(pool.acquire(self.server), sock)
+        self.assertEqual(pool.stats["discarded"], 1)
+        pool.close()
+
+    def test_idle_timeout(self):
+        pool = ConnectionPool(idle_timeout=0.01)
+        sock = pool.acquire(self.server)
+        pool.release(self.server, sock, reusable=True)
+        time.sleep(0.05)
+        self.assertIsNot(pool.acquire(self.server), sock)
+        self.assertEqual(pool.stats["expired"], 1)
+        pool.close()
+
+    def test_max_size_waits_then_times_out(self):
+        pool = ConnectionPool(max_size=1, wait_timeout=0.05)
+        sock = pool.acquire(self.server)
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(self.server)
+        self.assertEqual(pool.stats["waits"], 1)
+        self.assertEqual(pool.stats["timeouts"], 1)
+
+        threading.Timer(0.02, pool.release, args=(self.server, sock, True)).start()
+        pool.wait_timeout = 2
+        self.assertIs(pool.acquire(self.server), sock)
+        self.assertGreater(pool.stats["wait_time"], 0)
+        pool.close()
+
+    def test_drain_closes_idle_and_released_connections(self):
+        pool = ConnectionPool()
+        idle, in_use = pool.acquire(self.server), pool.acquire(self.server)
+        pool.release(self.server, idle, reusable=True)
+        pool.drain(self.server)
+        self.assertEqual(idle.fileno(), -1)
+        pool.release(self.server, in_use, reusable=True)
+        self.assertEqual(in_use.fileno(), -1)
+        self.assertEqual(pool.idle_count(self.server), 0)
+
+        pool.resume(self.server)
+        sock = pool.acquire(self.server)
+        pool.release(self.server, sock, reusable=True)
+        self.assertEqual(pool.idle_count(self.server), 1)
+        pool.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
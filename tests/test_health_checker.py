@@ -0,0 +1,135 @@
+import socket
+import threading
+import time
+import unittest
+
+from src.backend_server import BackendServer
+from src.health_checker import HealthChecker, probe_server, probe_servers
+from src.load_balancer import RoundRobinLoadBalancer
+from src.proxy_server import ProxyServer
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def listen(port=0):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", port))
+    sock.listen(50)
+    return sock
+
+
+class TestHealthChecker(unittest.TestCase):
+    def make_proxy(self, servers):
+        lb = RoundRobinLoadBalancer()
+        for server in servers:
+            lb.add_server(server)
+        return ProxyServer("127.0.0.1", 0, lb, servers)
+
+    def test_probe_server(self):
+        listener = listen()
+        self.addCleanup(listener.close)
+        reachable, latency, error = probe_server(BackendServer(1, "127.0.0.1", listener.getsockname()[1]))
+        self.assertTrue(reachable)
+        self.assertIsNotNone(latency)
+        self.assertIsNone(error)
+        reachable, _, error = probe_server(BackendServer(2, "127.0.0.1", free_port()))
+        self.assertFalse(reachable)
+        self.assertTrue(error)
+
+    def unresponsive(self):
+        # A listener whose accept queue is full: further connects hang until they time out
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.addCleanup(listener.close)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(0)
+        for _ in range(3):
+            filler = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.addCleanup(filler.close)
+            filler.setblocking(False)
+            filler.connect_ex(listener.getsockname())
+        time.sleep(0.1)
+        return listener.getsockname()[1]
+
+    def test_probe_servers_checks_all_at_once(self):
+        listener = listen()
+        self.addCleanup(listener.close)
+        servers = [BackendServer(1, "127.0.0.1", self.unresponsive()),
+                   BackendServer(2, "127.0.0.1", listener.getsockname()[1]),
+                   BackendServer(3, "127.0.0.1", free_port()),
+                   BackendServer(4, "127.0.0.1", self.unresponsive())]
+        started = time.monotonic()
+        results = probe_servers(servers, timeout=0.5)
+        self.assertLess(time.monotonic() - started, 0.9) # One timeout for both hung backends
+        self.assertEqual([result[0] for result in results], servers)
+        self.assertEqual([result[1] for result in results], [False, True, False, False])
+        self.assertEqual(results[0][3], "timed out")
+        self.assertGreater(results[1][2], 0)
+        self.assertEqual(results[2][3], "Connection refused")
+
+    def test_probe_servers_deadline(self):
+        servers = [BackendServer(i, "127.0.0.1", self.unresponsive()) for i in range(3)]
+        started = time.monotonic()
+        results = probe_servers(servers, timeout=5.0, deadline=0.3, max_in_flight=2)
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual([result[3] for result in results], ["timed out", "timed out", "deadline exceeded"])
+
+    def test_http_probe_checks_status(self):
+        listener = listen()
+        self.addCleanup(listener.close)
+
+        def answer():
+            conn, _ = listener.accept()
+            with conn:
+                conn.recv(1024)
+                conn.sendall(b"HTTP/1.1 500 Internal Server Error\r\nContent-Length: 0\r\n\r\n")
+        threading.Thread(target=answer, daemon=True).start()
+        server = BackendServer(1, "127.0.0.1", listener.getsockname()[1], protocol="http")
+        reachable, _, error = probe_server(server, http_path="/healthz")
+        self.assertFalse(reachable)
+        self.assertEqual(error, "HTTP 500")
+
+    def test_ejects_and_restores_backend(self):
+        up = listen()
+        self.addCleanup(up.close)
+        down_port = free_port()
+        healthy = BackendServer(1, "127.0.0.1", up.getsockname()[1])
+        dead = BackendServer(2, "127.0.0.1", down_port)
+        proxy = self.make_proxy([healthy, dead])
+        checker = HealthChecker(proxy, rise=2, fall=2)
+
+        checker.run_once()
+        self.assertIn(dead, proxy.load_balancer.servers) # One failure is below the fall threshold
+        checker.run_once()
+        self.assertNotIn(dead, proxy.load_balancer.servers)
+        self.assertFalse(checker.is_healthy(dead))
+        self.assertEqual([proxy.load_balancer.get_next_server() for _ in range(3)], [healthy] * 3)
+
+        revived = listen(down_port)
+        self.addCleanup(revived.close)
+        checker.run_once()
+        self.assertNotIn(dead, proxy.load_balancer.servers)
+        checker.run_once()
+        self.assertIn(dead, proxy.load_balancer.servers)
+        self.assertTrue(checker.is_healthy(dead))
+
+    def test_sync_reapplies_ejections_to_new_balancer(self):
+        dead = BackendServer(1, "127.0.0.1", free_port())
+        proxy = self.make_proxy([dead])
+        checker = HealthChecker(proxy, fall=1)
+        checker.run_once()
+        self.assertEqual(len(proxy.load_balancer.servers), 0)
+
+        reloaded = RoundRobinLoadBalancer()
+        reloaded.add_server(dead)
+        proxy.load_balancer = reloaded
+        checker.sync()
+        self.assertEqual(len(reloaded.servers), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
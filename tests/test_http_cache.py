@@ -0,0 +1,119 @@
+import threading
+import time
+import unittest
+
+from src.http_cache import HttpCache, ResponseCapture
+from src.http_parser import HttpParser, parse_head
+
+
+def request(target="/", headers=""):
+    return parse_head(f"GET {target} HTTP/1.1\r\nHost: test\r\n{headers}\r\n".encode(), is_response=False)
+
+
+def response(headers, status="200 OK"):
+    return parse_head(f"HTTP/1.1 {status}\r\n{headers}\r\n".encode(), is_response=True)
+
+
+class TestHttpCache(unittest.TestCase):
+    def test_freshness_and_staleness(self):
+        cache = HttpCache(stale_while_revalidate=5)
+        req = request()
+        key = cache.key(req)
+        self.assertTrue(cache.store(key, req, response("Cache-Control: max-age=10\r\nAge: 2\r\n"), b"ok", now=100))
+        self.assertEqual(cache.lookup(key, req, now=107)[1], "fresh")
+        self.assertEqual(cache.lookup(key, req, now=109)[1], "stale") # Served stale for 5s after max-age
+        self.assertEqual(cache.lookup(key, req, now=114), (None, None))
+        self.assertEqual(len(cache), 0) # Expired entries are dropped
+        self.assertEqual(cache.stats["misses"], 1)
+
+    def test_uncacheable_responses_and_requests(self):
+        cache = HttpCache()
+        req = request()
+        key = cache.key(req)
+        for headers in ("", "Cache-Control: no-store, max-age=60\r\n", "Cache-Control: private, max-age=60\r\n",
+                        "Cache-Control: max-age=60\r\nSet-Cookie: a=b\r\n", "Cache-Control: max-age=60\r\nVary: *\r\n"):
+            self.assertFalse(cache.store(key, req, response(headers), b"ok"), headers)
+        self.assertFalse(cache.store(key, req, response("Cache-Control: max-age=60\r\n", "500 Oops"), b""))
+        self.assertTrue(cache.store(key, req, response("Expires: Thu, 01 Jan 2099 00:00:00 GMT\r\n"), b"ok"))
+        self.assertFalse(HttpCache.cacheable_request(request(headers="Authorization: Basic eA==\r\n")))
+        self.assertFalse(HttpCache.cacheable_request(request(headers="Cache-Control: no-cache\r\n")))
+        self.assertFalse(HttpCache.cacheable_request(parse_head(b"POST / HTTP/1.1\r\nContent-Length: 1\r\n\r\n", False)))
+        self.assertTrue(HttpCache.cacheable_request(request()))
+
+    def test_lru_eviction_within_byte_budget(self):
+        cache = HttpCache(max_bytes=200)
+        head = response("Cache-Control: max-age=60\r\n")
+        for target in ("/a", "/b"):
+            cache.store(cache.key(request(target)), request(target), head, b"x" * 50)
+        cache.lookup(cache.key(request("/a")), request("/a")) # /b is now the least recently used
+        cache.store(cache.key(request("/c")), request("/c"), head, b"x" * 50)
+        self.assertEqual(cache.stats["evictions"], 1)
+        self.assertIsNone(cache.lookup(cache.key(request("/b")), request("/b"))[0])
+        self.assertIsNotNone(cache.lookup(cache.key(request("/a")), request("/a"))[0])
+        self.assertLessEqual(cache.size, 200)
+
+    def test_vary(self):
+        cache = HttpCache()
+        gzip = request(headers="Accept-Encoding: gzip\r\n")
+        key = cache.key(gzip)
+        cache.store(key, gzip, response("Cache-Control: max-age=60\r\nVary: Accept-Encoding\r\n"), b"ok")
+        self.assertIsNotNone(cache.lookup(key, gzip)[0])
+        self.assertIsNone(cache.lookup(key, request(headers="Accept-Encoding: br\r\n"))[0])
+
+    def test_response_bytes_age_and_not_modified(self):
+        cache = HttpCache()
+        req = request()
+        key = cache.key(req)
+        cache.store(key, req, response('Cache-Control: max-age=60\r\nETag: "v1"\r\nConnection: keep-alive\r\nContent-Length: 2\r\n'), b"ok", now=10)
+        entry, _ = cache.lookup(key, req, now=13)
+        self.assertEqual(cache.response_bytes(entry, req, now=13),
+                         b'HTTP/1.1 200 OK\r\nCache-Control: max-age=60\r\nETag: "v1"\r\nContent-Length: 2\r\nAge: 3\r\n\r\nok')
+        conditional = request(headers='If-None-Match: W/"v0", "v1"\r\nConnection: close\r\n')
+        self.assertEqual(cache.response_bytes(entry, conditional, now=13),
+                         b'HTTP/1.1 304 Not Modified\r\nETag: "v1"\r\nAge: 3\r\nConnection: close\r\n\r\n')
+        self.assertIn(b'If-None-Match: "v1"\r\n', cache.revalidation_head(req, entry))
+
+    def test_refresh_takes_directives_from_not_modified(self):
+        cache = HttpCache(stale_while_revalidate=5)
+        req = request()
+        key = cache.key(req)
+        cache.store(key, req, response('Cache-Control: max-age=60\r\nETag: "v1"\r\n'), b"ok", now=0)
+        cache.refresh(key, response("Cache-Control: max-age=0, must-revalidate\r\n", "304 Not Modified"), now=100)
+        self.assertEqual(cache.lookup(key, req, now=100), (None, None)) # Neither fresh nor servable stale
+        cache.store(key, req, response('Cache-Control: max-age=60\r\nETag: "v1"\r\n'), b"ok", now=0)
+        cache.refresh(key, response("Cache-Control: max-age=0\r\n", "304 Not Modified"), now=100)
+        self.assertEqual(cache.lookup(key, req, now=101)[1], "stale") # Revalidated on the next hit
+        cache.refresh(key, response("ETag: \"v1\"\r\n", "304 Not Modified"), now=200)
+        self.assertEqual(cache.lookup(key, req, now=201)[1], "stale") # No new directives: max-age=0 still holds
+
+    def test_capture_of_relayed_response(self):
+        parser = HttpParser(is_response=True)
+        parser.expect_response("GET")
+        capture = ResponseCapture(limit=1024)
+        for data in (b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n2\r\nok", b"\r\n0\r\n\r\n"):
+            capture.add(data, parser.feed(data))
+        self.assertTrue(capture.complete)
+        self.assertEqual(capture.body, b"2\r\nok\r\n0\r\n\r\n")
+        too_big = ResponseCapture(limit=10)
+        data = b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok"
+        too_big.add(data, HttpParser(is_response=True).feed(data))
+        self.assertIsNone(too_big.chunks)
+
+    def test_one_fetch_per_key(self):
+        cache = HttpCache(coalesce_timeout=2)
+        key = ("test", "/")
+        self.assertTrue(cache.begin_fetch(key))
+        self.assertFalse(cache.begin_fetch(key, wait=False))
+        waited = []
+        waiter = threading.Thread(target=lambda: waited.append(cache.begin_fetch(key)))
+        waiter.start()
+        while not cache.stats["coalesced"]: # Wait until it is blocked on the fetch
+            time.sleep(0.01)
+        cache.end_fetch(key)
+        waiter.join(2)
+        self.assertEqual(waited, [False])
+        self.assertTrue(cache.begin_fetch(key)) # Free again once the fetch ended
+
+
+if __name__ == '__main__':
+    unittest.main()
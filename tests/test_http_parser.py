@@ -0,0 +1,130 @@
+import unittest
+
+from src.http_parser import HttpParseError, HttpParser
+
+
+def kinds(events):
+    return [kind for kind, _ in events]
+
+
+def body(events):
+    return b"".join(bytes(value) for kind, value in events if kind == "data")
+
+
+class TestHttpParser(unittest.TestCase):
+    def test_request_without_body(self):
+        parser = HttpParser()
+        events = parser.feed(b"GET /index.html HTTP/1.1\r\nHost: example.com\r\n\r\n")
+        self.assertEqual(kinds(events), ["head", "end"])
+        head = events[0][1]
+        self.assertEqual(head.method, "GET")
+        self.assertEqual(head.target, "/index.html")
+        self.assertEqual(head.get_header("Host"), "example.com")
+        self.assertTrue(parser.is_idle)
+        self.assertEqual(parser.messages_completed, 1)
+
+    def test_content_length_split_across_reads(self):
+        parser = HttpParser()
+        events = parser.feed(b"POST / HTTP/1.1\r\nContent-")
+        events += parser.feed(b"Length: 5\r\n\r\nhel")
+        self.assertFalse(parser.is_idle)
+        events += parser.feed(b"loGET / HTTP/1.1\r\n\r\n")
+        self.assertEqual(kinds(events), ["head", "data", "data", "end", "head", "end"])
+        self.assertEqual(body(events), b"hello")
+        self.assertEqual(parser.messages_completed, 2)
+
+    def test_chunked_response(self):
+        parser = HttpParser(is_response=True)
+        parser.expect_response("GET")
+        wire = b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n4\r\nWiki\r\n5;ext=1\r\npedia\r\n0\r\nX-Trailer: 1\r\n\r\n"
+        events = []
+        for i in range(len(wire)): # Byte at a time exercises every partial state
+            events += parser.feed(wire[i:i + 1])
+        self.assertEqual(kinds(events)[-1], "end")
+        self.assertEqual(body(events), wire[wire.index(b"\r\n\r\n") + 4:])
+        self.assertTrue(parser.is_idle)
+
+    def test_head_and_no_content_responses_have_no_body(self):
+        parser = HttpParser(is_response=True)
+        parser.expect_response("HEAD")
+        parser.expect_response("GET")
+        events = parser.feed(b"HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nHTTP/1.1 204 No Content\r\n\r\n")
+        self.assertEqual(kinds(events), ["head", "end", "head", "end"])
+        self.assertEqual(parser.messages_completed, 2)
+
+    def test_interim_response_does_not_complete_exchange(self):
+        parser = HttpParser(is_response=True)
+        parser.expect_response("POST")
+        parser.feed(b"HTTP/1.1 100 Continue\r\n\r\n")
+        self.assertEqual(parser.messages_completed, 0)
+        parser.feed(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+        self.assertEqual(parser.messages_completed, 1)
+
+    def test_response_until_close(self):
+        parser = HttpParser(is_response=True)
+        parser.expect_response("GET")
+        events = parser.feed(b"HTTP/1.0 200 OK\r\n\r\npartial body")
+        self.assertEqual(kinds(events), ["head", "data"])
+        self.assertEqual(kinds(parser.close()), ["end"])
+        self.assertFalse(parser.keep_alive)
+
+    def test_keep_alive(self):
+        parser = HttpParser()
+        parser.feed(b"GET / HTTP/1.1\r\nConnection: close\r\n\r\n")
+        self.assertFalse(parser.keep_alive)
+        parser.feed(b"GET / HTTP/1.0\r\nConnection: keep-alive\r\n\r\n")
+        self.assertTrue(parser.keep_alive)
+
+    def test_upgrade_switches_to_tunnel(self):
+        parser = HttpParser(is_response=True)
+        parser.expect_response("GET")
+        events = parser.feed(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n\r\n\x81\x00")
+        self.assertTrue(parser.tunnel)
+        self.assertEqual(body(events), b"\x81\x00")
+        self.assertFalse(parser.is_idle)
+
+    def test_malformed_input(self):
+        with self.assertRaises(HttpParseError):
+            HttpParser().feed(b"\x16\x03\x01 not http\r\n\r\n")
+        with self.assertRaises(HttpParseError):
+            HttpParser().feed(b"POST / HTTP/1.1\r\nContent-Length: -1\r\n\r\n")
+
+    def test_ambiguous_framing_is_rejected(self):
+        for head in (b"Transfer-Encoding: chunked\r\nContent-Length: 5\r\n",
+                     b"Content-Length: 5\r\nContent-Length: 6\r\n",
+                     b"Content-Length: 5, 6\r\n",
+                     b"Transfer-Encoding: chunkedx\r\n",
+                     b"Transfer-Encoding: gzip, chunked, identity\r\n",
+                     b"Transfer-Encoding: chunked\r\nTransfer-Encoding: chunked\r\n",
+                     b"Transfer-Encoding: gzip\r\n",
+                     b"Content-Length: +5\r\n",
+                     b"Content-Length: 1_0\r\n",
+                     b"Content-Length: \x0b5\r\n",
+                     b"Content-Length: 5 5\r\n",
+                     b"Content-Length : 5\r\n",
+                     b"Transfer-Encoding\t: chunked\r\n",
+                     b" Content-Length: 5\r\n"):
+            with self.assertRaises(HttpParseError, msg=head):
+                HttpParser().feed(b"POST / HTTP/1.1\r\nHost: a\r\n" + head + b"\r\nhello")
+
+    def test_malformed_chunk_size_is_rejected(self):
+        for size in (b"1_0", b"0x5", b"+5", b"-1", b" 5", b"5 ", b"\t5", b"", b";ext", b"5 ;ext", b"1" * 17):
+            with self.assertRaises(HttpParseError, msg=size):
+                HttpParser().feed(b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n" + size + b"\r\nhello\r\n0\r\n\r\n")
+        events = HttpParser().feed(b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n5;ext=1\r\nhello\r\nA\nhelloworld\r\n0\r\n\r\n")
+        self.assertEqual(kinds(events)[-1], "end")
+
+    def test_unambiguous_framing_is_accepted(self):
+        for head in (b"Content-Length: 5\r\nContent-Length: 5\r\n",
+                     b"Content-Length:  5 \r\n",
+                     b"Transfer-Encoding: gzip, CHUNKED\r\n"):
+            events = HttpParser().feed(b"POST / HTTP/1.1\r\n" + head + b"\r\n" + (b"5\r\nhello\r\n0\r\n\r\n" if b"CHUNKED" in head else b"hello"))
+            self.assertEqual(kinds(events)[-1], "end", head)
+        parser = HttpParser(is_response=True)
+        parser.expect_response("GET")
+        events = parser.feed(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: gzip\r\n\r\nabc")
+        self.assertEqual(body(events), b"abc") # Responses not chunked last are read until close
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+
+from src.http_parser import parse_head
+from src.http_router import HttpRouter, Route
+
+
+def request(target, host="example.com"):
+    return parse_head(f"GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode(), is_response=False)
+
+
+class TestHttpRouter(unittest.TestCase):
+    def setUp(self):
+        self.router = HttpRouter.from_settings([
+            {"path_prefix": "/api/", "group": "api"},
+            {"path_prefix": "/api/v2/", "group": "api-v2"},
+            {"host": "Static.Example.com", "group": "static"},
+        ])
+
+    def test_longest_prefix_wins(self):
+        self.assertEqual(self.router.route(request("/api/v2/users")), "api-v2")
+        self.assertEqual(self.router.route(request("/api/v1/users")), "api")
+        self.assertIsNone(self.router.route(request("/index.html")))
+
+    def test_host_rules_before_any_host(self):
+        self.assertEqual(self.router.route(request("/api/x", host="static.example.com:8080")), "static")
+
+    def test_absolute_form_target(self):
+        self.assertEqual(self.router.route(request("http://example.com/api/x")), "api")
+
+    def test_empty_router_is_false(self):
+        self.assertFalse(HttpRouter())
+        self.assertTrue(HttpRouter([Route("api")]))
+
+
+if __name__ == '__main__':
+    unittest.main()
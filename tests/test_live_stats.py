@@ -0,0 +1,70 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from src.live_stats import FILE_HEADER, StatsPublisher, StatsWriter, create_stats_file, merge_slots, read_stats
+
+
+class TestLiveStats(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "magiclb.stats")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_and_read(self):
+        create_stats_file(self.path, slots=1, max_backends=4)
+        writer = StatsWriter(self.path)
+        writer.write("least_connections", 7, [(1, "10.0.0.1", 8000, True, 5, 120), (2, "10.0.0.2", 8000, None, 2, 30)])
+        (slot,) = read_stats(self.path)
+        self.assertEqual((slot["pid"], slot["sessions"], slot["algorithm"]), (os.getpid(), 7, "least_connections"))
+        self.assertEqual(slot["backends"][0], {"id": 1, "host": "10.0.0.1", "port": 8000, "health": "up", "active": 5, "requests": 120})
+        self.assertEqual(slot["backends"][1]["health"], "unknown")
+        writer.write("round_robin", 0, [(i, "h", i, False, 0, 0) for i in range(10)])
+        self.assertEqual(len(read_stats(self.path)[0]["backends"]), 4) # Capped at max_backends
+        writer.close()
+
+    def test_slots_are_merged_per_backend(self):
+        create_stats_file(self.path, slots=3, max_backends=4)
+        StatsWriter(self.path, 0).write("round_robin", 3, [(1, "a", 80, True, 2, 10), (2, "b", 80, True, 1, 5)])
+        StatsWriter(self.path, 1).write("round_robin", 1, [(1, "a", 80, False, 1, 4)])
+        slots = read_stats(self.path) # Slot 2 was never written
+        self.assertEqual([slot["slot"] for slot in slots], [0, 1])
+        merged = merge_slots(slots)
+        self.assertEqual([(b["host"], b["health"], b["active"], b["requests"]) for b in merged],
+                         [("a", "down", 3, 14), ("b", "up", 1, 5)])
+        with self.assertRaises(ValueError):
+            StatsWriter(self.path, 3)
+
+    def test_stopped_and_dead_writers_are_skipped(self):
+        create_stats_file(self.path, slots=2, max_backends=2)
+        publisher = StatsPublisher(StatsWriter(self.path, 0), lambda: ("round_robin", 1, [(1, "a", 80, True, 1, 1)]))
+        publisher.publish()
+        self.assertEqual(len(read_stats(self.path)), 1)
+        publisher.stop() # Clears its slot
+        self.assertEqual(read_stats(self.path), [])
+        writer = StatsWriter(self.path, 1)
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0)
+        os.waitpid(pid, 0)
+        writer.write("round_robin", 0, [], pid=pid) # Left behind by a process that is gone
+        self.assertEqual(read_stats(self.path), [])
+        writer.close()
+
+    def test_reader_skips_slot_mid_write(self):
+        create_stats_file(self.path, slots=1, max_backends=1)
+        writer = StatsWriter(self.path)
+        writer.write("round_robin", 0, [(1, "a", 80, True, 0, 0)])
+        with open(self.path, "r+b") as f: # Sequence number left odd, as by a writer mid-update
+            f.seek(FILE_HEADER.size)
+            f.write(struct.pack("<Q", 3))
+        self.assertEqual(read_stats(self.path, retries=3), [])
+        writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,14 @@
 
+import threading
+import time
 import unittest
-from src.load_balancer import RoundRobinLoadBalancer, WeightedRoundRobinLoadBalancer
+from src.http_parser import parse_head
+from src.load_balancer import (ALGORITHMS, LeastConnectionsLoadBalancer, LeastResponseTimeLoadBalancer, LoadBalancer,
+                               MaglevLoadBalancer, PowerOfTwoChoicesLoadBalancer, RoundRobinLoadBalancer,
+                               SmoothWeightedRoundRobinLoadBalancer, TieredLoadBalancer, WeightedRoundRobinLoadBalancer,
+                               affinity_key, load_plugins, register_algorithm)
 from src.backend_server import BackendServer
+from src.slow_start import SlowStart
 
 class TestLoadBalancer(unittest.TestCase):
     def test_round_robin(self):
@@ -31,6 +38,18 @@ class TestLoadBalancer(unittest.TestCase):
         self.assertEqual(lb.get_next_server(), server3) # Should skip server2 if index was 1 and reset to 0
         self.assertEqual(lb.get_next_server(), server2)
 
+    def test_generation_tracks_changes(self):
+        lb = WeightedRoundRobinLoadBalancer()
+        servers = [BackendServer(i, "127.0.0.1", 8000 + i, weight=1) for i in range(3)]
+        for server in servers:
+            lb.add_server(server)
+        self.assertEqual(lb.generation, 3)
+        self.assertEqual([lb.get_next_server() for _ in range(3)], servers)
+        lb.remove_server(BackendServer(1, "127.0.0.1", 8001, weight=1)) # An equal copy removes the live object
+        self.assertEqual(lb.generation, 4)
+        self.assertEqual(lb.servers, (servers[0], servers[2]))
+        self.assertEqual(sorted(lb.get_next_server().id for _ in range(4)), [0, 0, 2, 2]) # Schedule rebuilt
+
     def test_backend_server_attributes(self):
         server = BackendServer(1, "192.168.1.1", 9000, protocol="tcp", weight=5)
         self.assertEqual(server.id, 1)
@@ -67,5 +86,401 @@ class TestLoadBalancer(unittest.TestCase):
         self.assertNotIn(server1, lb.servers)
         self.assertEqual(lb.get_next_server(), server2) # Should be server2 as it's the only one left
 
+    def test_weighted_round_robin_full_cycle(self):
+        lb = WeightedRoundRobinLoadBalancer()
+        server1 = BackendServer(1, "127.0.0.1", 8001, weight=4)
+        server2 = BackendServer(2, "127.0.0.1", 8002, weight=2)
+        server3 = BackendServer(3, "127.0.0.1", 8003, weight=0)
+        for server in (server1, server2, server3):
+            lb.add_server(server)
+        picks = [lb.get_next_server() for _ in range(30)]
+        self.assertEqual(picks.count(server1), 20)
+        self.assertEqual(picks.count(server2), 10)
+        self.assertNotIn(server3, picks)
+
+    def test_smooth_weighted_round_robin(self):
+        lb = SmoothWeightedRoundRobinLoadBalancer()
+        server1 = BackendServer(1, "127.0.0.1", 8001, weight=10)
+        server2 = BackendServer(2, "127.0.0.1", 8002, weight=1)
+        lb.add_server(server1)
+        lb.add_server(server2)
+        picks = [lb.get_next_server() for _ in range(22)]
+        self.assertEqual(picks.count(server1), 20)
+        self.assertEqual(picks.count(server2), 2)
+        # server2's pick sits mid-cycle instead of after a run of ten server1 picks
+        self.assertEqual(picks.index(server2), 5)
+
+    def test_smooth_weighted_round_robin_rebuilds_on_change(self):
+        lb = SmoothWeightedRoundRobinLoadBalancer()
+        server1 = BackendServer(1, "127.0.0.1", 8001, weight=2)
+        server2 = BackendServer(2, "127.0.0.1", 8002, weight=1)
+        lb.add_server(server1)
+        self.assertEqual(lb.get_next_server(), server1)
+        lb.add_server(server2)
+        picks = [lb.get_next_server() for _ in range(6)]
+        self.assertEqual(picks.count(server2), 2)
+        lb.remove_server(server1)
+        self.assertEqual(lb.get_next_server(), server2)
+
+    def test_least_connections(self):
+        lb = LeastConnectionsLoadBalancer()
+        server1 = BackendServer(1, "127.0.0.1", 8001)
+        server2 = BackendServer(2, "127.0.0.1", 8002)
+        server3 = BackendServer(3, "127.0.0.1", 8003)
+        for server in (server1, server2, server3):
+            lb.add_server(server)
+
+        # Idle servers are used in turn
+        picked = [lb.get_next_server() for _ in range(3)]
+        self.assertEqual(picked, [server1, server2, server3])
+        for server in picked:
+            lb.on_connection_open(server)
+
+        # Server 2 frees up, so it takes the next two connections
+        lb.on_connection_close(server2)
+        self.assertEqual(lb.get_next_server(), server2)
+        lb.on_connection_open(server2)
+        lb.on_connection_close(server1)
+        lb.on_connection_close(server3)
+        self.assertIn(lb.get_next_server(), (server1, server3))
+
+    def test_least_connections_respects_weight(self):
+        lb = LeastConnectionsLoadBalancer()
+        heavy = BackendServer(1, "127.0.0.1", 8001, weight=3)
+        light = BackendServer(2, "127.0.0.1", 8002, weight=1)
+        lb.add_server(heavy)
+        lb.add_server(light)
+        picks = []
+        for _ in range(8):
+            server = lb.get_next_server()
+            lb.on_connection_open(server)
+            picks.append(server)
+        self.assertEqual(picks.count(heavy), 6)
+        self.assertEqual(picks.count(light), 2)
+
+    def test_least_connections_remove_server(self):
+        lb = LeastConnectionsLoadBalancer()
+        server1 = BackendServer(1, "127.0.0.1", 8001)
+        server2 = BackendServer(2, "127.0.0.1", 8002)
+        lb.add_server(server1)
+        lb.add_server(server2)
+        lb.remove_server(server1)
+        self.assertNotIn(server1, lb.servers)
+        self.assertEqual(lb.get_next_server(), server2)
+        lb.on_connection_close(server1) # Late close for a removed server is ignored
+        lb.remove_server(server2)
+        self.assertIsNone(lb.get_next_server())
+
+    def test_least_response_time(self):
+        lb = LeastResponseTimeLoadBalancer()
+        slow = BackendServer(1, "127.0.0.1", 8001)
+        fast = BackendServer(2, "127.0.0.1", 8002)
+        lb.add_server(slow)
+        lb.add_server(fast)
+        lb.record_response_time(slow, 0.5)
+        lb.record_response_time(fast, 0.01)
+
+        picks = []
+        for _ in range(10):
+            server = lb.get_next_server()
+            lb.on_connection_open(server)
+            picks.append(server)
+        self.assertGreater(picks.count(fast), picks.count(slow))
+        self.assertEqual(picks[0], fast)
+
+    def test_least_response_time_new_server_under_load(self):
+        lb = LeastResponseTimeLoadBalancer()
+        old = BackendServer(1, "127.0.0.1", 8001)
+        lb.add_server(old)
+        lb.record_response_time(old, 0.1)
+        new = BackendServer(2, "127.0.0.1", 8002)
+        lb.add_server(new) # No sample of its own yet: scored with the pool's mean
+        self.assertAlmostEqual(lb.response_times[id(new)], 0.1)
+        for _ in range(5):
+            lb.on_connection_open(new)
+        self.assertIs(lb.get_next_server(), old) # Its open connections count, unlike with a score of 0
+        lb.record_response_time(new, 0.02)
+        self.assertAlmostEqual(lb.response_times[id(new)], 0.02) # The first sample replaces the seed
+
+        fresh = LeastResponseTimeLoadBalancer() # No samples anywhere: least connections
+        a, b = BackendServer(1, "127.0.0.1", 8001), BackendServer(2, "127.0.0.1", 8002)
+        fresh.add_server(a)
+        fresh.add_server(b)
+        fresh.on_connection_open(a)
+        self.assertIs(fresh.get_next_server(), b)
+        fresh.record_response_time(a, 0.2)
+        self.assertAlmostEqual(fresh.response_times[id(b)], 0.2) # Seeded by the first sample
+
+    def test_least_response_time_ewma(self):
+        lb = LeastResponseTimeLoadBalancer(decay=0.5)
+        server = BackendServer(1, "127.0.0.1", 8001)
+        lb.add_server(server)
+        lb.record_response_time(server, 1.0)
+        lb.record_response_time(server, 0.0)
+        self.assertAlmostEqual(lb.response_times[id(server)], 0.5)
+
+    def test_concurrent_picks_are_evenly_distributed(self):
+        for lb_class in (RoundRobinLoadBalancer, WeightedRoundRobinLoadBalancer, SmoothWeightedRoundRobinLoadBalancer):
+            lb = lb_class()
+            servers = [BackendServer(i, "127.0.0.1", 8000 + i) for i in range(4)]
+            for server in servers:
+                lb.add_server(server)
+            counts = {server.id: 0 for server in servers}
+            counts_lock = threading.Lock()
+
+            def pick():
+                local = {server.id: 0 for server in servers}
+                for _ in range(5000):
+                    local[lb.get_next_server().id] += 1
+                with counts_lock:
+                    for server_id, count in local.items():
+                        counts[server_id] += count
+
+            threads = [threading.Thread(target=pick) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(set(counts.values()), {10000}, lb_class.__name__)
+
+    def test_picks_survive_concurrent_removal(self):
+        for lb_class in (RoundRobinLoadBalancer, WeightedRoundRobinLoadBalancer, LeastConnectionsLoadBalancer):
+            lb = lb_class()
+            servers = [BackendServer(i, "127.0.0.1", 8000 + i, weight=i % 3 + 1) for i in range(50)]
+            for server in servers:
+                lb.add_server(server)
+            errors = []
+
+            def pick():
+                try:
+                    for _ in range(5000):
+                        lb.get_next_server()
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=pick) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for server in servers[:-1]:
+                lb.remove_server(server)
+            for thread in threads:
+                thread.join()
+            self.assertEqual(errors, [], lb_class.__name__)
+            self.assertEqual(lb.get_next_server(), servers[-1])
+
+    def test_maglev_same_key_same_server(self):
+        lb = MaglevLoadBalancer(table_size=1031)
+        servers = [BackendServer(i, "10.0.0.1", 8000 + i) for i in range(5)]
+        for server in servers:
+            lb.add_server(server)
+        first = lb.get_server_for_key("192.168.1.10")
+        self.assertTrue(all(lb.get_server_for_key("192.168.1.10") is first for _ in range(10)))
+        picks = {id(lb.get_server_for_key(f"client-{i}")) for i in range(200)}
+        self.assertEqual(len(picks), 5)
+
+    def test_maglev_minimal_disruption(self):
+        lb = MaglevLoadBalancer()
+        servers = [BackendServer(i, "10.0.0.1", 8000 + i) for i in range(20)]
+        for server in servers:
+            lb.add_server(server)
+        keys = [f"10.1.{i // 256}.{i % 256}" for i in range(5000)]
+        before = {key: lb.get_server_for_key(key) for key in keys}
+        lb.remove_server(servers[7])
+        after = {key: lb.get_server_for_key(key) for key in keys}
+        moved = [key for key in keys if before[key] is not after[key]]
+        # Keys owned by the removed server must move; few others may
+        self.assertTrue(all(before[key] is not servers[7] for key in keys if key not in moved))
+        self.assertLess(len(moved) / len(keys), 2.0 / 20)
+
+    def test_maglev_respects_weight(self):
+        lb = MaglevLoadBalancer(table_size=10007)
+        heavy = BackendServer(1, "10.0.0.1", 8001, weight=3)
+        light = BackendServer(2, "10.0.0.1", 8002, weight=1)
+        lb.add_server(heavy)
+        lb.add_server(light)
+        picks = [lb.get_server_for_key(f"client-{i}") for i in range(4000)]
+        self.assertAlmostEqual(picks.count(heavy) / len(picks), 0.75, delta=0.05)
+
+    def test_affinity_key(self):
+        head = parse_head(b"GET / HTTP/1.1\r\nX-User: alice\r\nCookie: a=1; session=abc\r\n\r\n", is_response=False)
+        address = ("10.0.0.9", 50000)
+        self.assertEqual(affinity_key("client_ip", address, head), "10.0.0.9")
+        self.assertEqual(affinity_key("header:X-User", address, head), "alice")
+        self.assertEqual(affinity_key("cookie:session", address, head), "abc")
+        self.assertEqual(affinity_key("cookie:missing", address, head), "10.0.0.9")
+        self.assertEqual(affinity_key("header:X-User", address, None), "10.0.0.9")
+
+    def test_tiered_fails_over_below_min_healthy(self):
+        lb = TieredLoadBalancer([("primary", RoundRobinLoadBalancer, 2), ("backup", RoundRobinLoadBalancer, 1)])
+        primary = [BackendServer(i, "10.0.0.1", 8000 + i, group="primary") for i in range(3)]
+        backup = BackendServer(9, "10.0.0.2", 8000, group="backup")
+        for server in [backup] + primary:
+            lb.add_server(server)
+        self.assertEqual({lb.get_next_server().id for _ in range(6)}, {0, 1, 2})
+        lb.remove_server(primary[0]) # Two healthy left: still enough
+        self.assertEqual(lb.active_pool(), "primary")
+        lb.remove_server(primary[1])
+        self.assertEqual(lb.active_pool(), "backup")
+        self.assertEqual({lb.get_next_server().id for _ in range(4)}, {9})
+        lb.add_server(primary[1]) # Back in rotation
+        self.assertEqual(lb.active_pool(), "primary")
+        lb.remove_server(backup)
+        for server in primary[1:]:
+            lb.remove_server(server)
+        self.assertIsNone(lb.get_next_server())
+
+    def test_tiered_uses_any_pool_left_and_per_pool_algorithms(self):
+        lb = TieredLoadBalancer([("primary", RoundRobinLoadBalancer, 3), ("backup", LeastConnectionsLoadBalancer, 3)])
+        ungrouped = BackendServer(1, "10.0.0.1", 8001) # No group: joins the first pool
+        backup = [BackendServer(i, "10.0.0.2", 8000 + i, group="backup") for i in range(2)]
+        for server in [ungrouped] + backup:
+            lb.add_server(server)
+        self.assertEqual(lb.active_pool(), "primary") # No pool has 3; the first with any server serves
+        lb.remove_server(ungrouped)
+        self.assertEqual(lb.active_pool(), "backup")
+        lb.on_connection_open(backup[0])
+        self.assertEqual(lb.get_next_server(), backup[1]) # Least connections within the pool
+        self.assertEqual(len(lb.servers), 2)
+
+    def test_tiered_hash_key_follows_active_pool(self):
+        lb = TieredLoadBalancer([("primary", RoundRobinLoadBalancer, 1),
+                                 ("backup", lambda: MaglevLoadBalancer(hash_key="header:X-User"), 1)])
+        primary = BackendServer(1, "10.0.0.1", 8001, group="primary")
+        backup = [BackendServer(i, "10.0.0.2", 8000 + i, group="backup") for i in range(3)]
+        for server in [primary] + backup:
+            lb.add_server(server)
+        self.assertIsNone(lb.hash_key) # Round robin needs no key
+        lb.remove_server(primary)
+        self.assertEqual(lb.hash_key, "header:X-User")
+        picks = {lb.get_server_for_key("alice").id for _ in range(5)}
+        self.assertEqual(len(picks), 1) # The same user sticks to one backup server
+        lb.add_server(primary)
+        self.assertIsNone(lb.hash_key)
+
+    def test_power_of_two_choices_prefers_less_loaded(self):
+        lb = PowerOfTwoChoicesLoadBalancer()
+        busy = BackendServer(1, "10.0.0.1", 8001)
+        idle = BackendServer(2, "10.0.0.1", 8002)
+        self.assertIsNone(lb.get_next_server())
+        lb.add_server(busy)
+        self.assertIs(lb.get_next_server(), busy) # A single server needs no choice
+        lb.add_server(idle)
+        for _ in range(3):
+            lb.on_connection_open(busy)
+        self.assertEqual({lb.get_next_server().id for _ in range(20)}, {2}) # Two servers: always compared
+        lb.remove_server(busy)
+        lb.on_connection_close(busy) # Late close for a removed server is ignored
+        self.assertIs(lb.get_next_server(), idle)
+
+    def test_power_of_two_choices_spreads_load(self):
+        lb = PowerOfTwoChoicesLoadBalancer()
+        servers = [BackendServer(i, "10.0.0.1", 8000 + i) for i in range(10)]
+        for server in servers:
+            lb.add_server(server)
+        for _ in range(1000):
+            lb.on_connection_open(lb.get_next_server()) # Connections that never close
+        counts = sorted(lb.active_connections.values())
+        self.assertLessEqual(counts[-1] - counts[0], 10) # Random picks alone would spread far wider
+
+    def test_register_algorithm(self):
+        class CustomLoadBalancer(RoundRobinLoadBalancer):
+            pass
+        self.addCleanup(ALGORITHMS.pop, "custom", None)
+        self.assertIs(register_algorithm("custom")(CustomLoadBalancer), CustomLoadBalancer)
+        self.assertIs(ALGORITHMS["custom"], CustomLoadBalancer)
+        register_algorithm("custom", CustomLoadBalancer) # Registering again (e.g. on reload) is fine
+        with self.assertRaises(ValueError):
+            register_algorithm("custom", RoundRobinLoadBalancer)
+        with self.assertRaises(TypeError):
+            register_algorithm("not_a_balancer", object)
+        self.assertTrue(issubclass(ALGORITHMS["power_of_two_choices"], LoadBalancer))
+
+    def test_load_plugins_reports_bad_modules(self):
+        load_plugins(["json"])
+        with self.assertRaises(ValueError):
+            load_plugins(["no_such_module_for_magiclb"])
+
+    def test_slow_start_curves(self):
+        server = BackendServer(1, "10.0.0.1", 8001, weight=10)
+        linear = SlowStart(window=10.0, min_fraction=0.1, steps=10)
+        linear.begin(server, 100.0)
+        self.assertAlmostEqual(linear.weight(server, 100.0), 1.0)
+        self.assertAlmostEqual(linear.weight(server, 105.5), 5.5) # Held at the 50% step
+        self.assertEqual(linear.weight(server, 110.0), 10)
+        self.assertEqual(linear.next_step(102.5), 103.0)
+        self.assertIsNone(linear.next_step(110.0)) # Ramp over
+        exponential = SlowStart(window=10.0, curve="exponential", min_fraction=0.01, steps=2)
+        exponential.begin(server, 0.0)
+        self.assertAlmostEqual(exponential.fraction(server, 0.0), 0.01)
+        self.assertAlmostEqual(exponential.fraction(server, 5.0), 0.1)
+        with self.assertRaises(ValueError):
+            SlowStart(curve="cubic")
+
+    def test_slow_start_weighted_round_robin(self):
+        lb = WeightedRoundRobinLoadBalancer()
+        lb.slow_start = SlowStart(window=0.3, min_fraction=0.1, steps=1)
+        warm = BackendServer(1, "10.0.0.1", 8001, weight=10)
+        cold = BackendServer(2, "10.0.0.1", 8002, weight=10)
+        lb.add_server(warm)
+        lb.end_slow_start() # Loaded at startup: full weight at once
+        self.assertEqual(lb.get_next_server(), warm)
+        lb.add_server(cold)
+        picks = [lb.get_next_server().id for _ in range(110)]
+        self.assertEqual(picks.count(2), 10) # Weight 1 against 10
+        time.sleep(0.35)
+        picks = [lb.get_next_server().id for _ in range(100)]
+        self.assertEqual(picks.count(2), 50)
+        self.assertIsNone(lb._next_ramp_step) # Nothing left ramping: picks are back to the fast path
+
+    def test_slow_start_weight_one_servers(self):
+        for balancer in (WeightedRoundRobinLoadBalancer, SmoothWeightedRoundRobinLoadBalancer):
+            lb = balancer()
+            lb.slow_start = SlowStart(window=1.0, min_fraction=0.1, steps=2)
+            lb.add_server(BackendServer(1, "10.0.0.1", 8001))
+            lb.end_slow_start()
+            lb.add_server(BackendServer(2, "10.0.0.1", 8002))
+            picks = [lb.get_next_server().id for _ in range(110)]
+            self.assertEqual(picks.count(2), 10, balancer.__name__) # 0.1 against 1
+            time.sleep(0.55)
+            picks = [lb.get_next_server().id for _ in range(310)]
+            self.assertEqual(picks.count(2), 110, balancer.__name__) # 0.55 against 1, halfway through
+
+    def test_slow_start_steps_keep_the_schedule(self):
+        lb = SmoothWeightedRoundRobinLoadBalancer()
+        lb.slow_start = SlowStart(window=0.4, min_fraction=0.1, steps=2)
+        for i in range(3):
+            lb.add_server(BackendServer(i, "10.0.0.1", 8000 + i, weight=i + 1))
+        lb.end_slow_start()
+        lb.get_next_server()
+        schedule = lb._schedule_state[1]
+        lb.add_server(BackendServer(9, "10.0.0.2", 8000, weight=2))
+        lb.get_next_server()
+        self.assertIs(lb._schedule_state[1], schedule) # The joining server ramps outside it
+        time.sleep(0.25)
+        lb.get_next_server()
+        self.assertEqual(lb.ramp_steps, 1)
+        self.assertIs(lb._schedule_state[1], schedule) # A step only changes the ramping weights
+        time.sleep(0.2)
+        lb.get_next_server()
+        self.assertIsNone(lb._next_ramp_step)
+        self.assertEqual(len(lb._schedule_state[1]), 8) # Rebuilt once, with the server at full weight
+
+    def test_slow_start_least_connections(self):
+        lb = LeastConnectionsLoadBalancer()
+        lb.slow_start = SlowStart(window=0.3, min_fraction=0.25, steps=1)
+        warm = BackendServer(1, "10.0.0.1", 8001)
+        cold = BackendServer(2, "10.0.0.1", 8002)
+        lb.add_server(warm)
+        lb.end_slow_start()
+        lb.add_server(cold)
+        for _ in range(10):
+            lb.on_connection_open(lb.get_next_server())
+        self.assertEqual(lb.active_connections[id(cold)], 2) # A quarter of warm's share
+        time.sleep(0.35)
+        for _ in range(10):
+            lb.on_connection_open(lb.get_next_server())
+        self.assertEqual(lb.active_connections[id(cold)], 10) # Caught up once its ramp ended
+        self.assertEqual(lb.active_connections[id(warm)], 10)
+
 if __name__ == '__main__':
     unittest.main()
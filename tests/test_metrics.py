@@ -0,0 +1,73 @@
+import threading
+import unittest
+import urllib.request
+
+from src.connection_pool import ConnectionPool
+from src.metrics import MetricsRegistry, MetricsServer, ProxyMetrics
+
+
+class TestMetrics(unittest.TestCase):
+    def test_counter_sums_across_threads(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("requests_total", "Requests.", ("backend",))
+
+        def work():
+            for _ in range(1000):
+                counter.inc(("a",))
+            counter.inc(("b",), 5)
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.inc(("a",))
+        self.assertEqual(counter.collect(), {("a",): 8001, ("b",): 40})
+        self.assertEqual(len(counter._shards), 1) # Shards of finished threads were folded
+
+    def test_gauge(self):
+        gauge = MetricsRegistry().gauge("active", "Active.")
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        self.assertEqual(gauge.collect(), {(): 1})
+
+    def test_histogram_render(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram("latency_seconds", "Latency.", ("backend",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value, ("a:1",))
+        lines = registry.render().splitlines()
+        self.assertIn("# TYPE latency_seconds histogram", lines)
+        self.assertIn('latency_seconds_bucket{backend="a:1",le="0.1"} 2', lines)
+        self.assertIn('latency_seconds_bucket{backend="a:1",le="1"} 3', lines)
+        self.assertIn('latency_seconds_bucket{backend="a:1",le="+Inf"} 4', lines)
+        self.assertIn('latency_seconds_sum{backend="a:1"} 2.65', lines)
+        self.assertIn('latency_seconds_count{backend="a:1"} 4', lines)
+
+    def test_label_values_are_escaped(self):
+        registry = MetricsRegistry()
+        registry.counter("errors_total", "Errors.", ("type",)).inc(('say "hi"\n',))
+        self.assertIn('errors_total{type="say \\"hi\\"\\n"} 1', registry.render())
+
+    def test_pool_metrics(self):
+        metrics = ProxyMetrics()
+        pool = ConnectionPool()
+        metrics.watch_pool(pool)
+        pool.stats.update(created=1, reused=3, wait_time=0.25)
+        lines = metrics.registry.render().splitlines()
+        self.assertIn("# TYPE magiclb_pool_wait_seconds_total counter", lines)
+        self.assertIn("magiclb_pool_wait_seconds_total 0.25", lines)
+        self.assertIn("# TYPE magiclb_pool_reuse_ratio gauge", lines)
+        self.assertIn("magiclb_pool_reuse_ratio 0.75", lines)
+        pool.close()
+
+    def test_metrics_server(self):
+        registry = MetricsRegistry()
+        registry.counter("requests_total", "Requests.").inc()
+        server = MetricsServer(registry, port=0)
+        server.start()
+        self.addCleanup(server.stop)
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics", timeout=2) as response:
+            self.assertEqual(response.status, 200)
+            self.assertIn("requests_total 1", response.read().decode())
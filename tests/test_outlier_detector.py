@@ -0,0 +1,48 @@
+import unittest
+
+from src.backend_server import BackendServer
+from src.outlier_detector import OutlierDetector
+
+
+class TestOutlierDetector(unittest.TestCase):
+    def setUp(self):
+        self.servers = [BackendServer(i, "127.0.0.1", 8000 + i) for i in range(4)]
+
+    def test_ejects_after_consecutive_failures(self):
+        detector = OutlierDetector(consecutive_failures=3)
+        server = self.servers[0]
+        self.assertFalse(detector.record_failure(server, 4))
+        self.assertFalse(detector.record_failure(server, 4))
+        self.assertFalse(detector.is_ejected(server))
+        self.assertTrue(detector.record_failure(server, 4))
+        self.assertTrue(detector.is_ejected(server))
+        self.assertEqual(detector.ejected_count(), 1)
+
+    def test_success_resets_failures(self):
+        detector = OutlierDetector(consecutive_failures=2)
+        server = self.servers[0]
+        detector.record_failure(server, 4)
+        detector.record_success(server)
+        self.assertFalse(detector.record_failure(server, 4))
+        self.assertFalse(detector.is_ejected(server))
+
+    def test_ejection_time_backs_off(self):
+        detector = OutlierDetector(consecutive_failures=1, base_ejection_time=5.0, max_ejection_time=15.0)
+        server = self.servers[0]
+        state_times = []
+        for _ in range(3):
+            detector.record_failure(server, 4)
+            state = detector.states[detector.key(server)]
+            state_times.append(state.ejection_time)
+            state.ejected_until = 0.0 # End the ejection early
+        self.assertEqual(state_times, [5.0, 10.0, 15.0])
+
+    def test_max_ejection_percent(self):
+        detector = OutlierDetector(consecutive_failures=1, max_ejection_percent=50)
+        ejected = [detector.record_failure(server, len(self.servers)) for server in self.servers]
+        self.assertEqual(ejected, [True, True, False, False])
+        self.assertEqual(detector.ejected_count(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
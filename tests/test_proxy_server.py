@@ -0,0 +1,596 @@
+import os
+import socket
+import threading
+import time
+import unittest
+
+from src.access_log import AccessLog
+from src.admission import AdmissionController
+from src.backend_server import BackendServer
+from src.http_cache import HttpCache
+from src.http_parser import HttpParser
+from src.http_router import HttpRouter, Route
+from src.load_balancer import GroupedLoadBalancer, MaglevLoadBalancer, RoundRobinLoadBalancer
+from src.proxy_server import ProxyServer
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class EchoBackend:
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(50)
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._echo, args=(conn,), daemon=True).start()
+
+    def _echo(self, conn):
+        with conn:
+            while True:
+                try:
+                    data = conn.recv(65536)
+                except OSError:
+                    return
+                if not data:
+                    return
+                conn.sendall(data)
+
+    def close(self):
+        self.sock.close()
+
+
+class HttpBackend(EchoBackend):
+    # Minimal keep-alive HTTP/1.1 server answering every request with "ok"
+    def __init__(self):
+        self.connections = 0
+        self.requests = 0
+        self.bodies = [] # Body bytes of each request as received (chunk framing included)
+        self.heads = [] # Each request's HttpMessage
+        self.response = b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok"
+        self.delay = 0.0 # Seconds to wait before answering
+        super().__init__()
+
+    def _echo(self, conn):
+        self.connections += 1
+        parser = HttpParser()
+        body = b""
+        with conn:
+            while True:
+                try:
+                    data = conn.recv(65536)
+                except OSError:
+                    return
+                if not data:
+                    return
+                for kind, value in parser.feed(data):
+                    if kind == "head":
+                        self.heads.append(value)
+                    elif kind == "data":
+                        body += bytes(value)
+                    elif kind == "end":
+                        self.requests += 1
+                        self.bodies.append(body)
+                        body = b""
+                        time.sleep(self.delay)
+                        conn.sendall(self.response)
+
+
+class SilentBackend(EchoBackend):
+    # Reads requests and never answers them
+    def _echo(self, conn):
+        with conn:
+            while True:
+                try:
+                    data = conn.recv(65536)
+                except OSError:
+                    return
+                if not data:
+                    return
+
+
+def http_get(port, headers=b""):
+    with socket.create_connection(("127.0.0.1", port), timeout=2) as client:
+        client.sendall(b"GET / HTTP/1.1\r\nHost: test\r\n" + headers + b"\r\n")
+        response = b""
+        while not response.endswith(b"ok"):
+            data = client.recv(65536)
+            if not data:
+                break
+            response += data
+    return response
+
+
+def recv_all(sock, timeout=2.0):
+    sock.settimeout(timeout)
+    chunks = []
+    while True:
+        try:
+            data = sock.recv(65536)
+        except socket.timeout:
+            break
+        if not data:
+            break
+        chunks.append(data)
+    return b"".join(chunks)
+
+
+class ProxyServerSetupMixin:
+    # Builds and runs proxies for a test; stopped again in cleanup
+    engine = "threaded"
+    proxy_options = {} # ProxyServer arguments every proxy of the test case gets
+
+    def make_proxy(self, servers, lb=None, **kwargs):
+        lb = lb or RoundRobinLoadBalancer()
+        for server in servers:
+            lb.add_server(server)
+        return ProxyServer("127.0.0.1", free_port(), lb, servers, engine=self.engine, **{**self.proxy_options, **kwargs})
+
+    def run_proxy(self, proxy):
+        thread = threading.Thread(target=proxy.start, daemon=True)
+        thread.start()
+        deadline = time.time() + 5
+        while not proxy.running and time.time() < deadline:
+            time.sleep(0.01)
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(proxy.stop)
+        return proxy
+
+    def start_proxy(self, servers, lb=None, **kwargs):
+        return self.run_proxy(self.make_proxy(servers, lb, **kwargs))
+
+
+class ProxyServerTestMixin(ProxyServerSetupMixin):
+
+    def test_relays_data_to_backend(self):
+        backend = EchoBackend()
+        self.addCleanup(backend.close)
+        proxy = self.start_proxy([BackendServer(1, "127.0.0.1", backend.port, protocol="tcp")])
+
+        with socket.create_connection(("127.0.0.1", proxy.port), timeout=2) as client:
+            payload = b"x" * 200000
+            client.sendall(payload)
+            received = b""
+            while len(received) < len(payload):
+                data = client.recv(65536)
+                if not data:
+                    break
+                received += data
+        self.assertEqual(received, payload)
+
+    def test_no_servers_returns_503(self):
+        proxy = self.start_proxy([])
+        with socket.create_connection(("127.0.0.1", proxy.port), timeout=2) as client:
+            response = recv_all(client)
+        self.assertTrue(response.startswith(b"HTTP/1.1 503 Service Unavailable"))
+
+    def test_refused_backend_returns_503(self):
+        proxy = self.start_proxy([BackendServer(1, "127.0.0.1", free_port(), protocol="tcp")])
+        with socket.create_connection(("127.0.0.1", proxy.port), timeout=2) as client:
+            response = recv_all(client)
+        self.assertIn(b"Backend server refused connection.", response)
+
+    def test_retries_next_backend_when_one_is_down(self):
+        backend = HttpBackend()
+        self.addCleanup(backend.close)
+        dead = BackendServer(1, "127.0.0.1", free_port(), protocol="http")
+        proxy = self.start_proxy([dead, BackendServer(2, "127.0.0.1", backend.port, protocol="http")])
+
+        for _ in range(4):
+            self.assertTrue(http_get(proxy.port).endswith(b"ok"))
+        self.assertEqual(backend.requests, 4)
+        self.assertTrue(proxy.outlier_detector.is_ejected(dead))
+
+    def test_header_affinity(self):
+        backends = [HttpBackend() for _ in range(3)]
+        for backend in backends:
+            self.addCleanup(backend.close)
+        servers = [BackendServer(i, "127.0.0.1", backend.port, protocol="http") for i, backend in enumerate(backends)]
+        proxy = self.start_proxy(servers, MaglevLoadBalancer(hash_key="header:X-User"))
+
+        for _ in range(5):
+            self.assertTrue(http_get(proxy.port, b"X-User: alice\r\n").endswith(b"ok"))
+        self.assertEqual(sorted(backend.requests for backend in backends), [0, 0, 5])
+
+    def echo_proxy(self, backend_count=1, **admission):
+        backends = [EchoBackend() for _ in range(backend_count)]
+        for backend in backends:
+            self.addCleanup(backend.close)
+        servers = [BackendServer(i, "127.0.0.1", backend.port, protocol="tcp") for i, backend in enumerate(backends)]
+        return self.start_proxy(servers, admission=AdmissionController(**admission))
+
+    def open_echo(self, proxy):
+        client = socket.create_connection(("127.0.0.1", proxy.port), timeout=2)
+        self.addCleanup(client.close)
+        client.sendall(b"ping")
+        self.assertEqual(client.recv(1024), b"ping") # Admitted and relayed
+        return client
+
+    def test_rate_limit_rejects_with_429(self):
+        proxy = self.echo_proxy(rate=0.01, burst=2)
+        self.open_echo(proxy)
+        self.open_echo(proxy)
+        with socket.create_connection(("127.0.0.1", proxy.port), timeout=2) as client:
+            self.assertTrue(recv_all(client).startswith(b"HTTP/1.1 429 Too Many Requests"))
+        self.assertEqual(proxy.admission.stats["rate_limited"], 1)
+
+    def test_connection_cap_rejects_then_recovers(self):
+        proxy = self.echo_proxy(max_connections=1)
+        first = self.open_echo(proxy)
+        with socket.create_connection(("127.0.0.1", proxy.port), timeout=2) as client:
+            self.assertTrue(recv_all(client).startswith(b"HTTP/1.1 503 Service Unavailable"))
+        first.close()
+        deadline = time.time() + 2
+        while proxy.admission.active and time.time() < deadline:
+            time.sleep(0.01)
+        self.open_echo(proxy)
+
+    def test_queued_connection_admitted_when_slot_frees(self):
+        proxy = self.echo_proxy(max_connections=1, queue_timeout=5.0)
+        first = self.open_echo(proxy)
+        threading.Timer(0.2, first.close).start()
+        self.open_echo(proxy) # Waits for the first connection to end instead of being rejected
+        self.assertEqual(proxy.admission.stats["queued"], 1)
+
+    def test_queued_connections_do_not_block_accepts(self):
+        proxy = self.echo_proxy(max_connections=1, queue_timeout=5.0)
+        self.open_echo(proxy)
+        for _ in range(2):
+            client = socket.create_connection(("127.0.0.1", proxy.port), timeout=2)
+            self.addCleanup(client.close)
+        deadline = time.time() + 2
+        while proxy.admission.stats["queued"] < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(proxy.admission.stats["queued"], 2) # Both wait at once; the second was still accepted
+
+    def test_full_queue_rejects_with_503(self):
+        proxy = self.echo_proxy(max_connections=1, queue_timeout=5.0, max_queued=1)
+        self.open_echo(proxy)
+        waiting = socket.create_connection(("127.0.0.1", proxy.port), timeout=2)
+        self.addCleanup(waiting.close)
+        deadline = time.time() + 2
+        while proxy.admission.queued < 1 and time.time() < deadline:
+            time.sleep(0.01)
+        with socket.create_connection(("127.0.0.1", proxy.port), timeout=2) as client:
+            self.assertTrue(recv_all(client).startswith(b"HTTP/1.1 503 Service Unavailable")) # Not queued behind it
+        self.assertEqual((proxy.admission.stats["queued"], proxy.admission.stats["over_capacity"]), (1, 1))
+
+    def test_full_backends_are_skipped(self):
+        proxy = self.echo_proxy(backend_count=2, max_backend_connections=1)
+        self.open_echo(proxy)
+        self.open_echo(proxy) # Lands on the other backend
+        with socket.create_connection(("127.0.0.1", proxy.port), timeout=2) as client:
+            self.assertTrue(recv_all(client).startswith(b"HTTP/1.1 503 Service Unavailable"))
+
+    def timeout_proxy(self, **timeouts):
+        backend = EchoBackend()
+        self.addCleanup(backend.close)
+        return self.start_proxy([BackendServer(1, "127.0.0.1", backend.port, protocol="tcp")], **timeouts)
+
+    def assert_closed_within(self, client, seconds):
+        started = time.monotonic()
+        self.assertEqual(recv_all(client, seconds + 1), b"")
+        self.assertLess(time.monotonic() - started, seconds)
+
+    def test_idle_timeout_closes_silent_connection(self):
+        proxy = self.timeout_proxy(idle_timeout=0.3)
+        client = self.open_echo(proxy)
+        self.assert_closed_within(client, 2.0)
+        self.assertEqual(proxy.metrics.errors.collect(), {("idle_timeout",): 1})
+
+    def test_session_timeout_closes_busy_connection(self):
+        proxy = self.timeout_proxy(session_timeout=0.5, idle_timeout=0.3)
+        client = self.open_echo(proxy)
+        started = time.monotonic()
+        with self.assertRaises(OSError):
+            while time.monotonic() - started < 3.0: # Never idle, but the connection cannot last
+                client.sendall(b"ping")
+                if not client.recv(1024):
+                    raise ConnectionResetError
+                time.sleep(0.05)
+        self.assertLess(time.monotonic() - started, 2.0)
+        self.assertEqual(proxy.metrics.errors.collect(), {("session_timeout",): 1})
+
+    def test_stop_lets_open_connections_finish(self):
+        proxy = self.timeout_proxy(shutdown_timeout=5.0)
+        client = self.open_echo(proxy)
+        proxy.stop()
+        client.sendall(b"still relayed")
+        self.assertEqual(client.recv(1024), b"still relayed")
+        client.close()
+        deadline = time.time() + 3
+        while proxy._relaying and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(proxy._relaying) # Shut down as soon as the last connection ended
+
+    def test_stop_closes_connections_after_shutdown_timeout(self):
+        proxy = self.timeout_proxy(shutdown_timeout=0.3)
+        client = self.open_echo(proxy)
+        proxy.stop()
+        self.assert_closed_within(client, 2.0)
+
+
+class TestThreadedProxyServer(ProxyServerTestMixin, unittest.TestCase):
+    engine = "threaded"
+
+    def test_http_backend_connection_reused(self):
+        backend = HttpBackend()
+        self.addCleanup(backend.close)
+        proxy = self.start_proxy([BackendServer(1, "127.0.0.1", backend.port, protocol="http")])
+
+        for _ in range(3):
+            self.assertTrue(http_get(proxy.port).endswith(b"ok"))
+            time.sleep(0.1) # Let the handler thread return the connection to the pool
+        self.assertEqual(backend.connections, 1)
+        self.assertEqual(proxy.connection_pool.stats["reused"], 2)
+
+    def test_metrics_recorded(self):
+        backend = HttpBackend()
+        self.addCleanup(backend.close)
+        proxy = self.start_proxy([BackendServer(1, "127.0.0.1", backend.port, protocol="http")])
+        label = (f"127.0.0.1:{backend.port}",)
+
+        for _ in range(2):
+            self.assertTrue(http_get(proxy.port).endswith(b"ok"))
+        time.sleep(0.1)
+        metrics = proxy.metrics
+        self.assertEqual(metrics.requests.collect(), {label: 2})
+        self.assertEqual(metrics.active_connections.collect(), {label: 0})
+        self.assertGreater(metrics.bytes_received.collect()[label], 0)
+        self.assertEqual(sum(metrics.response_seconds.collect()[label][:-1]), 2) # Bucket counts; the last item is the sum
+        self.assertIn("magiclb_balancer_pick_seconds_count{algorithm=\"RoundRobinLoadBalancer\"} 2", metrics.registry.render())
+
+    def test_first_byte_timeout_returns_504(self):
+        backend = SilentBackend()
+        self.addCleanup(backend.close)
+        proxy = self.start_proxy([BackendServer(1, "127.0.0.1", backend.port, protocol="http")], first_byte_timeout=0.3)
+        with socket.create_connection(("127.0.0.1", proxy.port), timeout=2) as client:
+            client.sendall(b"GET / HTTP/1.1\r\nHost: test\r\n\r\n")
+            self.assertTrue(recv_all(client, 3.0).startswith(b"HTTP/1.1 504 Gateway Timeout"))
+        self.assertEqual(proxy.metrics.errors.collect(), {("first_byte_timeout",): 1})
+
+
+class TestAsyncioProxyServer(ProxyServerTestMixin, unittest.TestCase):
+    engine = "asyncio"
+
+    def test_many_concurrent_clients(self):
+        backend = EchoBackend()
+        self.addCleanup(backend.close)
+        proxy = self.start_proxy([BackendServer(1, "127.0.0.1", backend.port, protocol="tcp")])
+
+        clients = [socket.create_connection(("127.0.0.1", proxy.port), timeout=2) for _ in range(50)]
+        try:
+            for i, client in enumerate(clients):
+                client.sendall(f"hello {i}".encode())
+            for i, client in enumerate(clients):
+                self.assertEqual(client.recv(1024), f"hello {i}".encode())
+        finally:
+            for client in clients:
+                client.close()
+
+
+def read_responses(client, count):
+    response = b""
+    while response.count(b"ok") < count:
+        data = client.recv(65536)
+        if not data:
+            break
+        response += data
+    return response
+
+
+class TestHttpRequestMode(ProxyServerSetupMixin, unittest.TestCase):
+    proxy_options = {"http_mode": "request"}
+
+    def start_backends(self, count):
+        backends = [HttpBackend() for _ in range(count)]
+        for backend in backends:
+            self.addCleanup(backend.close)
+        return backends
+
+    def test_requests_on_one_connection_are_balanced(self):
+        backends = self.start_backends(2)
+        proxy = self.start_proxy([BackendServer(i, "127.0.0.1", backend.port) for i, backend in enumerate(backends)])
+
+        with socket.create_connection(("127.0.0.1", proxy.port), timeout=2) as client:
+            for _ in range(4):
+                client.sendall(b"GET / HTTP/1.1\r\nHost: test\r\n\r\n")
+                self.assertTrue(read_responses(client, 1).endswith(b"ok"))
+        self.assertEqual([backend.requests for backend in backends], [2, 2])
+        self.assertEqual([backend.connections for backend in backends], [1, 1]) # Pooled between requests
+
+    def test_pipelined_requests_and_bodies(self):
+        backends = self.start_backends(2)
+        proxy = self.start_proxy([BackendServer(i, "127.0.0.1", backend.port) for i, backend in enumerate(backends)])
+
+        with socket.create_connection(("127.0.0.1", proxy.port), timeout=2) as client:
+            client.sendall(b"POST /a HTTP/1.1\r\nHost: test\r\nContent-Length: 5\r\n\r\nhello"
+                           b"POST /b HTTP/1.1\r\nHost: test\r\nTransfer-Encoding: chunked\r\n\r\n3\r\nabc\r\n0\r\n\r\n"
+                           b"GET /c HTTP/1.1\r\nHost: test\r\n\r\n")
+            self.assertEqual(read_responses(client, 3).count(b"HTTP/1.1 200 OK"), 3)
+        self.assertEqual(sorted(backends[0].bodies + backends[1].bodies),
+                         [b"", b"3\r\nabc\r\n0\r\n\r\n", b"hello"])
+
+    def test_routes_by_host_and_path_prefix(self):
+        api, web, admin = self.start_backends(3)
+        servers = [BackendServer(1, "127.0.0.1", api.port, group="api"),
+                   BackendServer(2, "127.0.0.1", web.port, group="web"),
+                   BackendServer(3, "127.0.0.1", admin.port, group="admin")]
+        router = HttpRouter([Route("web", path_prefix="/"), Route("api", path_prefix="/api/"),
+                             Route("admin", host="admin.test")])
+        proxy = self.start_proxy(servers, GroupedLoadBalancer(RoundRobinLoadBalancer), router=router)
+
+        with socket.create_connection(("127.0.0.1", proxy.port), timeout=2) as client:
+            for target, host in [("/api/users", "test"), ("/", "test"), ("/api/x", "test"), ("/", "admin.test:8080")]:
+                client.sendall(f"GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+                self.assertTrue(read_responses(client, 1).endswith(b"ok"))
+        self.assertEqual((api.requests, web.requests, admin.requests), (2, 1, 1))
+
+    def test_malformed_request_gets_400(self):
+        backends = self.start_backends(1)
+        proxy = self.start_proxy([BackendServer(1, "127.0.0.1", backends[0].port)])
+        with socket.create_connection(("127.0.0.1", proxy.port), timeout=2) as client:
+            client.sendall(b"NONSENSE\r\n\r\n")
+            self.assertTrue(recv_all(client).startswith(b"HTTP/1.1 400 Bad Request"))
+
+    def test_first_byte_timeout_returns_504(self):
+        backend = SilentBackend()
+        self.addCleanup(backend.close)
+        proxy = self.start_proxy([BackendServer(1, "127.0.0.1", backend.port)], first_byte_timeout=0.3)
+        with socket.create_connection(("127.0.0.1", proxy.port), timeout=2) as client:
+            client.sendall(b"POST / HTTP/1.1\r\nHost: test\r\nContent-Length: 2\r\n\r\nhi")
+            self.assertTrue(recv_all(client, 3.0).startswith(b"HTTP/1.1 504 Gateway Timeout"))
+
+    def test_asyncio_engine_rejected(self):
+        with self.assertRaises(ValueError):
+            ProxyServer("127.0.0.1", 0, RoundRobinLoadBalancer(), [], engine="asyncio", http_mode="request")
+
+    def test_cache_answers_repeated_gets_without_backend(self):
+        backend, = self.start_backends(1)
+        backend.response = b"HTTP/1.1 200 OK\r\nCache-Control: max-age=60\r\nETag: \"v1\"\r\nContent-Length: 2\r\n\r\nok"
+        cache = HttpCache()
+        proxy = self.start_proxy([BackendServer(1, "127.0.0.1", backend.port)], cache=cache)
+
+        with socket.create_connection(("127.0.0.1", proxy.port), timeout=2) as client:
+            for _ in range(3):
+                client.sendall(b"GET /page HTTP/1.1\r\nHost: test\r\n\r\n")
+                self.assertTrue(read_responses(client, 1).endswith(b"ok"))
+            client.sendall(b"GET /page HTTP/1.1\r\nHost: test\r\nIf-None-Match: \"v1\"\r\nConnection: close\r\n\r\n")
+            self.assertTrue(recv_all(client).startswith(b"HTTP/1.1 304 Not Modified"))
+        self.assertEqual(backend.requests, 1)
+        self.assertEqual((cache.stats["hits"], cache.stats["misses"]), (3, 1))
+        self.assertIn("magiclb_cache_lookups_total{result=\"hit\"} 3", proxy.metrics.registry.render())
+
+    def test_cache_coalesces_concurrent_misses(self):
+        backend, = self.start_backends(1)
+        backend.response = b"HTTP/1.1 200 OK\r\nCache-Control: max-age=60\r\nContent-Length: 2\r\n\r\nok"
+        backend.delay = 0.3
+        proxy = self.start_proxy([BackendServer(1, "127.0.0.1", backend.port)], cache=HttpCache())
+        responses = []
+
+        def get():
+            responses.append(http_get(proxy.port))
+        threads = [threading.Thread(target=get) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(responses), 5)
+        self.assertTrue(all(response.endswith(b"ok") for response in responses))
+        self.assertEqual(backend.requests, 1)
+
+    def test_cache_serves_stale_while_revalidating(self):
+        backend, = self.start_backends(1)
+        backend.response = b"HTTP/1.1 200 OK\r\nCache-Control: max-age=0, stale-while-revalidate=60\r\nETag: \"v1\"\r\nContent-Length: 2\r\n\r\nok"
+        cache = HttpCache()
+        proxy = self.start_proxy([BackendServer(1, "127.0.0.1", backend.port)], cache=cache)
+        self.assertTrue(http_get(proxy.port).endswith(b"ok"))
+
+        backend.response = b"HTTP/1.1 304 Not Modified\r\nCache-Control: max-age=60\r\nETag: \"v1\"\r\n\r\n"
+        self.assertTrue(http_get(proxy.port).endswith(b"ok")) # Served stale
+        deadline = time.time() + 2
+        while not cache.stats["revalidated"] and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(cache.stats["revalidated"], 1)
+        self.assertEqual(backend.heads[-1].get_header("if-none-match"), '"v1"')
+        self.assertTrue(http_get(proxy.port).endswith(b"ok")) # Fresh again
+        self.assertEqual(backend.requests, 2)
+        self.assertEqual(cache.stats["stale_hits"], 1)
+
+    def test_cache_needs_request_mode(self):
+        with self.assertRaises(ValueError):
+            ProxyServer("127.0.0.1", 0, RoundRobinLoadBalancer(), [], cache=HttpCache())
+
+
+class TestProxyServerAccessLog(ProxyServerSetupMixin, unittest.TestCase):
+    def test_one_record_per_connection(self):
+        backend = EchoBackend()
+        self.addCleanup(backend.close)
+        log = AccessLog(os.devnull)
+        proxy = self.start_proxy([BackendServer(1, "127.0.0.1", backend.port, protocol="tcp")], access_log=log)
+
+        with socket.create_connection(("127.0.0.1", proxy.port), timeout=2) as client:
+            client.sendall(b"hello")
+            self.assertEqual(client.recv(1024), b"hello")
+        deadline = time.time() + 2
+        while not log._queue and time.time() < deadline:
+            time.sleep(0.01)
+        _, client_address, backend_name, outcome, _, bytes_in, bytes_out, requests = log._queue[0]
+        self.assertEqual(client_address[0], "127.0.0.1")
+        self.assertEqual(backend_name, f"127.0.0.1:{backend.port}")
+        self.assertEqual((outcome, bytes_in, bytes_out, requests), ("ok", 5, 5, 1))
+
+
+class TestProxyServerReload(ProxyServerSetupMixin, unittest.TestCase):
+    def test_update_servers_applies_only_the_diff(self):
+        servers = [BackendServer(i, "127.0.0.1", 9000 + i) for i in range(3)]
+        proxy = self.make_proxy(list(servers))
+        new = [BackendServer(0, "127.0.0.1", 9000), BackendServer(2, "127.0.0.1", 9002), BackendServer(3, "127.0.0.1", 9003)]
+
+        added, removed = proxy.update_servers(new)
+        self.assertEqual(added, [new[2]])
+        self.assertEqual(removed, [servers[1]])
+        self.assertIs(proxy.servers[0], servers[0]) # Unchanged backends keep their live objects
+        self.assertIs(proxy.servers[1], servers[2])
+        self.assertEqual(proxy.load_balancer.servers, (servers[0], servers[2], new[2]))
+
+    def test_update_servers_skips_unhealthy_additions(self):
+        proxy = self.make_proxy([])
+        server = BackendServer(1, "127.0.0.1", 9001)
+        proxy.update_servers([server], is_healthy=lambda s: False)
+        self.assertEqual(proxy.servers, [server])
+        self.assertEqual(proxy.load_balancer.servers, ())
+
+    def test_removed_backend_drains_then_closes(self):
+        backend = EchoBackend()
+        self.addCleanup(backend.close)
+        server = BackendServer(1, "127.0.0.1", backend.port, protocol="tcp")
+        proxy = self.start_proxy([server], drain_timeout=0.2)
+
+        with socket.create_connection(("127.0.0.1", proxy.port), timeout=2) as client:
+            client.sendall(b"before")
+            self.assertEqual(client.recv(1024), b"before")
+            proxy.update_servers([])
+            client.sendall(b"during") # The open connection keeps working while it drains
+            self.assertEqual(client.recv(1024), b"during")
+            self.assertEqual(recv_all(client), b"") # Closed once drain_timeout is up
+        self.assertEqual(proxy.load_balancer.servers, ())
+
+
+class TestProxyServerEngine(unittest.TestCase):
+    def test_unknown_engine_rejected(self):
+        with self.assertRaises(ValueError):
+            ProxyServer("127.0.0.1", 0, RoundRobinLoadBalancer(), [], engine="fibers")
+
+    def test_reuse_port_allows_shared_listener(self):
+        port = free_port()
+        proxies = [ProxyServer("127.0.0.1", port, RoundRobinLoadBalancer(), [], reuse_port=True) for _ in range(2)]
+        threads = [threading.Thread(target=proxy.start, daemon=True) for proxy in proxies]
+        for thread in threads:
+            thread.start()
+        deadline = time.time() + 5
+        while not all(proxy.running for proxy in proxies) and time.time() < deadline:
+            time.sleep(0.01)
+        try:
+            self.assertTrue(all(proxy.running for proxy in proxies))
+        finally:
+            for proxy in proxies:
+                proxy.stop()
+            for thread in threads:
+                thread.join(5)
+
+
+if __name__ == '__main__':
+    unittest.main()
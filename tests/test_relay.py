@@ -0,0 +1,75 @@
+import socket
+import threading
+import unittest
+
+from src.relay import SPLICE_AVAILABLE, relay, resolve_relay_mode
+
+
+class TestRelay(unittest.TestCase):
+    def run_relay(self, mode, payload, buffer_size=4096):
+        client, client_peer = socket.socketpair()
+        backend, backend_peer = socket.socketpair()
+        for sock in (client, client_peer, backend, backend_peer):
+            self.addCleanup(sock.close)
+        for sock in (client, backend):
+            sock.settimeout(10) # A stuck relay fails the test instead of hanging it
+
+        running = [True]
+        self.addCleanup(running.clear)
+        worker = threading.Thread(target=relay, args=(client_peer, backend_peer, lambda: running, mode, buffer_size), daemon=True)
+        worker.start()
+
+        # Backend echoes everything it receives back through the relay
+        def echo():
+            received = 0
+            while received < len(payload):
+                data = backend.recv(65536)
+                received += len(data)
+                backend.sendall(data)
+        threading.Thread(target=echo, daemon=True).start()
+
+        # Send while the echo comes back, so both directions are full at once
+        echoed = []
+        def read_echo():
+            length = 0
+            while length < len(payload):
+                data = client.recv(65536)
+                if not data:
+                    break
+                echoed.append(data)
+                length += len(data)
+        reader = threading.Thread(target=read_echo, daemon=True)
+        reader.start()
+        client.sendall(payload)
+        reader.join(10)
+        self.assertFalse(reader.is_alive())
+        client.shutdown(socket.SHUT_WR)
+        worker.join(5)
+        self.assertFalse(worker.is_alive())
+        return b"".join(echoed)
+
+    def test_buffer_relay(self):
+        payload = bytes(range(256)) * 2000
+        self.assertEqual(self.run_relay("buffer", payload), payload)
+
+    @unittest.skipUnless(SPLICE_AVAILABLE, "os.splice is not available")
+    def test_splice_relay(self):
+        payload = bytes(range(256)) * 2000
+        self.assertEqual(self.run_relay("splice", payload), payload)
+
+    def test_full_duplex(self):
+        # Far more than the socket buffers hold: the backend echoes while it still
+        # receives, so the relay has to keep reading one side while writing the other
+        payload = bytes(range(256)) * 16384
+        for mode in ("buffer", "splice") if SPLICE_AVAILABLE else ("buffer",):
+            self.assertEqual(self.run_relay(mode, payload), payload, mode)
+
+    def test_resolve_relay_mode(self):
+        self.assertIn(resolve_relay_mode("auto"), ("splice", "buffer"))
+        self.assertEqual(resolve_relay_mode("copy"), "copy")
+        with self.assertRaises(ValueError):
+            resolve_relay_mode("sendfile")
+
+
+if __name__ == '__main__':
+    unittest.main()
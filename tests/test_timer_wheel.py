@@ -0,0 +1,52 @@
+import threading
+import time
+import unittest
+
+from src.timer_wheel import TimerWheel
+
+
+class TestTimerWheel(unittest.TestCase):
+    def start_wheel(self, **kwargs):
+        wheel = TimerWheel(**kwargs)
+        wheel.start()
+        self.addCleanup(wheel.stop)
+        return wheel
+
+    def test_fires_in_deadline_order(self):
+        wheel = self.start_wheel(tick=0.01)
+        fired = []
+        done = threading.Event()
+        wheel.schedule(0.15, lambda: (fired.append("late"), done.set()))
+        wheel.schedule(0.05, lambda: fired.append("early"))
+        self.assertTrue(done.wait(2))
+        self.assertEqual(fired, ["early", "late"])
+        self.assertEqual(len(wheel), 0)
+
+    def test_cancelled_timer_never_fires(self):
+        wheel = self.start_wheel(tick=0.01)
+        fired = []
+        done = threading.Event()
+        timer = wheel.schedule(0.05, lambda: fired.append("cancelled"))
+        wheel.schedule(0.1, done.set)
+        wheel.cancel(timer)
+        self.assertTrue(done.wait(2))
+        self.assertEqual(fired, [])
+
+    def test_delay_longer_than_one_turn(self):
+        wheel = self.start_wheel(tick=0.01, slots=4) # One turn is 0.04s
+        done = threading.Event()
+        started = time.monotonic()
+        wheel.schedule(0.2, done.set)
+        self.assertTrue(done.wait(2))
+        self.assertGreaterEqual(time.monotonic() - started, 0.18)
+
+    def test_callback_errors_do_not_stop_the_wheel(self):
+        wheel = self.start_wheel(tick=0.01)
+        done = threading.Event()
+        wheel.schedule(0.02, lambda: 1 / 0)
+        wheel.schedule(0.05, done.set)
+        self.assertTrue(done.wait(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+
+from src.backend_server import StandInBackend
+from src.connection_pool import ConnectionPool
+from src.load_balancer import RoundRobinLoadBalancer
+from src.proxy_server import ProxyServer
+from src.tls import TlsTerminator, backend_context, server_context
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def recv_all(sock):
+    data = b""
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return data
+        data += chunk
+
+
+@unittest.skipUnless(shutil.which("openssl"), "needs the openssl command to create a test certificate")
+class TestTlsTermination(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.certfile = os.path.join(cls.directory, "cert.pem")
+        cls.keyfile = os.path.join(cls.directory, "key.pem")
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+                        "-nodes", "-keyout", cls.keyfile, "-out", cls.certfile, "-days", "1",
+                        "-subj", "/CN=localhost", "-addext", "subjectAltName=IP:127.0.0.1"],
+                       check=True, capture_output=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        self.client_context = ssl.create_default_context(cafile=self.certfile)
+
+    def start_backend(self, **kwargs):
+        backend = StandInBackend("http", **kwargs).start()
+        self.addCleanup(backend.stop)
+        return backend
+
+    def start_proxy(self, servers, engine="threaded", tls=True, connection_pool=None):
+        lb = RoundRobinLoadBalancer()
+        for server in servers:
+            lb.add_server(server)
+        terminator = TlsTerminator(server_context(self.certfile, self.keyfile), handshake_timeout=2.0) if tls else None
+        proxy = ProxyServer("127.0.0.1", free_port(), lb, servers, engine=engine, tls=terminator,
+                            connection_pool=connection_pool)
+        thread = threading.Thread(target=proxy.start, daemon=True)
+        thread.start()
+        deadline = time.time() + 5
+        while not proxy.running and time.time() < deadline:
+            time.sleep(0.01)
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(proxy.stop)
+        return proxy
+
+    def tls_get(self, port, session=None):
+        # Returns (response, TLS session, whether it was resumed)
+        with socket.create_connection(("127.0.0.1", port), timeout=2) as raw:
+            with self.client_context.wrap_socket(raw, server_hostname="127.0.0.1", session=session) as client:
+                client.sendall(b"GET / HTTP/1.1\r\nHost: test\r\n\r\n")
+                response = b""
+                while not response.endswith(b"xx"):
+                    data = client.recv(65536)
+                    if not data:
+                        break
+                    response += data
+                return response, client.session, client.session_reused
+
+    def check_termination(self, engine):
+        backend = self.start_backend()
+        proxy = self.start_proxy([backend.as_server(1)], engine=engine)
+
+        response, session, reused = self.tls_get(proxy.port)
+        self.assertTrue(response.startswith(b"HTTP/1.1 200 OK"))
+        self.assertFalse(reused)
+        response, _, reused = self.tls_get(proxy.port, session)
+        self.assertTrue(response.startswith(b"HTTP/1.1 200 OK"))
+        self.assertTrue(reused)
+        self.assertEqual(proxy.tls.handshakes.collect(), {("full",): 1, ("resumed",): 1})
+        self.assertIn("magiclb_tls_handshake_seconds_count{result=\"resumed\"} 1", proxy.metrics.registry.render())
+
+    def test_threaded_termination_and_resumption(self):
+        self.check_termination("threaded")
+
+    def test_asyncio_termination_and_resumption(self):
+        self.check_termination("asyncio")
+
+    def test_failed_handshake_is_counted(self):
+        backend = self.start_backend()
+        proxy = self.start_proxy([backend.as_server(1)])
+        with socket.create_connection(("127.0.0.1", proxy.port), timeout=2) as client:
+            client.sendall(b"GET / HTTP/1.1\r\n\r\n") # Plain HTTP to a TLS listener
+            try:
+                client.recv(1024)
+            except ConnectionResetError:
+                pass
+        deadline = time.time() + 2
+        while not proxy.tls.handshakes.collect() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(proxy.tls.handshakes.collect(), {("failed",): 1})
+        self.assertEqual(proxy.metrics.errors.collect(), {("tls_handshake",): 1})
+
+    def test_idle_clients_do_not_stall_handshakes(self):
+        backend = self.start_backend()
+        proxy = self.start_proxy([backend.as_server(1)])
+        proxy.tls.hello_timeout = 0.5
+        idle = []
+        for _ in range(50): # Far more than there used to be handshake threads
+            client = socket.create_connection(("127.0.0.1", proxy.port), timeout=2)
+            self.addCleanup(client.close)
+            idle.append(client)
+        started = time.monotonic()
+        response, _, _ = self.tls_get(proxy.port)
+        self.assertTrue(response.startswith(b"HTTP/1.1 200 OK"))
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(recv_all(idle[0]), b"") # Dropped once the hello_timeout passed
+        deadline = time.time() + 2
+        while proxy.tls.pending and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(proxy.tls.handshakes.collect(), {("full",): 1, ("failed",): 50})
+
+    def test_handshakes_beyond_max_pending_are_refused(self):
+        backend = self.start_backend()
+        proxy = self.start_proxy([backend.as_server(1)])
+        proxy.tls.max_pending = 1
+        idle = socket.create_connection(("127.0.0.1", proxy.port), timeout=2)
+        self.addCleanup(idle.close)
+        deadline = time.time() + 2
+        while not proxy.tls.pending and time.time() < deadline:
+            time.sleep(0.01)
+        with self.assertRaises((ssl.SSLError, OSError)):
+            self.tls_get(proxy.port)
+        self.assertEqual(proxy.tls.handshakes.collect(), {("refused",): 1})
+        self.assertEqual(proxy.admission.active, 1) # The refused client gave its slot back
+
+    def test_reencrypts_to_https_backends(self):
+        backend = self.start_backend(tls_context=server_context(self.certfile, self.keyfile))
+        pool = ConnectionPool(tls_context=backend_context(ca_file=self.certfile))
+        proxy = self.start_proxy([backend.as_server(1)], connection_pool=pool)
+
+        for _ in range(2):
+            response, _, _ = self.tls_get(proxy.port)
+            self.assertTrue(response.endswith(b"xx"))
+            time.sleep(0.1) # Let the handler return the backend connection to the pool
+        self.assertEqual(backend.requests, 2)
+        self.assertEqual(backend.connections, 1) # Pooled like a plain http backend
+        pool.close()
+        response, _, _ = self.tls_get(proxy.port)
+        self.assertTrue(response.endswith(b"xx"))
+        self.assertEqual(pool.stats["tls_resumed"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,17 @@
+import os
+import unittest
+
+from src.workers import resolve_worker_count
+
+
+class TestWorkers(unittest.TestCase):
+    def test_resolve_worker_count(self):
+        self.assertEqual(resolve_worker_count(4), 4)
+        self.assertEqual(resolve_worker_count("2"), 2)
+        self.assertEqual(resolve_worker_count("auto"), os.cpu_count() or 1)
+        with self.assertRaises(ValueError):
+            resolve_worker_count(-1)
+
+
+if __name__ == '__main__':
+    unittest.main()